@@ -0,0 +1,81 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Helpers shared by the benchmarks."""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).parents[1]
+MIGRATIONS = ROOT / "image-scripts" / "migrations"
+BENCHMARK_SCHEMA = "ldap_benchmark"
+
+# slapd's configuration is rendered the way the charm renders it.
+sys.path.insert(0, str(ROOT / "src"))
+import slapd_config  # noqa: E402
+
+
+def argument_parser(description):
+    """An argument parser with the options every benchmark takes."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--dsn", default=os.environ.get("POSTGRES_TEST_DSN", ""), help="libpq connection string")
+    return parser
+
+
+def create_schema(cur, until=None):
+    """Recreate the benchmark schema, applying the migrations before `until`."""
+    cur.execute(f"drop schema if exists {BENCHMARK_SCHEMA} cascade")
+    cur.execute(f"create schema {BENCHMARK_SCHEMA}")
+    cur.execute(f"set search_path to {BENCHMARK_SCHEMA}")
+    for migration in sorted(MIGRATIONS.glob("*.sql")):
+        if until is not None and migration.name >= until:
+            break
+        cur.execute(migration.read_text())
+
+
+def drop_schema(cur):
+    """Remove the benchmark schema and everything in it."""
+    cur.execute(f"drop schema if exists {BENCHMARK_SCHEMA} cascade")
+
+
+def latency_summary(timings):
+    """Summarise latencies in seconds as p50/p99 milliseconds."""
+    timings = sorted(timings)
+    return {
+        "p50_ms": round(statistics.median(timings) * 1000, 3),
+        "p99_ms": round(timings[max(int(len(timings) * 0.99) - 1, 0)] * 1000, 3),
+    }
+
+
+def docker(*args, **kwargs):
+    """Run a docker command, returning its output."""
+    return subprocess.run(["docker", *args], check=True, stdout=subprocess.PIPE, text=True, **kwargs).stdout.strip()
+
+
+def start_workload_container(image):
+    """Run the workload image with host networking, idle until slapd is started in it."""
+    return docker("run", "--detach", "--rm", "--network", "host", "--entrypoint", "sleep", image, "infinity")
+
+
+def configure_slapd(container, settings, admin_password):
+    """Render slapd's configuration into a workload container and convert it, as the charm does."""
+    settings = {**settings, "SLAPD_ROOTPW": slapd_config.hash_password(admin_password)}
+    files = slapd_config.render(settings, os.cpu_count(), admin_password)
+    with tempfile.TemporaryDirectory() as directory:
+        for path, content in files.items():
+            local = Path(directory) / Path(path).name
+            local.write_text(content)
+            docker("cp", str(local), f"{container}:{path}")
+    paths = (slapd_config.SLAPD_CONFIG_DIR, slapd_config.PCACHE_DIR, slapd_config.MDB_DIR)
+    docker("exec", container, "mkdir", "-p", *paths)
+    docker("exec", container, *slapd_config.SLAPTEST_COMMAND)
+
+
+def start_slapd(container):
+    """Start slapd in a configured workload container, as Pebble does."""
+    docker("exec", "--detach", container, "sh", "-c", slapd_config.slapd_command(0))
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Time the charm's hooks, dispatched through the Harness.
+
+Juju runs every hook as a new process, which imports the charm, builds
+it and dispatches a single event. Each sample here builds the charm in
+a new Harness as the leader of a deployment that is already up against
+a database, then times dispatching one event to it, as far as the end
+of hook commit: config-changed, update-status, db-relation-changed
+with a new primary or the get-admin-password action. Leadership settings
+start out unread, as in a new process, and the leader-get and leader-set
+calls each hook makes are counted; --hook-tool-ms makes each of them
+take as long as Juju's hook tools do. Building the charm and importing
+it in a new interpreter are timed too. Results are printed as JSON.
+
+    python3 benchmarks/hooks.py --hook-tool-ms 20
+"""
+
+import argparse
+import collections
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from unittest.mock import MagicMock, patch
+
+import common
+import yaml
+from ops import testing
+
+from charm import OpenLDAPK8sCharm
+from leadership import LeadershipSettings
+
+testing.SIMULATE_CAN_CONNECT = True
+
+PRIMARY = "host=10.0.0.{} port=5432 dbname=openldap user=ldap password=secret"
+EVENTS = ("config-changed", "update-status", "db-relation-changed", "get-admin-password")
+
+
+class HookTools:
+    """leader-get and leader-set, keeping the settings in memory and counting calls."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.settings = {}
+        self.calls = collections.Counter()
+
+    def check_output(self, cmd, *args, **kwargs):
+        self.calls[cmd[0]] += 1
+        time.sleep(self.latency)
+        if len(cmd) > 2:
+            return yaml.safe_dump(self.settings.get(cmd[2])).encode()
+        return yaml.safe_dump(self.settings).encode()
+
+    def check_call(self, cmd, *args, **kwargs):
+        self.calls[cmd[0]] += 1
+        time.sleep(self.latency)
+        for setting in cmd[1:]:
+            key, _, value = setting.partition("=")
+            if value:
+                self.settings[key] = value
+            else:
+                self.settings.pop(key, None)
+        return 0
+
+
+def new_process(charm):
+    """Forget what leadership settings and databases were read, as a new hook process would."""
+    LeadershipSettings._LeadershipSettings__cls_cache = None
+    charm._databases = None
+
+
+def deployed_charm():
+    """A Harness for the leader of a deployment that is up, with the workload configured."""
+    harness = testing.Harness(OpenLDAPK8sCharm)
+    relation_id = harness.add_relation("db", "postgresql")
+    harness.add_relation_unit(relation_id, "postgresql/0")
+    harness.update_relation_data(relation_id, "openldap-k8s", {"database": "openldap"})
+    harness.update_relation_data(relation_id, "postgresql/0", {"master": PRIMARY.format(1), "database": "openldap"})
+    harness.set_leader(True)
+    harness.begin()
+    for container in ("openldap", "pgbouncer"):
+        harness.set_can_connect(container, True)
+    relation = harness.model.get_relation("db", relation_id)
+    harness.charm.on.db_relation_joined.emit(relation, relation.app, next(iter(relation.units)))
+    harness.charm.on.config_changed.emit()
+    harness.framework.commit()
+    return harness, relation_id
+
+
+def dispatch(harness, relation_id, event, sample):
+    """Dispatch one event to a deployed charm, as a hook would, up to its commit."""
+    if event == "config-changed":
+        harness.charm.on.config_changed.emit()
+    elif event == "update-status":
+        harness.charm.on.update_status.emit()
+    elif event == "db-relation-changed":
+        harness.update_relation_data(relation_id, "postgresql/0", {"master": PRIMARY.format(sample % 250 + 2)})
+    else:
+        with patch.dict(os.environ, {"JUJU_ACTION_NAME": event}):
+            harness.charm.on.get_admin_password_action.emit()
+    harness.framework.commit()
+
+
+def time_hooks(event, samples, tools):
+    """Time dispatching an event to new charms, counting the hook tools each hook calls."""
+    timings = []
+    calls = collections.Counter()
+    for sample in range(samples):
+        harness, relation_id = deployed_charm()
+        new_process(harness.charm)
+        tools.calls.clear()
+        start = time.perf_counter()
+        dispatch(harness, relation_id, event, sample)
+        timings.append(time.perf_counter() - start)
+        calls.update(tools.calls)
+        harness.cleanup()
+    return {
+        **common.latency_summary(timings),
+        "leader_get_per_hook": calls["leader-get"] / samples,
+        "leader_set_per_hook": calls["leader-set"] / samples,
+    }
+
+
+def time_build(samples):
+    """Time building the charm and registering its observers."""
+    timings = []
+    for _ in range(samples):
+        harness = testing.Harness(OpenLDAPK8sCharm)
+        start = time.perf_counter()
+        harness.begin()
+        timings.append(time.perf_counter() - start)
+        harness.cleanup()
+    return common.latency_summary(timings)
+
+
+def time_import(samples):
+    """Time importing the charm in a new interpreter, less starting the interpreter."""
+    environment = {**os.environ, "PYTHONPATH": str(common.ROOT / "src")}
+
+    def run(code):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True, env=environment)
+        return time.perf_counter() - start
+
+    interpreter = statistics.median(run("pass") for _ in range(samples))
+    return round((statistics.median(run("import charm") for _ in range(samples)) - interpreter) * 1000, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", type=int, default=200, help="hooks dispatched for each event")
+    parser.add_argument("--hook-tool-ms", type=float, default=0, help="time each leader-get or leader-set takes")
+    parser.add_argument("--events", nargs="+", choices=EVENTS, default=list(EVENTS), help="events to dispatch")
+    args = parser.parse_args()
+
+    tools = HookTools(args.hook_tool_ms / 1000)
+    container_exec = MagicMock()
+    container_exec.return_value.wait_output.return_value = ("", "")
+    with patch("subprocess.check_output", tools.check_output), patch("subprocess.check_call", tools.check_call), patch(
+        "ops.testing._TestingPebbleClient.exec", container_exec
+    ), patch("ops.testing._TestingModelBackend.action_get", return_value={}, create=True), patch(
+        "ops.testing._TestingModelBackend.action_set", create=True
+    ):
+        results = {event: time_hooks(event, args.samples, tools) for event in args.events}
+        build = time_build(args.samples)
+    import_ms = time_import(min(args.samples, 20))
+
+    print(
+        json.dumps(
+            {
+                "samples": args.samples,
+                "hook_tool_ms": args.hook_tool_ms,
+                "import_ms": import_ms,
+                "build": build,
+                "events": results,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Drive concurrent LDAP bind, search, add and modify load at slapd with back-sql.
+
+Creates a throwaway database next to the one given by --dsn, applies the
+schema migrations and seeds people below ou=people through the default
+mappings they add. slapd is then run from the workload image against
+that database (or reached at --ldap-uri if it is already running), and
+each workload is run in turn by concurrent clients. Throughput and
+p50/p99 latencies are printed as JSON, to compare slapd.conf, odbc.ini
+or schema changes between runs.
+
+    docker build -t openldap-k8s-benchmark --build-arg DIST_RELEASE=20.04 --build-arg LDAP_VERSION=2.4.50 .
+    python3 benchmarks/ldap_load.py --dsn "host=localhost user=postgres password=..." --image openldap-k8s-benchmark
+"""
+
+import concurrent.futures
+import json
+import random
+import subprocess
+import time
+
+import common
+import ldap3
+import psycopg2
+import psycopg2.extensions
+
+DATABASE = "ldap_benchmark"
+ADMIN_DN = "cn=administrator,dc=example"
+ADMIN_PASSWORD = "benchmark"
+PEOPLE = "ou=people,dc=example"
+USER_PASSWORD = "secret"
+
+# The organization and unit above the people, stored through the default mappings.
+TREE = """
+insert into ldap_units (id, name) values (1, 'example'), (2, 'people');
+select setval('ldap_units_id_seq', 2);
+insert into ldap_entries (dn, oc_map_id, parent, keyval)
+    select 'dc=example', id, 0, 1 from ldap_oc_mappings where name = 'organization';
+insert into ldap_entries (dn, oc_map_id, parent, keyval)
+    select 'ou=people,dc=example', oc.id, parent.id, 2 from ldap_oc_mappings oc, ldap_entries parent
+    where oc.name = 'organizationalUnit' and parent.dn = 'dc=example';
+"""
+
+
+def database_dsn(dsn):
+    """The libpq connection string of the throwaway database."""
+    return psycopg2.extensions.make_dsn(dsn, dbname=DATABASE)
+
+
+def create_database(dsn, entries):
+    """Recreate the throwaway database with the back-sql schema and people."""
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"drop database if exists {DATABASE}")
+            cur.execute(f"create database {DATABASE}")
+    finally:
+        conn.close()
+
+    conn = psycopg2.connect(database_dsn(dsn))
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for migration in sorted(common.MIGRATIONS.glob("*.sql")):
+                cur.execute(migration.read_text())
+            cur.execute(TREE)
+            cur.execute(
+                "insert into ldap_people (uid, cn, sn, user_password) "
+                "select 'user' || n, 'User ' || n, 'User', %s from generate_series(1, %s) n",
+                (USER_PASSWORD, entries),
+            )
+            cur.execute(
+                "insert into ldap_entries (dn, oc_map_id, parent, keyval) "
+                "select 'uid=' || ldap_people.uid || ',ou=people,dc=example', oc.id, people.id, ldap_people.id "
+                "from ldap_people, ldap_oc_mappings oc, ldap_entries people "
+                "where oc.name = 'inetOrgPerson' and people.dn = 'ou=people,dc=example'"
+            )
+            cur.execute("analyze")
+    finally:
+        conn.close()
+
+
+def drop_database(dsn):
+    """Remove the throwaway database."""
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"drop database if exists {DATABASE}")
+    finally:
+        conn.close()
+
+
+def database_settings(dsn):
+    """The openldap service's settings for the throwaway database."""
+    params = psycopg2.extensions.parse_dsn(dsn)
+    return {
+        "POSTGRES_HOST": params.get("host", "localhost"),
+        "POSTGRES_PORT": params.get("port", "5432"),
+        "POSTGRES_NAME": DATABASE,
+        "POSTGRES_USER": params.get("user", "postgres"),
+        "POSTGRES_PASSWORD": params.get("password", ""),
+    }
+
+
+def start_slapd(image, dsn):
+    """Run the workload image against the throwaway database, returning the container id."""
+    container = common.start_workload_container(image)
+    try:
+        common.configure_slapd(container, database_settings(dsn), ADMIN_PASSWORD)
+        common.start_slapd(container)
+    except subprocess.CalledProcessError:
+        subprocess.run(["docker", "stop", container], check=False, stdout=subprocess.DEVNULL)
+        raise
+    return container
+
+
+def wait_for_slapd(uri, timeout=60):
+    """Wait until slapd answers searches through back-sql."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            conn = ldap3.Connection(ldap3.Server(uri), ADMIN_DN, ADMIN_PASSWORD, auto_bind=True)
+            conn.search(PEOPLE, "(objectClass=*)", search_scope=ldap3.BASE)
+            conn.unbind()
+            if conn.result["result"] == 0:
+                return
+        except ldap3.core.exceptions.LDAPException:
+            pass
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"slapd at {uri} did not become ready")
+        time.sleep(1)
+
+
+def run_operation(conn, workload, n, new_uid, rng):
+    """Run one operation of a workload against person `n`, returning whether it succeeded."""
+    if workload == "bind":
+        return conn.rebind(f"uid=user{n},{PEOPLE}", USER_PASSWORD)
+    if workload == "search":
+        return conn.search(PEOPLE, f"(uid=user{n})", attributes=["cn", "sn", "telephoneNumber"])
+    if workload == "add":
+        return conn.add(
+            f"uid={new_uid},{PEOPLE}",
+            "inetOrgPerson",
+            {"uid": new_uid, "cn": new_uid, "sn": "Load", "userPassword": USER_PASSWORD},
+        )
+    return conn.modify(
+        f"uid=user{n},{PEOPLE}", {"telephoneNumber": [(ldap3.MODIFY_REPLACE, [str(rng.randrange(10**9))])]}
+    )
+
+
+def run_client(uri, workload, entries, client, duration):
+    """Run one workload from one client for `duration` seconds, returning latencies and errors."""
+    rng = random.Random(client)
+    conn = ldap3.Connection(ldap3.Server(uri), ADMIN_DN, ADMIN_PASSWORD, auto_bind=True)
+    timings = []
+    errors = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        n = rng.randint(1, entries)
+        start = time.perf_counter()
+        try:
+            ok = run_operation(conn, workload, n, f"load{client}-{len(timings)}", rng)
+        except ldap3.core.exceptions.LDAPException:
+            ok = False
+        timings.append(time.perf_counter() - start)
+        if not ok:
+            errors += 1
+    conn.unbind()
+    return timings, errors
+
+
+def run_workload(uri, workload, entries, clients, duration):
+    """Run a workload from concurrent client processes and summarise it."""
+    with concurrent.futures.ProcessPoolExecutor(clients) as pool:
+        futures = [pool.submit(run_client, uri, workload, entries, client, duration) for client in range(clients)]
+        outcomes = [future.result() for future in futures]
+    timings = [timing for client_timings, _ in outcomes for timing in client_timings]
+    return {
+        "operations": len(timings),
+        "errors": sum(errors for _, errors in outcomes),
+        "operations_per_second": round(len(timings) / duration, 1),
+        **common.latency_summary(timings),
+    }
+
+
+def main():
+    parser = common.argument_parser(__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=10_000, help="number of people to seed")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent LDAP clients")
+    parser.add_argument("--duration", type=float, default=30, help="seconds each workload runs for")
+    parser.add_argument(
+        "--workloads",
+        nargs="+",
+        choices=["bind", "search", "add", "modify"],
+        default=["bind", "search", "add", "modify"],
+        help="workloads to run, in order",
+    )
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--image", help="workload image built from the dockerfile, run with host networking")
+    target.add_argument("--ldap-uri", help=f"a slapd already running against the {DATABASE} database")
+    args = parser.parse_args()
+
+    create_database(args.dsn, args.entries)
+    container = None
+    try:
+        if args.image:
+            container = start_slapd(args.image, args.dsn)
+        uri = args.ldap_uri or "ldap://localhost:389"
+        wait_for_slapd(uri)
+        results = {
+            workload: run_workload(uri, workload, args.entries, args.clients, args.duration)
+            for workload in args.workloads
+        }
+    finally:
+        if container:
+            subprocess.run(["docker", "stop", container], check=False, stdout=subprocess.DEVNULL)
+        drop_database(args.dsn)
+
+    print(
+        json.dumps(
+            {"entries": args.entries, "clients": args.clients, "duration": args.duration, "results": results},
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
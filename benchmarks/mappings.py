@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Compare the default back-sql mappings with a naive per-attribute layout.
+
+Applies the schema migrations to a scratch schema, seeds people and
+posix groups through the default mappings they add, and copies the same
+values into a naive layout: one attribute-value table per key table,
+each single valued attribute read by its own correlated subquery and
+each multi valued one joined without a covering index, the way mappings
+are often written by hand. The data table side of the queries back-sql
+issues is then timed for both: reading every attribute of an entry, one
+query per attribute, equality filters on uid and memberUid, and adding
+a person or a group member through create_proc and add_proc. Results
+are printed as JSON.
+
+    python3 benchmarks/mappings.py --dsn "host=localhost user=postgres"
+"""
+
+import json
+import random
+import time
+
+import common
+import psycopg2
+
+# Attributes compared case insensitively, through upper_func.
+CASE_IGNORE = {"uid", "cn", "sn", "givenName", "displayName", "mail", "employeeNumber", "description"}
+MULTI_VALUED = {"memberUid", "member"}
+
+NAIVE_LAYOUT = """
+create table naive_people (id serial primary key);
+create table naive_person_attributes (person_id integer not null, name varchar(64), value varchar(1024));
+create index on naive_person_attributes (person_id);
+create table naive_groups (id serial primary key);
+create table naive_group_attributes (group_id integer not null, name varchar(64), value varchar(1024));
+create index on naive_group_attributes (group_id);
+-- Logging changes for pcache-invalidator.py, like the default tables do
+-- while the cache is enabled.
+create trigger naive_people_log_change after insert or update or delete on naive_people
+    for each row execute procedure ldap_log_data_change('inetOrgPerson', 'id');
+create trigger naive_person_attributes_log_change after insert or update or delete on naive_person_attributes
+    for each row execute procedure ldap_log_data_change('inetOrgPerson', 'person_id');
+create trigger naive_groups_log_change after insert or update or delete on naive_groups
+    for each row execute procedure ldap_log_data_change('posixGroup', 'id');
+create trigger naive_group_attributes_log_change after insert or update or delete on naive_group_attributes
+    for each row execute procedure ldap_log_data_change('posixGroup', 'group_id');
+"""
+
+NAIVE_TABLES = {
+    "inetOrgPerson": ("naive_people", "naive_person_attributes", "person_id"),
+    "posixGroup": ("naive_groups", "naive_group_attributes", "group_id"),
+}
+
+# What each layout runs for adding a person with these attributes, and a member to a group.
+ADDED_ATTRIBUTES = ("uid", "cn", "sn", "mail")
+
+
+class Mapping:
+    """An object class mapping, with its attribute mappings by name."""
+
+    def __init__(self, keytbl, keycol, create_proc):
+        self.keytbl = keytbl
+        self.keycol = keycol
+        self.create_proc = create_proc
+        # name: (sel_expr, sel_expr_u, from_tbls, join_where, add_proc)
+        self.attributes = {}
+
+    def attribute_query(self, name):
+        """The query back-sql reads an attribute's values of an entry with."""
+        sel_expr, _, from_tbls, join_where, _ = self.attributes[name]
+        query = f"select {sel_expr} from {from_tbls} where {self.keytbl}.{self.keycol} = %s"
+        if join_where:
+            query += f" and {join_where}"
+        return query
+
+    def filter_query(self, name):
+        """The data table side of the query back-sql finds entries by an attribute value with."""
+        sel_expr, sel_expr_u, from_tbls, join_where, _ = self.attributes[name]
+        if name in CASE_IGNORE:
+            condition = f"{sel_expr_u or f'upper({sel_expr})'} = upper(%s)"
+        else:
+            condition = f"{sel_expr} = %s"
+        query = f"select distinct {self.keytbl}.{self.keycol} from {from_tbls} where {condition}"
+        if join_where:
+            query += f" and {join_where}"
+        return query
+
+
+def default_mappings(cur):
+    """Load the default mappings added by the migrations."""
+    cur.execute(
+        "select oc.name, oc.keytbl, oc.keycol, oc.create_proc, am.name, am.sel_expr, am.sel_expr_u, am.from_tbls, "
+        "am.join_where, am.add_proc from ldap_oc_mappings oc join ldap_attr_mappings am on am.oc_map_id = oc.id "
+        "where oc.name in %s",
+        (tuple(NAIVE_TABLES),),
+    )
+    mappings = {}
+    for oc_name, keytbl, keycol, create_proc, name, *attribute in cur.fetchall():
+        mapping = mappings.setdefault(oc_name, Mapping(keytbl, keycol, create_proc))
+        mapping.attributes[name] = tuple(attribute)
+    return mappings
+
+
+def naive_mappings(mappings):
+    """Map the same attributes to the naive layout."""
+    naive = {}
+    for oc_name, mapping in mappings.items():
+        keytbl, values, key = NAIVE_TABLES[oc_name]
+        naive[oc_name] = Mapping(keytbl, "id", f"insert into {keytbl} default values returning id")
+        for name in mapping.attributes:
+            add_proc = f"insert into {values} (name, value, {key}) values ('{name}', %s, %s)"
+            if name in MULTI_VALUED:
+                attribute = (
+                    f"{values}.value",
+                    None,
+                    f"{keytbl}, {values}",
+                    f"{values}.{key} = {keytbl}.id and {values}.name = '{name}'",
+                    add_proc,
+                )
+            else:
+                subquery = f"(select value from {values} where {values}.{key} = {keytbl}.id and name = '{name}')"
+                attribute = (subquery, None, keytbl, None, add_proc)
+            naive[oc_name].attributes[name] = attribute
+    return naive
+
+
+def seed(cur, people, groups, members):
+    """Seed both layouts with the same people and groups."""
+    cur.execute(
+        "insert into ldap_people (uid, cn, sn, given_name, mail, uid_number, gid_number, home_directory, "
+        "login_shell, user_password) "
+        "select 'user' || n, 'User ' || n, 'User', 'Test', 'user' || n || '@example.com', 10000 + n, 10000, "
+        "'/home/user' || n, '/bin/bash', 'secret' from generate_series(1, %s) n",
+        (people,),
+    )
+    cur.execute(
+        "insert into ldap_groups (cn, gid_number) select 'group' || n, 20000 + n from generate_series(1, %s) n",
+        (groups,),
+    )
+    cur.execute(
+        "insert into ldap_group_member_uids (group_id, member_uid) "
+        "select g, 'user' || ((g * %s + m) %% %s + 1) from generate_series(1, %s) g, generate_series(1, %s) m",
+        (members, people, groups, members),
+    )
+    cur.execute(NAIVE_LAYOUT)
+    cur.execute("select ldap_set_entry_change_log(false)")
+    mappings = default_mappings(cur)
+    for oc_name, mapping in mappings.items():
+        keytbl, values, key = NAIVE_TABLES[oc_name]
+        cur.execute(f"insert into {keytbl} (id) select {mapping.keycol} from {mapping.keytbl}")
+        cur.execute(f"select setval(pg_get_serial_sequence('{keytbl}', 'id'), max(id)) from {keytbl}")
+        for name, (sel_expr, _, from_tbls, join_where, _) in mapping.attributes.items():
+            query = (
+                f"insert into {values} ({key}, name, value) "
+                f"select {mapping.keytbl}.{mapping.keycol}, '{name}', {sel_expr} from {from_tbls} "
+                f"where {sel_expr} is not null"
+            )
+            if join_where:
+                query += f" and {join_where}"
+            cur.execute(query)
+    # Both layouts are measured logging their changes, as with the cache enabled.
+    cur.execute("select ldap_set_entry_change_log(true)")
+    cur.execute("analyze")
+    return mappings
+
+
+def timed(cur, statements):
+    """Run statements, returning how long they took in seconds."""
+    start = time.perf_counter()
+    for query, params in statements:
+        cur.execute(query, params)
+        if cur.description:
+            cur.fetchall()
+    return time.perf_counter() - start
+
+
+def add_person(cur, person, n):
+    """Add a person the way back-sql does: create_proc, then add_proc for each value."""
+    cur.execute(person.create_proc)
+    keyval = cur.fetchone()[0]
+    for name in ADDED_ATTRIBUTES:
+        cur.execute(person.attributes[name][4].replace("?", "%s"), (f"added{n}", keyval))
+
+
+def measure(cur, mappings, people, groups, iterations):
+    """Time each workload against random targets."""
+    rng = random.Random(42)
+    person, group = mappings["inetOrgPerson"], mappings["posixGroup"]
+    add_member = group.attributes["memberUid"][4].replace("?", "%s")
+    workloads = {
+        "read-person": lambda n: [
+            (person.attribute_query(name), (keyval,))
+            for keyval in [rng.randint(1, people)]
+            for name in person.attributes
+        ],
+        "read-group": lambda n: [
+            (group.attribute_query(name), (keyval,)) for keyval in [rng.randint(1, groups)] for name in group.attributes
+        ],
+        "filter-uid": lambda n: [(person.filter_query("uid"), (f"USER{rng.randint(1, people)}",))],
+        "filter-memberuid": lambda n: [(group.filter_query("memberUid"), (f"user{rng.randint(1, people)}",))],
+        "add-member": lambda n: [(add_member, (f"added{n}", rng.randint(1, groups)))],
+    }
+    results = {
+        name: common.latency_summary([timed(cur, statements(n)) for n in range(iterations)])
+        for name, statements in workloads.items()
+    }
+    timings = []
+    for n in range(iterations):
+        start = time.perf_counter()
+        add_person(cur, person, n)
+        timings.append(time.perf_counter() - start)
+    results["add-person"] = common.latency_summary(timings)
+    return results
+
+
+def main():
+    parser = common.argument_parser(__doc__.splitlines()[0])
+    parser.add_argument("--people", type=int, default=100_000, help="number of people to seed")
+    parser.add_argument("--groups", type=int, default=1000, help="number of posix groups to seed")
+    parser.add_argument("--members", type=int, default=100, help="members of each group")
+    parser.add_argument("--iterations", type=int, default=1000, help="times each workload is run")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            common.create_schema(cur)
+            mappings = seed(cur, args.people, args.groups, args.members)
+            default = measure(cur, mappings, args.people, args.groups, args.iterations)
+            naive = measure(cur, naive_mappings(mappings), args.people, args.groups, args.iterations)
+            common.drop_schema(cur)
+    finally:
+        conn.close()
+
+    print(
+        json.dumps(
+            {"people": args.people, "groups": args.groups, "members": args.members, "default": default, "naive": naive},
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
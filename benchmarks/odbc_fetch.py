@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Measure a large back-sql subtree search through psqlODBC at different fetch sizes.
+
+Seeds a scratch schema with entries under a single organizational unit,
+then runs the subtree query back-sql issues for it through the PostgreSQL
+Unicode ODBC driver, once without cursors and once with UseDeclareFetch
+for each fetch size. Needs unixODBC and the odbc-postgresql driver, as
+installed in the workload image. Results are printed as JSON.
+
+    python3 benchmarks/odbc_fetch.py --dsn "host=localhost user=postgres" --fetch-sizes 99 1000 10000
+"""
+
+import json
+import time
+
+import common
+import psycopg2
+import psycopg2.extensions
+import pyodbc
+
+SUBTREE_QUERY = (
+    "select ldap_entries.id, ldap_entries.keyval, ldap_entries.oc_map_id, ldap_entries.dn "
+    "from ldap_entries where upper(ldap_entries.dn) like upper(?)"
+)
+
+
+def seed(cur, entries):
+    """Add an organizational unit with `entries` people below it."""
+    common.create_schema(cur)
+    cur.execute("select name, id from ldap_oc_mappings")
+    oc_map_ids = dict(cur.fetchall())
+    cur.execute(
+        "insert into ldap_entries (id, dn, oc_map_id, parent, keyval) values (1, 'ou=people,dc=example', %s, 0, 1)",
+        (oc_map_ids["organizationalUnit"],),
+    )
+    cur.execute(
+        "insert into ldap_entries (id, dn, oc_map_id, parent, keyval) "
+        "select 1 + n, 'uid=user' || n || ',ou=people,dc=example', %s, 1, n from generate_series(1, %s) n",
+        (oc_map_ids["inetOrgPerson"], entries),
+    )
+    cur.execute("select setval('ldap_entries_id_seq', %s)", (entries + 1,))
+    cur.execute("analyze")
+
+
+def odbc_connection_string(dsn, use_declare_fetch, fetch_size):
+    """Build a psqlODBC connection string from a libpq one, like /etc/odbc.ini does."""
+    params = psycopg2.extensions.parse_dsn(dsn)
+    return ";".join(
+        [
+            "Driver={PostgreSQL Unicode}",
+            "Servername={}".format(params.get("host", "localhost")),
+            "Port={}".format(params.get("port", "5432")),
+            "Database={}".format(params.get("dbname", params.get("user", "postgres"))),
+            "Username={}".format(params.get("user", "postgres")),
+            "Password={}".format(params.get("password", "")),
+            "UseDeclareFetch={}".format(1 if use_declare_fetch else 0),
+            "Fetch={}".format(fetch_size),
+            "ConnSettings=set search_path to {}".format(common.BENCHMARK_SCHEMA),
+        ]
+    )
+
+
+def measure(connection_string, iterations):
+    """Time fetching the whole subtree, returning the latencies in seconds and rows fetched."""
+    conn = pyodbc.connect(connection_string, autocommit=False)
+    timings = []
+    rows = 0
+    try:
+        for _ in range(iterations):
+            cur = conn.cursor()
+            start = time.perf_counter()
+            cur.execute(SUBTREE_QUERY, "%,OU=PEOPLE,DC=EXAMPLE")
+            rows = 0
+            while True:
+                batch = cur.fetchmany(1000)
+                if not batch:
+                    break
+                rows += len(batch)
+            timings.append(time.perf_counter() - start)
+            cur.close()
+            conn.rollback()
+    finally:
+        conn.close()
+    return timings, rows
+
+
+def main():
+    parser = common.argument_parser(__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=100_000, help="number of entries in the subtree")
+    parser.add_argument("--fetch-sizes", type=int, nargs="+", default=[99, 1000, 10000], help="Fetch values to try")
+    parser.add_argument("--iterations", type=int, default=5, help="searches timed per setting")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn)
+    conn.autocommit = True
+    results = []
+    try:
+        with conn.cursor() as cur:
+            seed(cur, args.entries)
+            settings = [(False, 0)] + [(True, fetch_size) for fetch_size in args.fetch_sizes]
+            for use_declare_fetch, fetch_size in settings:
+                timings, rows = measure(
+                    odbc_connection_string(args.dsn, use_declare_fetch, fetch_size), args.iterations
+                )
+                results.append(
+                    {
+                        "use_declare_fetch": use_declare_fetch,
+                        "fetch_size": fetch_size,
+                        "rows": rows,
+                        "rows_per_second": round(rows / (sum(timings) / len(timings))),
+                        **common.latency_summary(timings),
+                    }
+                )
+            common.drop_schema(cur)
+    finally:
+        conn.close()
+
+    print(json.dumps({"entries": args.entries, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Measure back-sql search queries with and without the metadata indexes.
+
+Seeds a scratch schema in a local PostgreSQL database with a two level
+tree of entries, times the queries back-sql issues for base, one-level
+and objectClass lookups, then applies the schema migration that creates
+the indexes and times them again. Results are printed as JSON.
+
+    python3 benchmarks/search_indexes.py --dsn "host=localhost user=postgres"
+"""
+
+import json
+import random
+import time
+
+import common
+import psycopg2
+
+INDEX_MIGRATION = common.MIGRATIONS / "0003_metadata_indexes.sql"
+
+# The statements back-sql prepares for the lookups we care about.
+QUERIES = {
+    "base": (
+        "select ldap_entries.id, ldap_entries.keyval, ldap_entries.oc_map_id, ldap_entries.dn "
+        "from ldap_entries where upper(ldap_entries.dn) = upper(%s)"
+    ),
+    "one-level": (
+        "select ldap_entries.id, ldap_entries.keyval, ldap_entries.oc_map_id, ldap_entries.dn "
+        "from ldap_entries where ldap_entries.parent = %s"
+    ),
+    "objectclasses": (
+        "select ldap_entry_objclasses.oc_name from ldap_entries, ldap_entry_objclasses "
+        "where ldap_entries.id = ldap_entry_objclasses.entry_id and ldap_entries.id = %s"
+    ),
+}
+
+
+def seed(cur, entries, branches):
+    """Create the back-sql tables without indexes and fill them."""
+    common.create_schema(cur, until=INDEX_MIGRATION.name)
+    cur.execute(
+        "insert into ldap_oc_mappings (id, name, keytbl, keycol, expect_return) values "
+        "(1, 'organizationalUnit', 'ous', 'id', 0), (2, 'inetOrgPerson', 'persons', 'id', 0)"
+    )
+    cur.execute("insert into ldap_entries (id, dn, oc_map_id, parent, keyval) values (1, 'dc=example', 1, 0, 1)")
+    cur.execute(
+        "insert into ldap_entries (id, dn, oc_map_id, parent, keyval) "
+        "select 1 + n, 'ou=ou' || n || ',dc=example', 1, 1, 1 + n from generate_series(1, %s) n",
+        (branches,),
+    )
+    cur.execute(
+        "insert into ldap_entries (id, dn, oc_map_id, parent, keyval) "
+        "select n, 'uid=user' || n || ',ou=ou' || (n %% %s + 1) || ',dc=example', 2, n %% %s + 2, n "
+        "from generate_series(%s, %s) n",
+        (branches, branches, branches + 2, entries),
+    )
+    cur.execute(
+        "insert into ldap_entry_objclasses (entry_id, oc_name) "
+        "select id, 'posixAccount' from ldap_entries where oc_map_id = 2"
+    )
+    cur.execute("select setval('ldap_entries_id_seq', %s)", (entries,))
+    cur.execute("analyze")
+
+
+def measure(cur, entries, branches, iterations):
+    """Time each query against random targets, returning latencies in ms."""
+    rng = random.Random(42)
+    results = {}
+    for name, query in QUERIES.items():
+        timings = []
+        for _ in range(iterations):
+            if name == "base":
+                n = rng.randint(branches + 2, entries)
+                param = f"UID=USER{n},OU=OU{n % branches + 1},DC=EXAMPLE"
+            elif name == "one-level":
+                param = rng.randint(2, branches + 1)
+            else:
+                param = rng.randint(branches + 2, entries)
+            start = time.perf_counter()
+            cur.execute(query, (param,))
+            cur.fetchall()
+            timings.append(time.perf_counter() - start)
+        results[name] = common.latency_summary(timings)
+    return results
+
+
+def main():
+    parser = common.argument_parser(__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=1_000_000, help="number of entries to seed")
+    parser.add_argument("--branches", type=int, default=1000, help="number of organizational units")
+    parser.add_argument("--iterations", type=int, default=200, help="queries timed per lookup type")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            seed(cur, args.entries, args.branches)
+            before = measure(cur, args.entries, args.branches, args.iterations)
+            cur.execute(INDEX_MIGRATION.read_text())
+            cur.execute("analyze")
+            after = measure(cur, args.entries, args.branches, args.iterations)
+            common.drop_schema(cur)
+    finally:
+        conn.close()
+
+    print(json.dumps({"entries": args.entries, "before": before, "after": after}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
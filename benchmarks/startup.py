@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Time how long the workload container takes to start serving LDAP.
+
+Runs the workload image the way the charm does: the container is
+created, slapd's configuration is rendered, copied in and converted by
+slaptest, and slapd is started, then the root DSE and the suffix are
+searched until both answer. Each step is timed from the container being
+created, over several runs, and the image size is reported with them.
+An image built before the configuration was rendered by the charm can
+be given with --legacy-image, to be timed from being run with the old
+environment to answering. Results are printed as JSON.
+
+    docker build -t openldap-k8s-benchmark --build-arg DIST_RELEASE=20.04 --build-arg LDAP_VERSION=2.4.50 .
+    python3 benchmarks/startup.py --image openldap-k8s-benchmark --backend mdb
+"""
+
+import json
+import statistics
+import subprocess
+import time
+
+import common
+import ldap3
+import ldap_load
+
+READY_TIMEOUT = 60
+POLL_INTERVAL = 0.02
+
+
+def answers(uri):
+    """Whether slapd answers searches of the root DSE and the suffix."""
+    try:
+        conn = ldap3.Connection(
+            ldap3.Server(uri), ldap_load.ADMIN_DN, ldap_load.ADMIN_PASSWORD, auto_bind=True, receive_timeout=5
+        )
+        try:
+            if not conn.search("", "(objectClass=*)", search_scope=ldap3.BASE):
+                return False
+            conn.search("dc=example", "(objectClass=*)", search_scope=ldap3.BASE)
+            # An empty back-mdb database answers noSuchObject.
+            return conn.result["result"] in (0, 32)
+        finally:
+            conn.unbind()
+    except ldap3.core.exceptions.LDAPException:
+        return False
+
+
+def wait_until_ready(uri, start):
+    """Poll slapd until it answers, returning the seconds since `start`."""
+    while not answers(uri):
+        if time.perf_counter() - start > READY_TIMEOUT:
+            raise TimeoutError(f"slapd at {uri} did not become ready")
+        time.sleep(POLL_INTERVAL)
+    return time.perf_counter() - start
+
+
+def run_once(image, settings, uri):
+    """Start a workload container as the charm does, timing each step from creating it."""
+    start = time.perf_counter()
+    container = common.start_workload_container(image)
+    try:
+        created = time.perf_counter() - start
+        common.configure_slapd(container, settings, ldap_load.ADMIN_PASSWORD)
+        configured = time.perf_counter() - start
+        common.start_slapd(container)
+        ready = wait_until_ready(uri, start)
+    finally:
+        subprocess.run(["docker", "stop", "--time", "1", container], check=False, stdout=subprocess.DEVNULL)
+    return {"created": created, "configured": configured, "ready": ready}
+
+
+def run_legacy_once(image, settings, uri):
+    """Run an image configuring slapd from its environment, timing it from creating the container."""
+    environment = {**settings, "LDAP_ADMIN_PASSWORD": ldap_load.ADMIN_PASSWORD}
+    command = ["run", "--detach", "--rm", "--network", "host"]
+    for name, value in environment.items():
+        command += ["--env", f"{name}={value}"]
+    start = time.perf_counter()
+    container = common.docker(*command, image)
+    try:
+        ready = wait_until_ready(uri, start)
+    finally:
+        subprocess.run(["docker", "stop", "--time", "1", container], check=False, stdout=subprocess.DEVNULL)
+    return {"ready": ready}
+
+
+def summarise(runs):
+    """The median of each step over the runs, in milliseconds."""
+    return {step: round(statistics.median(run[step] for run in runs) * 1000, 1) for step in runs[0]}
+
+
+def image_size(image):
+    """The size of an image in MiB."""
+    return round(int(common.docker("image", "inspect", "--format", "{{.Size}}", image)) / 1048576, 1)
+
+
+def main():
+    parser = common.argument_parser(__doc__.splitlines()[0])
+    parser.add_argument("--image", required=True, help="workload image built from the dockerfile")
+    parser.add_argument("--legacy-image", help="an older workload image to compare with")
+    parser.add_argument("--backend", choices=["sql", "mdb"], default="sql", help="slapd backend to start")
+    parser.add_argument("--runs", type=int, default=10, help="times each image is started")
+    args = parser.parse_args()
+
+    settings = {"LDAP_BACKEND": args.backend}
+    if args.backend == "sql":
+        ldap_load.create_database(args.dsn, 0)
+        settings.update(ldap_load.database_settings(args.dsn))
+    uri = "ldap://localhost:389"
+    try:
+        results = {
+            args.image: {
+                "size_mib": image_size(args.image),
+                **summarise([run_once(args.image, settings, uri) for _ in range(args.runs)]),
+            }
+        }
+        if args.legacy_image:
+            results[args.legacy_image] = {
+                "size_mib": image_size(args.legacy_image),
+                **summarise([run_legacy_once(args.legacy_image, settings, uri) for _ in range(args.runs)]),
+            }
+    finally:
+        if args.backend == "sql":
+            ldap_load.drop_database(args.dsn)
+
+    print(json.dumps({"backend": args.backend, "runs": args.runs, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
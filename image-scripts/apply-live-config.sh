@@ -0,0 +1,45 @@
+#!/bin/bash
+# Apply the settings slapd can change while running through cn=config,
+# over ldapi:/// as the admin. Run by the charm with the new environment
+# of the openldap service, with its threads worked out as for a restart,
+# so the settings match a restart with it.
+set -eu
+
+export SLAPD_LOG_LEVEL="${SLAPD_LOG_LEVEL:-none}"
+
+# Log levels are separate values of olcLogLevel.
+read -ra log_levels <<< "$SLAPD_LOG_LEVEL"
+log_level_values=""
+for level in "${log_levels[@]}"; do
+    log_level_values="${log_level_values}olcLogLevel: $level
+"
+done
+
+# Global limits from slapd.conf belong to the frontend database.
+ldapmodify -Q -Y EXTERNAL -H ldapi:/// <<LDIF
+dn: cn=config
+changetype: modify
+replace: olcLogLevel
+${log_level_values}-
+replace: olcThreads
+olcThreads: $SLAPD_THREADS
+-
+replace: olcConnMaxPending
+olcConnMaxPending: $SLAPD_CONN_MAX_PENDING
+-
+replace: olcConnMaxPendingAuth
+olcConnMaxPendingAuth: $SLAPD_CONN_MAX_PENDING_AUTH
+-
+replace: olcIdleTimeout
+olcIdleTimeout: $SLAPD_IDLETIMEOUT
+-
+
+dn: olcDatabase={-1}frontend,cn=config
+changetype: modify
+replace: olcSizeLimit
+olcSizeLimit: $SLAPD_SIZELIMIT
+-
+replace: olcTimeLimit
+olcTimeLimit: $SLAPD_TIMELIMIT
+-
+LDIF
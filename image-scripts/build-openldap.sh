@@ -1,33 +1,37 @@
 #!/bin/bash
+# Build OpenLDAP into /srv/openldap, to be copied over the runtime image's
+# root. Only run in the build stage, so nothing here ends up in the image
+# the charm runs but the installed files themselves.
+set -eu
 LDAP_VERSION=$1
 
 echo "Running apt update and installs"
 apt-get update
-apt-get -y dist-upgrade
-apt-get --purge autoremove -y
-apt-get install -y wget unixodbc make gcc unixodbc-dev groff-base ldap-utils odbc-postgresql gettext postgresql-client
-# Needed for juju actions to work.
-apt-get install -y python3-yaml
+apt-get install -y --no-install-recommends ca-certificates wget make gcc libc6-dev unixodbc-dev libsasl2-dev groff-base binutils
 
 echo "Making build dir"
 mkdir -p /srv/build
 cd /srv/build || exit
 echo "Fetching openldap source"
 wget https://www.openldap.org/software/download/OpenLDAP/openldap-release/openldap-"${LDAP_VERSION}".tgz
-tar -xvzf openldap-"${LDAP_VERSION}".tgz
+tar -xzf openldap-"${LDAP_VERSION}".tgz
 cd "/srv/build/openldap-${LDAP_VERSION}/" || exit
 echo "Configuring openldap"
-/srv/build/openldap-"${LDAP_VERSION}"/configure --prefix=/usr --sysconfdir=/etc --localstatedir=/var --enable-sql --disable-bdb --disable-ndb --disable-hdb
+# pcache only has its Query Delete extended operation, used to invalidate
+# the cache, and monitoring in development builds unless asked for.
+# back-mdb is built by default, and replicated by the syncprov overlay.
+# SASL is needed for ldapi:/// EXTERNAL binds, as used by the charm's
+# scripts.
+CPPFLAGS="-DPCACHE_EXOP_QUERY_DELETE='\"1.3.6.1.4.1.4203.666.11.9.6.1\"' -DPCACHE_MONITOR" \
+/srv/build/openldap-"${LDAP_VERSION}"/configure --prefix=/usr --sysconfdir=/etc --localstatedir=/var --enable-sql --disable-bdb --disable-ndb --disable-hdb --enable-proxycache --enable-mdb --enable-syncprov --with-cyrus-sasl --disable-static
 echo "Building openldap dependencies"
 make depend
 echo "Building openldap"
-make
+make -j "$(nproc)"
 echo "Installing openldap"
-make install
-echo "Removing build directory"
-cd /srv || exit
-rm -rf /srv/build/openldap-"${LDAP_VERSION}"/
-echo "Purging build dependencies"
-apt-get purge -y wget make gcc groff-base unixodbc-dev
-apt-get --purge autoremove -y
-apt-get clean
+make install DESTDIR=/srv/openldap
+echo "Trimming the installed files"
+cd /srv/openldap || exit
+rm -rf usr/include usr/share/man
+find . -name '*.a' -delete -o -name '*.la' -delete
+find usr/bin usr/libexec usr/lib -type f \( -perm -u+x -o -name '*.so*' \) -exec strip --strip-unneeded {} +
@@ -0,0 +1,15 @@
+#!/bin/bash
+# Turn the ldap_entry_changes log the cache invalidator reads on (true)
+# or off (false). Run by the charm leader when the cache is enabled or
+# disabled, once per database.
+set -eu
+
+export PGHOST=$POSTGRES_HOST
+export PGPORT=$POSTGRES_PORT
+export PGDATABASE=$POSTGRES_NAME
+export PGUSER=$POSTGRES_USER
+export PGPASSWORD=$POSTGRES_PASSWORD
+export PGOPTIONS="-c client_min_messages=error"
+
+psql -qX -v ON_ERROR_STOP=1 -o /dev/null -c "select ldap_set_entry_change_log($1)"
+echo "Entry change log enabled: $(psql -qtAX -c "select ldap_entry_change_log_enabled()")"
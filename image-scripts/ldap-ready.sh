@@ -0,0 +1,17 @@
+#!/bin/bash
+# Pebble readiness check: slapd answers over ldapi:/// and back-sql can
+# reach the database. slapd accepts connections before its ODBC
+# connection works, so a TCP probe isn't enough.
+set -u
+
+# The root DSE is served by slapd itself.
+ldapsearch -LLL -Q -Y EXTERNAL -H ldapi:/// -o nettimeout=2 -l 2 -s base -b "" "(objectClass=*)" 1.1 > /dev/null || exit 1
+
+# Looking up the suffix goes through back-sql. An empty directory has
+# no suffix entry (noSuchObject, 32), which still means the query ran.
+ldapsearch -LLL -Q -Y EXTERNAL -H ldapi:/// -o nettimeout=2 -l 2 -z 1 -s base -b "dc=example" "(objectClass=*)" 1.1 > /dev/null
+rc=$?
+if [ "$rc" -ne 0 ] && [ "$rc" -ne 32 ]; then
+    echo "back-sql lookup failed with LDAP result $rc" >&2
+    exit 1
+fi
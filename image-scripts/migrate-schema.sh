@@ -0,0 +1,31 @@
+#!/bin/bash
+# Apply the back-sql schema migrations the database doesn't have yet.
+# Run by the charm leader once per database, not on every slapd start.
+set -eu
+
+MIGRATIONS_DIR=/srv/image-scripts/migrations
+
+export PGHOST=$POSTGRES_HOST
+export PGPORT=$POSTGRES_PORT
+export PGDATABASE=$POSTGRES_NAME
+export PGUSER=$POSTGRES_USER
+export PGPASSWORD=$POSTGRES_PASSWORD
+export PGOPTIONS="-c client_min_messages=error"
+
+# A single query tells us which migrations are already applied. It fails
+# on a database that has never been migrated, which is version 0.
+current=$(psql -qtAX -c "select coalesce(max(version), 0) from ldap_schema_version" 2>/dev/null || echo 0)
+
+for migration in "$MIGRATIONS_DIR"/*.sql; do
+    name=$(basename "$migration")
+    version=$((10#${name%%_*}))
+    if [ "$version" -le "$current" ]; then
+        continue
+    fi
+    echo "Applying schema migration $name"
+    {
+        cat "$migration"
+        echo "insert into ldap_schema_version (version) values ($version);"
+    } | psql -qX -v ON_ERROR_STOP=1 --single-transaction -o /dev/null -f -
+done
+echo "Schema is at version $(psql -qtAX -c "select max(version) from ldap_schema_version")"
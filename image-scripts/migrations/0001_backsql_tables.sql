@@ -1,3 +1,13 @@
+-- Databases set up by older releases already have the back-sql tables
+-- but no ldap_schema_version, so everything here must be idempotent.
+
+-- Migrations applied by migrate-schema.sh.
+create table if not exists ldap_schema_version
+ (
+	version integer not null primary key,
+	applied_at timestamp with time zone not null default now()
+);
+
 create table if not exists ldap_oc_mappings
  (
 	id serial not null primary key,
@@ -0,0 +1,6 @@
+-- Entry ids come from the ldap_entries_id_seq sequence. Older releases
+-- inserted max(id)+1 instead, so move the sequence past any existing ids.
+select setval(
+	'ldap_entries_id_seq',
+	greatest((select coalesce(max(id), 0) from ldap_entries), (select last_value from ldap_entries_id_seq))
+);
@@ -0,0 +1,7 @@
+-- Indexes for the lookups back-sql makes on every search: DNs are
+-- matched through upper_func, one-level and subtree searches walk
+-- ldap_entries.parent, and objectClasses are joined on entry_id.
+create index if not exists ldap_entries_upper_dn_idx on ldap_entries (upper(dn));
+create index if not exists ldap_entries_parent_idx on ldap_entries (parent);
+create index if not exists ldap_entry_objclasses_entry_id_idx on ldap_entry_objclasses (entry_id);
+create index if not exists ldap_attr_mappings_oc_map_id_idx on ldap_attr_mappings (oc_map_id);
@@ -0,0 +1,52 @@
+-- A log of changed entry DNs, read by pcache-invalidator.py to drop
+-- cached search results that may be stale.
+create table if not exists ldap_entry_changes
+ (
+	id bigserial not null primary key,
+	dn varchar(255) not null,
+	changed_at timestamp with time zone not null default now()
+);
+
+create index if not exists ldap_entry_changes_changed_at_idx on ldap_entry_changes (changed_at);
+
+create or replace function ldap_log_entry_change() returns trigger as $$
+begin
+	if tg_op <> 'INSERT' then
+		insert into ldap_entry_changes (dn) values (old.dn);
+	end if;
+	if tg_op <> 'DELETE' then
+		insert into ldap_entry_changes (dn) values (new.dn);
+	end if;
+	return null;
+end
+$$ language plpgsql;
+
+drop trigger if exists ldap_entries_log_change on ldap_entries;
+create trigger ldap_entries_log_change after insert or update or delete on ldap_entries
+	for each row execute procedure ldap_log_entry_change();
+
+-- Attribute changes happen in the mapped data tables. Attach this trigger
+-- to each of them, giving the object class mapping name and the column
+-- holding the entry's keyval, for example:
+--
+--   create trigger persons_log_change after insert or update or delete on persons
+--       for each row execute procedure ldap_log_data_change('inetOrgPerson', 'id');
+create or replace function ldap_log_data_change() returns trigger as $$
+declare
+	keyvals text[] := '{}';
+begin
+	if tg_op <> 'INSERT' then
+		keyvals := keyvals || (to_jsonb(old) ->> tg_argv[1]);
+	end if;
+	if tg_op <> 'DELETE' then
+		keyvals := keyvals || (to_jsonb(new) ->> tg_argv[1]);
+	end if;
+	insert into ldap_entry_changes (dn)
+		select ldap_entries.dn
+		from ldap_entries, ldap_oc_mappings
+		where ldap_entries.oc_map_id = ldap_oc_mappings.id
+			and ldap_oc_mappings.name = tg_argv[0]
+			and ldap_entries.keyval::text = any (keyvals);
+	return null;
+end
+$$ language plpgsql;
@@ -0,0 +1,234 @@
+-- Default mappings for organization, organizationalUnit, inetOrgPerson,
+-- posixAccount, posixGroup and groupOfNames entries, stored in ldap_*
+-- data tables. They are only added to a database without mappings, so
+-- directories mapped by hand keep theirs.
+--
+-- Single valued attributes are columns of the key table, read without
+-- any join. Multi valued ones are rows of a table keyed on the entry,
+-- joined through join_where on an index that covers the selected value,
+-- and every attribute that is filtered on has an index matching its
+-- sel_expr_u (upper_func is upper) or sel_expr, holding the key column
+-- too, so searches don't have to visit the data table at all. Entries
+-- are created and values added by single statements, so concurrent adds
+-- and repeated values don't need any locking or checks.
+
+create table if not exists ldap_units
+ (
+	id serial not null primary key,
+	name varchar(255),
+	description varchar(1024)
+);
+
+create table if not exists ldap_people
+ (
+	id serial not null primary key,
+	uid varchar(255),
+	cn varchar(255),
+	sn varchar(255),
+	given_name varchar(255),
+	display_name varchar(255),
+	mail varchar(255),
+	telephone_number varchar(255),
+	employee_number varchar(255),
+	uid_number integer,
+	gid_number integer,
+	home_directory varchar(255),
+	login_shell varchar(255),
+	gecos varchar(255),
+	user_password varchar(255),
+	description varchar(1024)
+);
+
+create index if not exists ldap_people_upper_uid_idx on ldap_people (upper(uid), id, uid);
+create index if not exists ldap_people_upper_cn_idx on ldap_people (upper(cn), id, cn);
+create index if not exists ldap_people_upper_mail_idx on ldap_people (upper(mail), id, mail);
+create index if not exists ldap_people_uid_number_idx on ldap_people (uid_number, id);
+
+create table if not exists ldap_groups
+ (
+	id serial not null primary key,
+	cn varchar(255),
+	gid_number integer,
+	description varchar(1024)
+);
+
+create index if not exists ldap_groups_upper_cn_idx on ldap_groups (upper(cn), id, cn);
+create index if not exists ldap_groups_gid_number_idx on ldap_groups (gid_number, id);
+
+-- The primary keys cover reading a group's values, the other indexes
+-- finding the groups a value is in.
+create table if not exists ldap_group_member_uids
+ (
+	group_id integer not null references ldap_groups(id) on delete cascade,
+	member_uid varchar(255) not null,
+	primary key ( group_id, member_uid )
+);
+
+create index if not exists ldap_group_member_uids_member_uid_idx on ldap_group_member_uids (member_uid, group_id);
+
+create table if not exists ldap_group_members
+ (
+	group_id integer not null references ldap_groups(id) on delete cascade,
+	member_dn varchar(255) not null,
+	primary key ( group_id, member_dn )
+);
+
+create index if not exists ldap_group_members_upper_member_dn_idx
+	on ldap_group_members (upper(member_dn), group_id, member_dn);
+
+-- create_proc functions, called as select f() for the new keyval.
+create or replace function ldap_create_unit() returns integer as $$
+	insert into ldap_units default values returning id
+$$ language sql;
+
+create or replace function ldap_create_person() returns integer as $$
+	insert into ldap_people default values returning id
+$$ language sql;
+
+create or replace function ldap_create_group() returns integer as $$
+	insert into ldap_groups default values returning id
+$$ language sql;
+
+do $$
+declare
+	organization integer;
+	unit integer;
+	person integer;
+	account integer;
+	posix_group integer;
+	group_of_names integer;
+begin
+	if exists (select 1 from ldap_oc_mappings) then
+		return;
+	end if;
+
+	insert into ldap_oc_mappings (name, keytbl, keycol, create_proc, delete_proc, expect_return)
+		values ('organization', 'ldap_units', 'id', 'select ldap_create_unit()', 'delete from ldap_units where id=?', 0)
+		returning id into organization;
+	insert into ldap_oc_mappings (name, keytbl, keycol, create_proc, delete_proc, expect_return)
+		values ('organizationalUnit', 'ldap_units', 'id', 'select ldap_create_unit()',
+			'delete from ldap_units where id=?', 0)
+		returning id into unit;
+	insert into ldap_oc_mappings (name, keytbl, keycol, create_proc, delete_proc, expect_return)
+		values ('inetOrgPerson', 'ldap_people', 'id', 'select ldap_create_person()',
+			'delete from ldap_people where id=?', 0)
+		returning id into person;
+	insert into ldap_oc_mappings (name, keytbl, keycol, create_proc, delete_proc, expect_return)
+		values ('posixAccount', 'ldap_people', 'id', 'select ldap_create_person()',
+			'delete from ldap_people where id=?', 0)
+		returning id into account;
+	insert into ldap_oc_mappings (name, keytbl, keycol, create_proc, delete_proc, expect_return)
+		values ('posixGroup', 'ldap_groups', 'id', 'select ldap_create_group()',
+			'delete from ldap_groups where id=?', 0)
+		returning id into posix_group;
+	insert into ldap_oc_mappings (name, keytbl, keycol, create_proc, delete_proc, expect_return)
+		values ('groupOfNames', 'ldap_groups', 'id', 'select ldap_create_group()',
+			'delete from ldap_groups where id=?', 0)
+		returning id into group_of_names;
+
+	-- Columns of the key table, added and deleted with an update of the
+	-- entry's row (param_order 3: the value, then the keyval). Optional
+	-- ones are only selected when set.
+	insert into ldap_attr_mappings
+		(oc_map_id, name, sel_expr, sel_expr_u, from_tbls, join_where, add_proc, delete_proc, param_order,
+			expect_return)
+		select m.oc_map_id, m.name, m.tbl || '.' || m.col,
+			case when m.upper then 'upper(' || m.tbl || '.' || m.col || ')' end,
+			m.tbl,
+			case when m.optional then m.tbl || '.' || m.col || ' is not null' end,
+			'update ' || m.tbl || ' set ' || m.col || '=? where id=?',
+			'update ' || m.tbl || ' set ' || m.col || '=null where ' || m.col || '=? and id=?',
+			3, 0
+		from (values
+			(organization, 'o', 'ldap_units', 'name', true, false),
+			(organization, 'description', 'ldap_units', 'description', true, true),
+			(unit, 'ou', 'ldap_units', 'name', true, false),
+			(unit, 'description', 'ldap_units', 'description', true, true),
+			(person, 'uid', 'ldap_people', 'uid', true, true),
+			(person, 'cn', 'ldap_people', 'cn', true, false),
+			(person, 'sn', 'ldap_people', 'sn', true, false),
+			(person, 'givenName', 'ldap_people', 'given_name', true, true),
+			(person, 'displayName', 'ldap_people', 'display_name', true, true),
+			(person, 'mail', 'ldap_people', 'mail', true, true),
+			(person, 'telephoneNumber', 'ldap_people', 'telephone_number', false, true),
+			(person, 'employeeNumber', 'ldap_people', 'employee_number', true, true),
+			(person, 'description', 'ldap_people', 'description', true, true),
+			(person, 'userPassword', 'ldap_people', 'user_password', false, true),
+			-- Entries may add posixAccount as an auxiliary class.
+			(person, 'uidNumber', 'ldap_people', 'uid_number', false, true),
+			(person, 'gidNumber', 'ldap_people', 'gid_number', false, true),
+			(person, 'homeDirectory', 'ldap_people', 'home_directory', false, true),
+			(person, 'loginShell', 'ldap_people', 'login_shell', false, true),
+			(person, 'gecos', 'ldap_people', 'gecos', false, true),
+			(account, 'uid', 'ldap_people', 'uid', true, false),
+			(account, 'cn', 'ldap_people', 'cn', true, false),
+			(account, 'uidNumber', 'ldap_people', 'uid_number', false, false),
+			(account, 'gidNumber', 'ldap_people', 'gid_number', false, false),
+			(account, 'homeDirectory', 'ldap_people', 'home_directory', false, false),
+			(account, 'loginShell', 'ldap_people', 'login_shell', false, true),
+			(account, 'gecos', 'ldap_people', 'gecos', false, true),
+			(account, 'description', 'ldap_people', 'description', true, true),
+			(account, 'userPassword', 'ldap_people', 'user_password', false, true),
+			(posix_group, 'cn', 'ldap_groups', 'cn', true, false),
+			(posix_group, 'gidNumber', 'ldap_groups', 'gid_number', false, false),
+			(posix_group, 'description', 'ldap_groups', 'description', true, true),
+			(group_of_names, 'cn', 'ldap_groups', 'cn', true, false),
+			(group_of_names, 'description', 'ldap_groups', 'description', true, true)
+		) m(oc_map_id, name, tbl, col, upper, optional);
+
+	-- Rows of the member tables, joined on their key.
+	insert into ldap_attr_mappings
+		(oc_map_id, name, sel_expr, sel_expr_u, from_tbls, join_where, add_proc, delete_proc, param_order,
+			expect_return)
+		values
+		(posix_group, 'memberUid', 'ldap_group_member_uids.member_uid', null, 'ldap_groups, ldap_group_member_uids',
+			'ldap_group_member_uids.group_id = ldap_groups.id',
+			'insert into ldap_group_member_uids (member_uid, group_id) values (?, ?) on conflict do nothing',
+			'delete from ldap_group_member_uids where member_uid=? and group_id=?', 3, 0),
+		(group_of_names, 'member', 'ldap_group_members.member_dn', 'upper(ldap_group_members.member_dn)',
+			'ldap_groups, ldap_group_members', 'ldap_group_members.group_id = ldap_groups.id',
+			'insert into ldap_group_members (member_dn, group_id) values (?, ?) on conflict do nothing',
+			'delete from ldap_group_members where member_dn=? and group_id=?', 3, 0);
+end
+$$;
+
+-- Let pcache-invalidator.py see attribute changes, as 0004 describes.
+-- Keyvals are integers, so compare them as such to look the entries up
+-- through the ( oc_map_id, keyval ) index rather than scan ldap_entries
+-- for every changed row, and take a comma separated list of mapping
+-- names, so tables shared by several mappings need a single trigger.
+create or replace function ldap_log_data_change() returns trigger as $$
+declare
+	keyvals integer[] := '{}';
+begin
+	if tg_op <> 'INSERT' then
+		keyvals := keyvals || (to_jsonb(old) ->> tg_argv[1])::integer;
+	end if;
+	if tg_op <> 'DELETE' then
+		keyvals := keyvals || (to_jsonb(new) ->> tg_argv[1])::integer;
+	end if;
+	insert into ldap_entry_changes (dn)
+		select ldap_entries.dn
+		from ldap_entries, ldap_oc_mappings
+		where ldap_entries.oc_map_id = ldap_oc_mappings.id
+			and ldap_oc_mappings.name = any (string_to_array(tg_argv[0], ','))
+			and ldap_entries.keyval = any (keyvals);
+	return null;
+end
+$$ language plpgsql;
+
+drop trigger if exists ldap_units_log_change on ldap_units;
+create trigger ldap_units_log_change after insert or update or delete on ldap_units
+	for each row execute procedure ldap_log_data_change('organization,organizationalUnit', 'id');
+drop trigger if exists ldap_people_log_change on ldap_people;
+create trigger ldap_people_log_change after insert or update or delete on ldap_people
+	for each row execute procedure ldap_log_data_change('inetOrgPerson,posixAccount', 'id');
+drop trigger if exists ldap_groups_log_change on ldap_groups;
+create trigger ldap_groups_log_change after insert or update or delete on ldap_groups
+	for each row execute procedure ldap_log_data_change('posixGroup,groupOfNames', 'id');
+drop trigger if exists ldap_group_member_uids_log_change on ldap_group_member_uids;
+create trigger ldap_group_member_uids_log_change after insert or update or delete on ldap_group_member_uids
+	for each row execute procedure ldap_log_data_change('posixGroup', 'group_id');
+drop trigger if exists ldap_group_members_log_change on ldap_group_members;
+create trigger ldap_group_members_log_change after insert or update or delete on ldap_group_members
+	for each row execute procedure ldap_log_data_change('groupOfNames', 'group_id');
@@ -0,0 +1,79 @@
+-- Only pcache-invalidator.py reads ldap_entry_changes, and only while
+-- the search result cache is enabled, which it isn't by default. The
+-- triggers filling it are therefore left disabled, and the charm leader
+-- turns them on with ldap_set_entry_change_log(true) while the cache is
+-- enabled. Turning them off empties the log, so it never outgrows what
+-- the invalidator prunes.
+--
+-- Sessions that don't need their changes logged, like bulk imports,
+-- skip the triggers with
+--
+--   set local ldap.entry_change_log to off;
+
+create or replace function ldap_log_entry_change() returns trigger as $$
+begin
+	if current_setting('ldap.entry_change_log', true) = 'off' then
+		return null;
+	end if;
+	if tg_op <> 'INSERT' then
+		insert into ldap_entry_changes (dn) values (old.dn);
+	end if;
+	if tg_op <> 'DELETE' then
+		insert into ldap_entry_changes (dn) values (new.dn);
+	end if;
+	return null;
+end
+$$ language plpgsql;
+
+create or replace function ldap_log_data_change() returns trigger as $$
+declare
+	keyvals integer[] := '{}';
+begin
+	if current_setting('ldap.entry_change_log', true) = 'off' then
+		return null;
+	end if;
+	if tg_op <> 'INSERT' then
+		keyvals := keyvals || (to_jsonb(old) ->> tg_argv[1])::integer;
+	end if;
+	if tg_op <> 'DELETE' then
+		keyvals := keyvals || (to_jsonb(new) ->> tg_argv[1])::integer;
+	end if;
+	insert into ldap_entry_changes (dn)
+		select ldap_entries.dn
+		from ldap_entries, ldap_oc_mappings
+		where ldap_entries.oc_map_id = ldap_oc_mappings.id
+			and ldap_oc_mappings.name = any (string_to_array(tg_argv[0], ','))
+			and ldap_entries.keyval = any (keyvals);
+	return null;
+end
+$$ language plpgsql;
+
+-- Every trigger logging changes, including those attached by hand to
+-- tables of other mappings, as 0004 describes.
+create or replace function ldap_set_entry_change_log(enabled boolean) returns void as $$
+declare
+	log_trigger record;
+begin
+	for log_trigger in
+		select tgrelid::regclass as tbl, tgname
+		from pg_trigger
+		where not tgisinternal
+			and tgfoid in ('ldap_log_entry_change'::regproc, 'ldap_log_data_change'::regproc)
+	loop
+		execute format('alter table %s %s trigger %I', log_trigger.tbl,
+			case when enabled then 'enable' else 'disable' end, log_trigger.tgname);
+	end loop;
+	if not enabled then
+		truncate ldap_entry_changes;
+	end if;
+end
+$$ language plpgsql;
+
+create or replace function ldap_entry_change_log_enabled() returns boolean as $$
+	select exists (
+		select 1 from pg_trigger
+		where tgrelid = 'ldap_entries'::regclass and tgname = 'ldap_entries_log_change' and tgenabled <> 'D'
+	)
+$$ language sql stable;
+
+select ldap_set_entry_change_log(false);
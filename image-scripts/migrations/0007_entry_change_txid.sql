@@ -0,0 +1,7 @@
+-- Concurrent transactions commit their changes out of id order, so
+-- pcache-invalidator.py can't read the log in id order without missing
+-- some. Each change records its transaction instead, for the invalidator
+-- to read again the changes of transactions that hadn't finished yet.
+alter table ldap_entry_changes add column if not exists txid bigint not null default txid_current();
+
+create index if not exists ldap_entry_changes_txid_idx on ldap_entry_changes (txid);
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Serve slapd's cn=Monitor counters as Prometheus metrics.
+
+Each scrape reads the monitor database over ldapi:///, as the admin, and
+renders the connection, operation, thread pool, statistics, waiter and
+search result cache counters in the Prometheus text format.
+"""
+
+import http.server
+import logging
+import os
+import subprocess
+import sys
+
+MONITOR_COMMAND = [
+    "ldapsearch",
+    "-LLL",
+    "-Q",
+    "-Y",
+    "EXTERNAL",
+    "-H",
+    "ldapi:///",
+    "-o",
+    "ldif-wrap=no",
+    "-b",
+    "cn=Monitor",
+    "(objectClass=*)",
+    "monitorCounter",
+    "monitorOpInitiated",
+    "monitorOpCompleted",
+    "monitoredInfo",
+    "pcacheNumQueries",
+    "pcacheNumEntries",
+]
+
+# name: (type, help)
+METRICS = {
+    "openldap_up": ("gauge", "Whether cn=Monitor could be read."),
+    "openldap_connections_total": ("counter", "Connections accepted since slapd started."),
+    "openldap_connections_current": ("gauge", "Open client connections."),
+    "openldap_operations_initiated_total": ("counter", "Operations started, by type."),
+    "openldap_operations_completed_total": ("counter", "Operations finished, by type."),
+    "openldap_threads": ("gauge", "Worker thread pool state, by counter."),
+    "openldap_statistics_total": ("counter", "Bytes, PDUs, entries and referrals sent."),
+    "openldap_waiters": ("gauge", "Connections waiting to read or write."),
+    "openldap_cache_queries": ("gauge", "Search results held in the pcache overlay."),
+    "openldap_cache_entries": ("gauge", "Entries held in the pcache overlay."),
+}
+
+logger = logging.getLogger("monitor-exporter")
+
+
+def read_monitor():
+    """Read the monitor database, returning the attributes of each entry by lowercased DN."""
+    output = subprocess.run(
+        MONITOR_COMMAND, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True
+    ).stdout
+    entries = {}
+    attributes = None
+    for line in output.splitlines():
+        name, _, value = line.partition(": ")
+        if name == "dn":
+            attributes = entries.setdefault(value.lower(), {})
+        elif attributes is not None and value:
+            attributes[name] = value
+    return entries
+
+
+def label(value):
+    """A Prometheus label value from a monitor entry name."""
+    return value.lower().replace(" ", "_")
+
+
+def collect(entries):
+    """Turn monitor entries into (metric, labels, value) samples."""
+    samples = []
+    for dn, attributes in entries.items():
+        rdns = dn.split(",")
+        if len(rdns) != 3:
+            continue
+        name, parent = rdns[0].partition("=")[2], rdns[1]
+        if parent == "cn=connections" and name in ("total", "current"):
+            samples.append(("openldap_connections_" + name, {}, attributes.get("monitorCounter")))
+        elif parent == "cn=operations":
+            labels = {"operation": label(name)}
+            samples.append(("openldap_operations_initiated_total", labels, attributes.get("monitorOpInitiated")))
+            samples.append(("openldap_operations_completed_total", labels, attributes.get("monitorOpCompleted")))
+        elif parent == "cn=threads":
+            samples.append(("openldap_threads", {"counter": label(name)}, attributes.get("monitoredInfo")))
+        elif parent == "cn=statistics":
+            samples.append(("openldap_statistics_total", {"type": label(name)}, attributes.get("monitorCounter")))
+        elif parent == "cn=waiters":
+            samples.append(("openldap_waiters", {"type": label(name)}, attributes.get("monitorCounter")))
+        elif parent == "cn=databases" and "pcacheNumQueries" in attributes:
+            labels = {"database": label(name)}
+            samples.append(("openldap_cache_queries", labels, attributes.get("pcacheNumQueries")))
+            samples.append(("openldap_cache_entries", labels, attributes.get("pcacheNumEntries")))
+    # Drop values that aren't numbers, like the thread pool's state.
+    return [(metric, labels, value) for metric, labels, value in samples if value and value.isdigit()]
+
+
+def render(samples, up):
+    """Render samples in the Prometheus text exposition format."""
+    samples = [("openldap_up", {}, "1" if up else "0")] + samples
+    lines = []
+    for metric, (metric_type, description) in METRICS.items():
+        metric_samples = [sample for sample in samples if sample[0] == metric]
+        if not metric_samples:
+            continue
+        lines.append("# HELP {} {}".format(metric, description))
+        lines.append("# TYPE {} {}".format(metric, metric_type))
+        for _, labels, value in metric_samples:
+            label_text = ",".join('{}="{}"'.format(key, value) for key, value in sorted(labels.items()))
+            lines.append("{}{} {}".format(metric, "{" + label_text + "}" if label_text else "", value))
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Serve the metrics on /metrics."""
+
+    def do_GET(self):  # noqa: N802
+        """Read cn=Monitor and reply with the metrics."""
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        try:
+            body = render(collect(read_monitor()), up=True)
+        except subprocess.CalledProcessError as e:
+            logger.warning("Reading cn=Monitor failed: %s", e.stderr.strip())
+            body = render([], up=False)
+        body = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # noqa: A002
+        """Don't log every scrape."""
+
+
+def main():
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(name)s: %(message)s")
+    port = int(os.environ.get("METRICS_PORT", "9330"))
+    server = http.server.ThreadingHTTPServer(("", port), MetricsHandler)
+    logger.info("Serving metrics on port %d", port)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
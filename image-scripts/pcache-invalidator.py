@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Drop cached search results when the back-sql data changes.
+
+Polls the ldap_entry_changes log kept by database triggers, and for each
+changed entry asks slapd's pcache overlay to delete the cached queries
+that returned the entry, and those based on the entry or one of its
+ancestors (which may now match a newly added entry). The charm leader
+only turns the triggers on while the cache is enabled.
+
+Concurrent writers commit their changes out of id order, so the log is
+read by transaction instead: each poll reads again the changes of every
+transaction that hadn't finished by the last one, skipping those already
+seen. Changes made while the invalidator wasn't running were never seen,
+so it empties the cache when it starts.
+"""
+
+import base64
+import logging
+import os
+import re
+import subprocess
+import sys
+import time
+import urllib.parse
+
+# pcache's Query Delete extended operation.
+QUERY_DELETE_OID = "1.3.6.1.4.1.4203.666.11.9.6.1"
+QUERY_DELETE_BASE = 0xA0
+QUERY_DELETE_DN = 0xA1
+
+POLL_INTERVAL = 1
+PRUNE_INTERVAL = 3600
+FIELD_SEPARATOR = "\x1f"
+
+# The oldest transaction still running, and the changes of it and of
+# every later transaction visible so far. Both come from the statement's
+# snapshot, so changes missing from the result belong to transactions
+# from that xmin on, and the next poll reads them.
+CHANGES_QUERY = """
+select snapshot.xmin, changes.id, changes.txid, changes.dn
+from (select txid_snapshot_xmin(txid_current_snapshot()) as xmin) snapshot
+left join ldap_entry_changes changes on changes.txid >= {xmin}
+order by changes.id
+"""
+
+# The URL of every cached query, from slapd's monitor database.
+CACHED_QUERIES_COMMAND = [
+    "ldapsearch",
+    "-LLL",
+    "-Q",
+    "-Y",
+    "EXTERNAL",
+    "-H",
+    "ldapi:///",
+    "-o",
+    "ldif-wrap=no",
+    "-b",
+    "cn=Monitor",
+    "(pcacheQueryURL=*)",
+    "pcacheQueryURL",
+]
+
+logger = logging.getLogger("pcache-invalidator")
+
+
+def psql(query):
+    """Run a query, returning its rows as lists of fields."""
+    output = subprocess.run(
+        ["psql", "-qtAX", "-v", "ON_ERROR_STOP=1", "-F", FIELD_SEPARATOR, "-c", query],
+        check=True,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    ).stdout
+    return [line.split(FIELD_SEPARATOR) for line in output.splitlines() if line]
+
+
+def ber_length(length):
+    """BER encode a length."""
+    if length < 0x80:
+        return bytes([length])
+    encoded = length.to_bytes((length.bit_length() + 7) // 8, "big")
+    return bytes([0x80 | len(encoded)]) + encoded
+
+
+def query_delete_request(tag, dn):
+    """BER encode a Query Delete request for the queries matching a DN."""
+    value = dn.encode()
+    element = bytes([tag]) + ber_length(len(value)) + value
+    return b"\x30" + ber_length(len(element)) + element
+
+
+def ancestors(dn):
+    """The DN itself and every DN above it."""
+    rdns = re.split(r"(?<!\\),", dn)
+    return [",".join(rdns[i:]) for i in range(len(rdns))]
+
+
+def query_delete(tag, dn):
+    """Ask slapd to delete the cached queries matching a DN."""
+    request = base64.b64encode(query_delete_request(tag, dn)).decode()
+    result = subprocess.run(
+        ["ldapexop", "-Q", "-Y", "EXTERNAL", "-H", "ldapi:///", "{}::{}".format(QUERY_DELETE_OID, request)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    if result.returncode != 0:
+        # slapd empties the cache when it starts, so there's nothing to
+        # retry if it isn't running.
+        logger.warning("Query Delete for %s failed: %s", dn, result.stderr.strip())
+
+
+def invalidate(dns):
+    """Delete the cached queries affected by changes to the given entries."""
+    bases = set()
+    for dn in dns:
+        query_delete(QUERY_DELETE_DN, dn)
+        bases.update(ancestors(dn))
+    for base in bases:
+        query_delete(QUERY_DELETE_BASE, base)
+
+
+def query_bases(monitor_ldif):
+    """The base DNs of the cached queries listed in slapd's monitor database."""
+    bases = set()
+    for line in monitor_ldif.splitlines():
+        attribute, _, value = line.partition(": ")
+        if attribute == "pcacheQueryURL:":
+            value = base64.b64decode(value).decode()
+        elif attribute != "pcacheQueryURL":
+            continue
+        # ldap:///<base>??<scope>?<filter>?<extensions>
+        bases.add(urllib.parse.unquote(value[len("ldap:///") :].split("?")[0]))
+    return bases
+
+
+def flush():
+    """Delete every cached query."""
+    result = subprocess.run(
+        CACHED_QUERIES_COMMAND, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True
+    )
+    if result.returncode != 0:
+        # slapd empties the cache when it starts.
+        logger.warning("Listing the cached queries failed: %s", result.stderr.strip())
+        return
+    bases = query_bases(result.stdout)
+    for base in bases:
+        query_delete(QUERY_DELETE_BASE, base)
+    logger.info("Emptied the cache of the queries under %d bases", len(bases))
+
+
+class ChangeLog:
+    """The entries changed since the last read, including by transactions still running then."""
+
+    def __init__(self):
+        self.xmin = int(psql("select txid_snapshot_xmin(txid_current_snapshot())")[0][0])
+        # The transactions of the changes already read, by change id, from xmin on.
+        self.seen = {}
+
+    def read(self):
+        """The DNs of the entries changed since the last read."""
+        dns = set()
+        rows = psql(CHANGES_QUERY.format(xmin=self.xmin))
+        for _, change_id, txid, dn in rows:
+            if change_id and change_id not in self.seen:
+                self.seen[change_id] = int(txid)
+                dns.add(dn)
+        # Changes of transactions before the new xmin are never read again.
+        self.xmin = int(rows[0][0])
+        self.seen = {change_id: txid for change_id, txid in self.seen.items() if txid >= self.xmin}
+        return dns
+
+
+def main():
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(name)s: %(message)s")
+    os.environ.update(
+        PGHOST=os.environ["POSTGRES_HOST"],
+        PGPORT=os.environ["POSTGRES_PORT"],
+        PGDATABASE=os.environ["POSTGRES_NAME"],
+        PGUSER=os.environ["POSTGRES_USER"],
+        PGPASSWORD=os.environ["POSTGRES_PASSWORD"],
+    )
+
+    # Changes committed while emptying the cache are read by the first poll.
+    changes = ChangeLog()
+    flush()
+    last_prune = time.monotonic()
+    logger.info("Watching for entry changes from transaction %d", changes.xmin)
+    while True:
+        try:
+            dns = changes.read()
+            if dns:
+                invalidate(dns)
+            if time.monotonic() - last_prune > PRUNE_INTERVAL:
+                last_prune = time.monotonic()
+                psql("delete from ldap_entry_changes where changed_at < now() - interval '1 day'")
+        except subprocess.CalledProcessError as e:
+            # Standbys are read only, and the database may be restarting.
+            logger.warning("Database query failed: %s", e)
+        time.sleep(POLL_INTERVAL)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Record the SQL statements back-sql runs for longer than a threshold.
+
+Samples pg_stat_activity for this unit's slapd sessions, which psqlODBC
+tags with an application_name. A statement running past the threshold
+is recorded once it finishes, with the longest duration it was seen
+running and the LDAP connections that had operations executing when it
+was spotted. With the diagnostic log profile, slapd logs the operations
+of those connections under the same conn= numbers.
+
+The records are appended as JSON lines to SLOW_QUERY_LOG, keeping the
+last MAX_RECORDS of them, for the get-slow-queries action.
+
+Samples go through a single psql session kept open for as long as the
+sampler runs, so sampling often doesn't open a connection, or fork a
+process, each time.
+"""
+
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+SLOW_QUERY_LOG = "/var/log/slapd-slow-queries.jsonl"
+MAX_RECORDS = 1000
+FIELD_SEPARATOR = "\x1f"
+RECORD_SEPARATOR = "\x1e"
+
+MONITOR_CONNECTIONS_COMMAND = [
+    "ldapsearch",
+    "-LLL",
+    "-Q",
+    "-Y",
+    "EXTERNAL",
+    "-H",
+    "ldapi:///",
+    "-o",
+    "ldif-wrap=no",
+    "-b",
+    "cn=Connections,cn=Monitor",
+    "(monitorConnectionOpsExecuting>=1)",
+    "monitorConnectionNumber",
+    "monitorConnectionPeerAddress",
+    "monitorConnectionAuthzDN",
+]
+
+logger = logging.getLogger("slow-query-sampler")
+
+
+class Session:
+    """A psql session to run queries through, started again if it ends."""
+
+    COMMAND = ["psql", "-qtAX", "-v", "ON_ERROR_STOP=1", "-F", FIELD_SEPARATOR, "-R", RECORD_SEPARATOR]
+
+    def __init__(self):
+        self.process = None
+        # Echoed after each result, so we know where it ends.
+        self.marker = "end-of-result-{}".format(uuid.uuid4().hex)
+
+    def query(self, query):
+        """Run a query, returning its rows as lists of fields."""
+        if self.process is None:
+            self.process = subprocess.Popen(
+                self.COMMAND, stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True
+            )
+        lines = []
+        try:
+            self.process.stdin.write("{};\n\\echo {}\n".format(query, self.marker))
+            self.process.stdin.flush()
+            for line in self.process.stdout:
+                if line == self.marker + "\n":
+                    break
+                lines.append(line)
+            else:
+                # psql stops at the first error, after writing it to stderr.
+                raise subprocess.CalledProcessError(self.close(), self.COMMAND)
+        except BrokenPipeError:
+            raise subprocess.CalledProcessError(self.close(), self.COMMAND)
+        # Statements may span lines, so rows are split on a record separator.
+        output = "".join(lines).rstrip("\n")
+        return [row.split(FIELD_SEPARATOR) for row in output.split(RECORD_SEPARATOR) if row]
+
+    def close(self):
+        """End the session, returning psql's exit status."""
+        process, self.process = self.process, None
+        process.kill()
+        return process.wait()
+
+
+def executing_ldap_connections():
+    """Describe the LDAP connections with operations in progress."""
+    result = subprocess.run(
+        MONITOR_CONNECTIONS_COMMAND, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True
+    )
+    connections = []
+    for line in result.stdout.splitlines():
+        name, _, value = line.partition(": ")
+        if name == "dn":
+            connections.append({})
+        elif connections and name.startswith("monitorConnection"):
+            connections[-1][name.replace("monitorConnection", "", 1).lower()] = value
+    return ["conn={number} peer={peeraddress} authz={authzdn}".format(**c) for c in connections if "number" in c]
+
+
+def write_records(records):
+    """Append records to the log, dropping the oldest beyond MAX_RECORDS."""
+    lines = []
+    if os.path.exists(SLOW_QUERY_LOG):
+        with open(SLOW_QUERY_LOG) as f:
+            lines = f.readlines()
+    lines.extend(json.dumps(record) + "\n" for record in records)
+    with open(SLOW_QUERY_LOG + ".new", "w") as f:
+        f.writelines(lines[-MAX_RECORDS:])
+    os.replace(SLOW_QUERY_LOG + ".new", SLOW_QUERY_LOG)
+
+
+def main():
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(name)s: %(message)s")
+    threshold_ms = int(os.environ["SLOW_QUERY_THRESHOLD_MS"])
+    application_name = os.environ["SLOW_QUERY_APPLICATION_NAME"]
+    os.environ.update(
+        PGHOST=os.environ["POSTGRES_HOST"],
+        PGPORT=os.environ["POSTGRES_PORT"],
+        PGDATABASE=os.environ["POSTGRES_NAME"],
+        PGUSER=os.environ["POSTGRES_USER"],
+        PGPASSWORD=os.environ["POSTGRES_PASSWORD"],
+        PGAPPNAME="slow-query-sampler",
+    )
+    # Sample often enough to see statements just over the threshold.
+    interval = min(max(threshold_ms / 2000, 0.05), 1)
+    query = (
+        "select pid, query_start, extract(epoch from clock_timestamp() - query_start) * 1000, query "
+        "from pg_stat_activity where state = 'active' and application_name = '{}' "
+        "and clock_timestamp() - query_start > interval '{} milliseconds'"
+    ).format(application_name.replace("'", "''"), threshold_ms)
+
+    session = Session()
+    running = {}
+    logger.info("Recording statements from %s slower than %dms", application_name, threshold_ms)
+    while True:
+        try:
+            rows = session.query(query)
+        except subprocess.CalledProcessError as e:
+            logger.warning("Sampling pg_stat_activity failed: %s", e)
+            time.sleep(1)
+            continue
+        seen = set()
+        for pid, query_start, duration_ms, statement in rows:
+            key = (pid, query_start)
+            seen.add(key)
+            if key not in running:
+                running[key] = {
+                    "started": query_start,
+                    "statement": statement,
+                    "ldap_connections": executing_ldap_connections(),
+                }
+            running[key]["duration_ms"] = round(float(duration_ms))
+        finished = [running.pop(key) for key in list(running) if key not in seen]
+        if finished:
+            write_records(finished)
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    main()
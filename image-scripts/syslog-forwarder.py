@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Print what slapd logs to syslog, for Pebble to collect.
+
+slapd only writes the messages its `loglevel` selects to syslog, and the
+workload container runs no syslog daemon. This takes the place of one on
+/dev/log, so the level can change through cn=config while slapd runs and
+its output still reaches the Pebble logs. slapd reconnects on its next
+message if it started first.
+"""
+
+import os
+import re
+import socket
+import sys
+
+# The priority, and the timestamp the C library adds.
+HEADER = re.compile(r"^<\d+>(?:[A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d )?")
+
+
+def main():
+    path = os.environ.get("SYSLOG_SOCKET", "/dev/log")
+    if os.path.exists(path):
+        os.remove(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(path)
+    os.chmod(path, 0o666)
+    while True:
+        message = sock.recv(65536).decode(errors="replace")
+        sys.stdout.write(HEADER.sub("", message).rstrip("\x00\n") + "\n")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
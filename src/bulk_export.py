@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Dump the directory from the back-sql tables to gzipped LDIF.
+
+Run in the workload container by the export action, so it only uses the
+standard library and psql. A single COPY streams every entry with its
+object classes and attribute values, built from ldap_attr_mappings the
+way back-sql builds them, ordered so parents come before their
+children. Rows are written out as they arrive, so memory use doesn't
+grow with the size of the directory, and the output can be loaded back
+with the bulk-import action or ldapadd as it is.
+"""
+
+import argparse
+import base64
+import csv
+import gzip
+import io
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+FIELD_SEPARATOR = "\x1f"
+PROGRESS_INTERVAL = 100000
+MAX_ATTRIBUTES = 50
+# Values that can be written as they are, per RFC 2849, the rest are base64 encoded.
+SAFE_STRING = re.compile(r"[\x01-\x09\x0b\x0c\x0e-\x1f\x21-\x39\x3b\x3d-\x7f][\x01-\x09\x0b\x0c\x0e-\x7f]*")
+
+
+def psql_rows(query):
+    """Run a query, returning its rows as lists of fields."""
+    output = subprocess.run(
+        ["psql", "-qtAX", "-v", "ON_ERROR_STOP=1", "-F", FIELD_SEPARATOR, "-c", query],
+        check=True,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    ).stdout
+    return [line.split(FIELD_SEPARATOR) for line in output.splitlines() if line]
+
+
+def sql_literal(value):
+    """Quote a string for SQL."""
+    return "'{}'".format(value.replace("'", "''"))
+
+
+def export_query(rows):
+    """Build the query listing every entry, parents first.
+
+    Each row is an object class mapping with one of its attribute mappings,
+    if any: oc id, keytbl, keycol, attribute name, sel_expr, from_tbls, join_where."""
+    mappings = {}
+    for oc_map_id, keytbl, keycol, attribute, sel_expr, from_tbls, join_where in rows:
+        attributes = mappings.setdefault(int(oc_map_id), [])
+        if not attribute:
+            continue
+        # The values of the attribute for the entry's key, as back-sql selects them.
+        where = "{}.{} = e.keyval".format(keytbl, keycol)
+        if join_where:
+            where += " and ({})".format(join_where)
+        attributes.append(
+            "{}, array(select ({})::text from {} where {})".format(sql_literal(attribute), sel_expr, from_tbls, where)
+        )
+    selects = []
+    for oc_map_id, attributes in sorted(mappings.items()):
+        # Functions take at most 100 arguments, so large mappings are built in parts.
+        parts = []
+        for start in range(0, max(len(attributes), 1), MAX_ATTRIBUTES):
+            end = start + MAX_ATTRIBUTES
+            parts.append("json_build_object({})::jsonb".format(", ".join(attributes[start:end])))
+        selects.append(
+            "select e.id, e.dn, oc.name, "
+            "to_json(array(select oc_name from ldap_entry_objclasses where entry_id = e.id)), "
+            "{attributes} "
+            "from ldap_entries e join ldap_oc_mappings oc on oc.id = e.oc_map_id "
+            "where e.oc_map_id = {oc_map_id}".format(attributes=" || ".join(parts), oc_map_id=oc_map_id)
+        )
+    # A child's DN has more commas than its parent's.
+    return (
+        "select dn, oc_name, object_classes, attributes from ({}) entries(id, dn, oc_name, object_classes, attributes) "
+        "order by length(dn) - length(replace(dn, ',', '')), id".format(" union all ".join(selects))
+    )
+
+
+def ldif_line(name, value):
+    """Write an attribute value as an LDIF line."""
+    if value == "" or SAFE_STRING.fullmatch(value) and not value.endswith(" "):
+        return "{}: {}\n".format(name, value)
+    return "{}:: {}\n".format(name, base64.b64encode(value.encode()).decode())
+
+
+def ldif_entry(dn, oc_name, object_classes, attributes):
+    """Write an exported row as an LDIF entry."""
+    lines = [ldif_line("dn", dn), ldif_line("objectClass", oc_name)]
+    lines.extend(ldif_line("objectClass", name) for name in object_classes if name != oc_name)
+    for name, values in attributes.items():
+        lines.extend(ldif_line(name, value) for value in values if value is not None)
+    return "".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="gzipped LDIF file to write")
+    args = parser.parse_args()
+
+    os.environ.update(
+        PGHOST=os.environ["POSTGRES_HOST"],
+        PGPORT=os.environ["POSTGRES_PORT"],
+        PGDATABASE=os.environ["POSTGRES_NAME"],
+        PGUSER=os.environ["POSTGRES_USER"],
+        PGPASSWORD=os.environ["POSTGRES_PASSWORD"],
+        PGAPPNAME="bulk-export",
+    )
+    query = export_query(
+        psql_rows(
+            "select oc.id, oc.keytbl, oc.keycol, am.name, am.sel_expr, am.from_tbls, am.join_where "
+            "from ldap_oc_mappings oc left join ldap_attr_mappings am on am.oc_map_id = oc.id order by am.id"
+        )
+    )
+    copy = "copy ({}) to stdout with (format csv)".format(query)
+    psql = subprocess.Popen(["psql", "-qX", "-v", "ON_ERROR_STOP=1", "-c", copy], stdout=subprocess.PIPE)
+    # Values may hold any line endings, which the CSV reader has to see as they are.
+    rows = csv.reader(io.TextIOWrapper(psql.stdout, encoding="utf-8", newline=""))
+    start = time.monotonic()
+    entries = 0
+    with gzip.open(args.path + ".part", "wt", encoding="utf-8") as ldif:
+        ldif.write("version: 1\n\n")
+        for dn, oc_name, object_classes, attributes in rows:
+            ldif.write(ldif_entry(dn, oc_name, json.loads(object_classes), json.loads(attributes)))
+            entries += 1
+            if entries % PROGRESS_INTERVAL == 0:
+                print(
+                    "Exported {} entries, {:.0f} entries/s".format(entries, entries / (time.monotonic() - start)),
+                    flush=True,
+                )
+    if psql.wait() != 0:
+        os.remove(args.path + ".part")
+        sys.exit("Export failed")
+    os.replace(args.path + ".part", args.path)
+    elapsed = time.monotonic() - start
+    print(
+        "Exported {} entries to {} in {:.1f}s, {:.0f} entries/s".format(entries, args.path, elapsed, entries / elapsed)
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Load an LDIF file straight into the back-sql tables.
+
+Run in the workload container by the bulk-import action, so it only uses
+the standard library and psql. Entries are streamed from the LDIF file
+into temporary tables with COPY, in batches, then keys and parents are
+resolved and the rows moved into the data tables, ldap_entries and
+ldap_entry_objclasses with a few set-based statements. Everything
+happens in one transaction, so a failed import leaves no trace.
+
+The rows aren't logged one by one in ldap_entry_changes. If the log is
+on, the parents the entries were imported below are logged instead,
+which is enough for the cache invalidator to drop every cached search
+the new entries could be in.
+
+Attributes must be mapped in ldap_attr_mappings either to a column of
+their object class's key table, or to a column of a table joined to it
+on a single key column (join_where being "valtbl.fk = keytbl.keycol"),
+which may hold any number of values, like the default mappings'
+memberUid and member. Anything else has to go through slapd.
+"""
+
+import argparse
+import base64
+import binascii
+import gzip
+import os
+import re
+import subprocess
+import sys
+import time
+
+FIELD_SEPARATOR = "\x1f"
+COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+class LDIFError(Exception):
+    """The LDIF can't be imported."""
+
+
+class ObjectClassMapping:
+    """A back-sql object class mapping, and the attributes stored as columns of its key table or joined tables."""
+
+    def __init__(self, oc_map_id, name, keytbl, keycol):
+        self.id = oc_map_id
+        self.name = name
+        self.keytbl = keytbl
+        self.keycol = keycol
+        self.columns = {}
+        # Attributes in tables joined to the key table, as (table, foreign key, column).
+        self.joined = {}
+
+    @property
+    def staging_table(self):
+        """The temporary table the entries' rows are copied into."""
+        return "import_oc_{}".format(self.id)
+
+    def column_list(self):
+        """The key column and the mapped columns, in a fixed order."""
+        return [self.keycol] + sorted(set(self.columns.values()))
+
+    def joined_staging_table(self, attribute):
+        """The temporary table the values of a joined attribute are copied into."""
+        return "import_oc_{}_{}".format(self.id, sorted(self.joined).index(attribute))
+
+    def attributes(self):
+        """The lowercased names of the attributes the mapping can store."""
+        return set(self.columns) | set(self.joined)
+
+
+def psql_rows(query):
+    """Run a query, returning its rows as lists of fields."""
+    output = subprocess.run(
+        ["psql", "-qtAX", "-v", "ON_ERROR_STOP=1", "-F", FIELD_SEPARATOR, "-c", query],
+        check=True,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    ).stdout
+    return [line.split(FIELD_SEPARATOR) for line in output.splitlines() if line]
+
+
+def load_mappings(rows):
+    """Build object class mappings, by lowercased name, from mapping rows.
+
+    Each row is an object class mapping with one of its attribute mappings,
+    if any: oc id, oc name, keytbl, keycol, attribute name, sel_expr, from_tbls,
+    join_where."""
+    mappings = {}
+    for oc_map_id, name, keytbl, keycol, attribute, sel_expr, from_tbls, join_where in rows:
+        mapping = mappings.setdefault(name.lower(), ObjectClassMapping(int(oc_map_id), name, keytbl, keycol))
+        if not attribute:
+            continue
+        table, _, column = sel_expr.strip().partition(".")
+        if not re.fullmatch(r"\w+", column):
+            continue
+        tables = {tbl.strip() for tbl in from_tbls.split(",")}
+        if tables == {keytbl} and table == keytbl:
+            mapping.columns[attribute.lower()] = column
+        elif tables == {keytbl, table} and table != keytbl:
+            join = re.fullmatch(r"(\w+)\.(\w+)\s*=\s*(\w+)\.(\w+)", join_where.strip())
+            if not join:
+                continue
+            sides = {join.group(1): join.group(2), join.group(3): join.group(4)}
+            if sides.get(keytbl) == keycol and table in sides:
+                mapping.joined[attribute.lower()] = (table, sides[table], column)
+    return mappings
+
+
+def split_dn(dn):
+    """Split a DN into RDNs, tidying the spaces around them."""
+    return [rdn.strip() for rdn in re.split(r"(?<!\\),", dn)]
+
+
+def parse_ldif(lines):
+    """Yield (dn, [(attribute, value)]) for each entry of a content LDIF."""
+    dn = None
+    attributes = []
+    logical = []
+
+    def records():
+        # (line number, line) with folded lines unfolded. Comments are
+        # kept until then, since they can be folded too.
+        number = 0
+        for number, line in enumerate(lines, 1):
+            line = line.rstrip("\r\n")
+            if line.startswith(" ") and logical:
+                logical[-1][1] += line[1:]
+                continue
+            if logical:
+                yield logical.pop()
+            if line:
+                logical.append([number, line])
+            else:
+                yield number, ""
+        if logical:
+            yield logical.pop()
+        yield number, ""
+
+    for number, record in records():
+        if record.startswith("#"):
+            continue
+        if not record:
+            if dn is not None:
+                yield dn, attributes
+            dn, attributes = None, []
+            continue
+        name, sep, value = record.partition(":")
+        if not sep:
+            raise LDIFError("Invalid LDIF line {}: {}".format(number, record))
+        if value.startswith(":"):
+            try:
+                value = base64.b64decode(value[1:].strip(), validate=True).decode()
+            except (binascii.Error, UnicodeDecodeError) as e:
+                raise LDIFError("Line {}: {} isn't a base64 encoded UTF-8 value: {}".format(number, name, e))
+        elif value.startswith("<"):
+            raise LDIFError("URL values are not supported: {}".format(record))
+        else:
+            value = value.lstrip(" ")
+        if dn is None:
+            if name.lower() == "version":
+                continue
+            if name.lower() != "dn":
+                raise LDIFError("Expected a dn line, got: {}".format(record))
+            dn = ",".join(split_dn(value))
+        elif name.lower() == "changetype":
+            raise LDIFError("Only content LDIF can be imported, {} has a changetype".format(dn))
+        else:
+            attributes.append((name, value))
+
+
+def copy_value(value):
+    """Escape a value for COPY's text format."""
+    return "\\N" if value is None else value.translate(COPY_ESCAPES)
+
+
+class Importer:
+    """Write the SQL and COPY data for an import to a psql session."""
+
+    def __init__(self, out, mappings, suffix, batch_size):
+        self.out = out
+        self.mappings = mappings
+        self.suffix = suffix
+        self.batch_size = batch_size
+        self.entries = 0
+        self.used = {}
+        self.batch = []
+
+    def begin(self):
+        """Create the temporary tables the LDIF is copied into."""
+        self.out.write("set client_min_messages to warning;\nset local ldap.entry_change_log to off;\n")
+        self.out.write(
+            "create temp table import_entries (seq bigint, dn text, parent_dn text, oc_map_id integer, "
+            "id integer, parent integer, keyval integer) on commit drop;\n"
+            "create temp table import_objclasses (seq bigint, oc_name text) on commit drop;\n"
+        )
+        for mapping in self.mappings.values():
+            self.out.write(
+                "create temp table {table} on commit drop as select {columns} from {keytbl} with no data;\n"
+                "alter table {table} add column import_seq bigint;\n".format(
+                    table=mapping.staging_table, columns=", ".join(mapping.column_list()), keytbl=mapping.keytbl
+                )
+            )
+            for attribute, (table, _, column) in sorted(mapping.joined.items()):
+                self.out.write(
+                    "create temp table {staging} on commit drop as select {column} from {table} with no data;\n"
+                    "alter table {staging} add column import_seq bigint;\n".format(
+                        staging=mapping.joined_staging_table(attribute), column=column, table=table
+                    )
+                )
+
+    def mapping_for(self, dn, object_classes, names):
+        """The mapping of the entry's most specific mapped object class.
+
+        That is the one able to store every attribute of the entry, and of
+        those, the one with the most attributes, whatever order the LDIF
+        lists the object classes in. `names` maps the lowercased names of
+        the entry's attributes to their names in the LDIF."""
+        candidates = {
+            name.lower(): self.mappings[name.lower()] for name in object_classes if name.lower() in self.mappings
+        }
+        if not candidates:
+            raise LDIFError("{} has no object class mapped in ldap_oc_mappings".format(dn))
+        ranked = sorted(candidates.values(), key=lambda mapping: (-len(mapping.attributes()), mapping.name.lower()))
+        for mapping in ranked:
+            if names.keys() <= mapping.attributes():
+                return mapping
+        closest = min(ranked, key=lambda mapping: len(names.keys() - mapping.attributes()))
+        unmapped = min(names.keys() - closest.attributes())
+        raise LDIFError(
+            "{}: {} isn't mapped to a column of {} or a table joined to it for {}".format(
+                dn, names[unmapped], closest.keytbl, closest.name
+            )
+        )
+
+    def add(self, dn, attributes):
+        """Queue an entry, copying the batch once it is full."""
+        object_classes = [value for name, value in attributes if name.lower() == "objectclass"]
+        names = {name.lower(): name for name, _ in attributes if name.lower() != "objectclass"}
+        mapping = self.mapping_for(dn, object_classes, names)
+        values = {}
+        joined = []
+        for name, value in attributes:
+            if name.lower() == "objectclass":
+                continue
+            if name.lower() in mapping.joined:
+                joined.append((name.lower(), value))
+                continue
+            column = mapping.columns[name.lower()]
+            if column in values:
+                raise LDIFError("{}: {} has more than one value".format(dn, name))
+            values[column] = value
+        extra_classes = [value for value in object_classes if value.lower() not in (mapping.name.lower(), "top")]
+        self.batch.append((dn, mapping, values, joined, extra_classes))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """COPY the queued entries into the temporary tables."""
+        if not self.batch:
+            return
+        entries, objclasses, rows, joined_rows = [], [], {}, {}
+        for dn, mapping, values, joined, extra_classes in self.batch:
+            self.entries += 1
+            rdns = split_dn(dn)
+            parent_dn = "" if dn.lower() == self.suffix.lower() else ",".join(rdns[1:])
+            entries.append([str(self.entries), dn, parent_dn, str(mapping.id)])
+            objclasses.extend([str(self.entries), oc_name] for oc_name in extra_classes)
+            columns = mapping.column_list()[1:]
+            rows.setdefault(mapping, []).append([values.get(column) for column in columns] + [str(self.entries)])
+            for attribute, value in joined:
+                staging = (mapping.joined_staging_table(attribute), mapping.joined[attribute][2])
+                joined_rows.setdefault(staging, []).append([value, str(self.entries)])
+            self.used[mapping.id] = mapping
+        self._copy("import_entries (seq, dn, parent_dn, oc_map_id)", entries)
+        self._copy("import_objclasses (seq, oc_name)", objclasses)
+        for mapping, mapping_rows in rows.items():
+            columns = mapping.column_list()[1:] + ["import_seq"]
+            self._copy("{} ({})".format(mapping.staging_table, ", ".join(columns)), mapping_rows)
+        for (staging, column), values in sorted(joined_rows.items()):
+            self._copy("{} ({}, import_seq)".format(staging, column), values)
+        self.batch = []
+
+    def _copy(self, target, rows):
+        if not rows:
+            return
+        self.out.write("copy {} from stdin;\n".format(target))
+        for row in rows:
+            self.out.write("\t".join(copy_value(value) for value in row) + "\n")
+        self.out.write("\\.\n")
+
+    def finish(self):
+        """Allocate keys and entry ids, resolve parents and move the rows into place."""
+        self.flush()
+        write = self.out.write
+        write("create index on import_entries (upper(dn));\nanalyze import_entries;\n")
+        for mapping in self.used.values():
+            params = dict(
+                table=mapping.staging_table,
+                keytbl=mapping.keytbl,
+                keycol=mapping.keycol,
+                columns=", ".join(mapping.column_list()),
+                oc_map_id=mapping.id,
+            )
+            write(
+                "lock table {keytbl} in exclusive mode;\n"
+                "update {table} s set {keycol} = k.keyval from ("
+                "select import_seq, coalesce((select max({keycol}) from {keytbl}), 0) "
+                "+ row_number() over (order by import_seq) as keyval from {table}) k "
+                "where k.import_seq = s.import_seq;\n"
+                "insert into {keytbl} ({columns}) select {columns} from {table};\n"
+                "select setval(pg_get_serial_sequence('{keytbl}', '{keycol}'), max({keycol})) from {keytbl} "
+                "having pg_get_serial_sequence('{keytbl}', '{keycol}') is not null;\n"
+                "update import_entries e set keyval = s.{keycol} from {table} s "
+                "where s.import_seq = e.seq and e.oc_map_id = {oc_map_id};\n".format(**params)
+            )
+            # Repeated values are stored once, as the add_proc of such mappings usually ensures.
+            for attribute, (table, foreign_key, column) in sorted(mapping.joined.items()):
+                write(
+                    "insert into {table} ({foreign_key}, {column}) select distinct s.{keycol}, v.{column} "
+                    "from {joined} v join {staging} s on s.import_seq = v.import_seq;\n".format(
+                        table=table,
+                        foreign_key=foreign_key,
+                        column=column,
+                        keycol=mapping.keycol,
+                        joined=mapping.joined_staging_table(attribute),
+                        staging=mapping.staging_table,
+                    )
+                )
+        write(
+            "lock table ldap_entries in exclusive mode;\n"
+            "update import_entries set id = nextval('ldap_entries_id_seq'), parent = case when parent_dn = '' "
+            "then 0 end;\n"
+            "update import_entries e set parent = p.id from import_entries p "
+            "where e.parent is null and upper(p.dn) = upper(e.parent_dn);\n"
+            "update import_entries e set parent = p.id from ldap_entries p "
+            "where e.parent is null and upper(p.dn) = upper(e.parent_dn);\n"
+            "do $$ declare orphan text; begin "
+            "select dn into orphan from import_entries where parent is null limit 1; "
+            "if found then raise exception 'The parent of % is neither in the LDIF nor the directory', orphan; "
+            "end if; end $$;\n"
+            "insert into ldap_entries (id, dn, oc_map_id, parent, keyval) "
+            "select id, dn, oc_map_id, parent, keyval from import_entries order by seq;\n"
+            "insert into ldap_entry_objclasses (entry_id, oc_name) "
+            "select e.id, o.oc_name from import_objclasses o join import_entries e on e.seq = o.seq;\n"
+            "insert into ldap_entry_changes (dn) select distinct p.dn from import_entries e "
+            "join ldap_entries p on p.id = e.parent "
+            "where not exists (select 1 from import_entries i where i.id = p.id) "
+            "and ldap_entry_change_log_enabled();\n"
+        )
+
+
+def open_ldif(path):
+    """Open an LDIF file, which may be gzipped."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="LDIF file to import, optionally gzipped")
+    parser.add_argument("--suffix", default="dc=example", help="the directory suffix, whose entry has no parent")
+    parser.add_argument("--batch-size", type=int, default=10000, help="entries per COPY")
+    args = parser.parse_args()
+
+    os.environ.update(
+        PGHOST=os.environ["POSTGRES_HOST"],
+        PGPORT=os.environ["POSTGRES_PORT"],
+        PGDATABASE=os.environ["POSTGRES_NAME"],
+        PGUSER=os.environ["POSTGRES_USER"],
+        PGPASSWORD=os.environ["POSTGRES_PASSWORD"],
+        PGAPPNAME="bulk-import",
+    )
+    mappings = load_mappings(
+        psql_rows(
+            "select oc.id, oc.name, oc.keytbl, oc.keycol, am.name, am.sel_expr, am.from_tbls, am.join_where "
+            "from ldap_oc_mappings oc left join ldap_attr_mappings am on am.oc_map_id = oc.id"
+        )
+    )
+
+    psql = subprocess.Popen(
+        ["psql", "-qX", "-v", "ON_ERROR_STOP=1", "--single-transaction", "-o", "/dev/null", "-f", "-"],
+        stdin=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    importer = Importer(psql.stdin, mappings, args.suffix, args.batch_size)
+    start = time.monotonic()
+    try:
+        importer.begin()
+        with open_ldif(args.path) as ldif:
+            for dn, attributes in parse_ldif(ldif):
+                importer.add(dn, attributes)
+                if importer.entries and not importer.batch:
+                    elapsed = time.monotonic() - start
+                    print(
+                        "Copied {} entries, {:.0f} entries/s".format(importer.entries, importer.entries / elapsed),
+                        flush=True,
+                    )
+        print("Resolving keys and parents", flush=True)
+        importer.finish()
+        psql.stdin.close()
+    except (LDIFError, BrokenPipeError) as e:
+        psql.kill()
+        psql.wait()
+        sys.exit("Import failed, nothing was imported: {}".format(e))
+    if psql.wait() != 0:
+        sys.exit("Import failed, nothing was imported")
+    elapsed = time.monotonic() - start
+    print(
+        "Imported {} entries in {:.1f}s, {:.0f} entries/s".format(importer.entries, elapsed, importer.entries / elapsed)
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -5,57 +5,192 @@
 """OpenLDAP Charm - a sidecar charm for openldap
 with the option to relate to a PostgreSQL database."""
 
+import json
 import logging
+import os
 import random
+import re
 import string
+from pathlib import Path
 
-import ops.lib
-from ops.charm import CharmBase, CharmEvents
-from ops.framework import EventBase, EventSource, StoredState
+from ops.charm import CharmBase
 from ops.main import main
-from ops.model import ActiveStatus, MaintenanceStatus, WaitingStatus
+from ops.model import ActiveStatus, BlockedStatus, MaintenanceStatus, WaitingStatus
+from ops.pebble import ExecError
+from pgconnstr import ConnectionString
 
+import kubernetes_service
+import slapd_config
 from leadership import LeadershipSettings
 
-pgsql = ops.lib.use("pgsql", 1, "postgresql-charmers@lists.launchpad.net")
-
 logger = logging.getLogger(__name__)
 
 
 DATABASE_NAME = 'openldap'
 
+# The suffix slapd serves, as in templates/.
+LDAP_BASE_DN = 'dc=example'
 
-class OpenLDAPDBMasterAvailableEvent(EventBase):
-    """OpenLDAP empty handler for master available."""
+# back-sql keeps the directory in PostgreSQL, back-mdb on the unit's storage,
+# replicated from the leader with syncrepl.
+BACKENDS = ('sql', 'mdb')
 
+# slapd.conf settings from charm config. 0 threads or listener threads
+# means the workload works them out from its CPU limit.
+TUNING_OPTIONS = {
+    'threads': 'SLAPD_THREADS',
+    'listener_threads': 'SLAPD_LISTENER_THREADS',
+    'conn_max_pending': 'SLAPD_CONN_MAX_PENDING',
+    'conn_max_pending_auth': 'SLAPD_CONN_MAX_PENDING_AUTH',
+    'idletimeout': 'SLAPD_IDLETIMEOUT',
+    'sizelimit': 'SLAPD_SIZELIMIT',
+    'timelimit': 'SLAPD_TIMELIMIT',
+}
 
-class OpenLDAPCharmEvents(CharmEvents):
-    """Custom charm events."""
+MIGRATE_SCHEMA_COMMAND = ["/srv/image-scripts/migrate-schema.sh"]
+# Turns the log of changed entries the cache invalidator reads on or off.
+ENTRY_CHANGE_LOG_COMMAND = ["/srv/image-scripts/entry-change-log.sh"]
 
-    db_master_available = EventSource(OpenLDAPDBMasterAvailableEvent)
+# The level passed to `slapd -d`, which keeps slapd in the foreground.
+# It is part of the openldap service's command, so it stays the same
+# whatever the log profile, or changing the profile would restart slapd.
+SLAPD_DEBUG_LEVEL = 0
 
+# Settings of the openldap service that the running slapd takes through
+# cn=config. Changing anything else restarts it.
+LIVE_SETTINGS = {
+    'SLAPD_LOG_LEVEL',
+    'SLAPD_THREADS',
+    'SLAPD_CONN_MAX_PENDING',
+    'SLAPD_CONN_MAX_PENDING_AUTH',
+    'SLAPD_IDLETIMEOUT',
+    'SLAPD_SIZELIMIT',
+    'SLAPD_TIMELIMIT',
+}
+APPLY_LIVE_CONFIG_COMMAND = ["/srv/image-scripts/apply-live-config.sh"]
 
-class OpenLDAPK8sCharm(CharmBase):
-    """Charm the service as a sidecar charm."""
+# Where the workload container's CPU limit is, with cgroup v2 and v1.
+CPU_MAX = "/sys/fs/cgroup/cpu.max"
+CPU_CFS_QUOTA = "/sys/fs/cgroup/cpu/cpu.cfs_quota_us"
+CPU_CFS_PERIOD = "/sys/fs/cgroup/cpu/cpu.cfs_period_us"
+
+# Read the cache and search counters from slapd's monitor database as the
+# admin, over the local socket.
+CACHE_STATS_COMMAND = [
+    "ldapsearch",
+    "-LLL",
+    "-Q",
+    "-Y",
+    "EXTERNAL",
+    "-H",
+    "ldapi:///",
+    "-o",
+    "ldif-wrap=no",
+    "-b",
+    "cn=Monitor",
+    "(|(pcacheNumQueries=*)(&(cn=Search)(monitorOpCompleted=*)))",
+    "monitorOpCompleted",
+    "pcacheNumQueries",
+    "pcacheNumEntries",
+    "pcacheQueryURL",
+]
+
+METRICS_PORT = 9330
+
+SLOW_QUERY_LOG = "/var/log/slapd-slow-queries.jsonl"
+
+# Where actions copy the charm's scripts to run them in the workload container.
+CHARM_SCRIPTS_DIR = "/srv/charm-scripts"
+
+PGBOUNCER_PORT = 6432
+PGBOUNCER_CONFIG = "/etc/pgbouncer/pgbouncer.ini"
+PGBOUNCER_USERLIST = "/etc/pgbouncer/userlist.txt"
+PGBOUNCER_INI_TEMPLATE = """\
+[databases]
+{dbname} = host={host} port={port} dbname={dbname}
+
+[pgbouncer]
+listen_addr = 127.0.0.1
+listen_port = {listen_port}
+auth_type = md5
+auth_file = {auth_file}
+pool_mode = transaction
+default_pool_size = {pool_size}
+min_pool_size = {min_pool_size}
+reserve_pool_size = {reserve_pool_size}
+max_client_conn = {max_client_conn}
+ignore_startup_parameters = extra_float_digits
+"""
 
-    _state = StoredState()
+# Each log profile sets the slapd.conf `loglevel` and the psqlODBC
+# Debug/CommLog flags together. slapd takes a new `loglevel` through
+# cn=config, the ODBC driver only reads its flags when slapd starts.
+# slapd sends what `loglevel` selects to syslog, which the syslog service
+# prints for Pebble.
+LOG_PROFILES = {
+    'production': {
+        'SLAPD_LOG_LEVEL': 'none',
+        'ODBC_DEBUG': '0',
+        'ODBC_COMMLOG': '0',
+    },
+    'diagnostic': {
+        'SLAPD_LOG_LEVEL': 'stats',
+        'ODBC_DEBUG': '0',
+        'ODBC_COMMLOG': '0',
+    },
+    'trace': {
+        'SLAPD_LOG_LEVEL': 'trace args stats',
+        'ODBC_DEBUG': '1',
+        'ODBC_COMMLOG': '1',
+    },
+}
 
-    on = OpenLDAPCharmEvents()
+
+class OpenLDAPK8sCharm(CharmBase):
+    """Charm the service as a sidecar charm."""
 
     def __init__(self, *args):
         super().__init__(*args)
 
         self.leader_data = LeadershipSettings()
+        # Leadership settings written during the hook are set together at its end.
+        self.framework.observe(self.framework.on.commit, self._on_commit)
+        # The primary and standby databases, read from the db relation
+        # when first needed. The charm is instantiated for every hook.
+        self._databases = None
 
-        self.framework.observe(self.on.config_changed, self._on_config_changed)
+        # Every event that may change what the workload should look like
+        # reconciles it with the current state. Nothing is deferred: a unit
+        # that can't be configured yet waits for the next of these events.
+        self.framework.observe(self.on.config_changed, self._reconcile)
+        # Non-leaders wait for the leader to set the admin password and
+        # migrate the schema, which it shares through leadership settings.
+        self.framework.observe(self.on.leader_settings_changed, self._on_leader_settings_changed)
+        self.framework.observe(self.on.leader_elected, self._on_leader_elected)
+        self.framework.observe(self.on.upgrade_charm, self._on_upgrade_charm)
+        self.framework.observe(self.on.openldap_pebble_ready, self._reconcile)
+        self.framework.observe(self.on.pgbouncer_pebble_ready, self._reconcile)
+        # Retries what failed for reasons outside the charm, like a schema migration.
+        self.framework.observe(self.on.update_status, self._reconcile)
         self.framework.observe(self.on.get_admin_password_action, self._on_get_admin_password_action)
+        self.framework.observe(self.on.get_cache_stats_action, self._on_get_cache_stats_action)
+        self.framework.observe(self.on.get_slow_queries_action, self._on_get_slow_queries_action)
+        self.framework.observe(self.on.bulk_import_action, self._on_bulk_import_action)
+        self.framework.observe(self.on.export_action, self._on_export_action)
+        self.framework.observe(self.on.metrics_endpoint_relation_joined, self._on_metrics_endpoint_relation_joined)
+        # With back-mdb, units replicate from the address the leader shares here.
+        self.framework.observe(self.on.replicas_relation_changed, self._reconcile)
+        # LDAP clients are told where to connect.
+        self.framework.observe(self.on.ldap_relation_joined, self._reconcile)
+        self.framework.observe(self.on.remove, self._on_remove)
 
         # database
-        self._state.set_default(postgres=None)
-        self.db = pgsql.PostgreSQLClient(self, 'db')
-        self.framework.observe(self.db.on.database_relation_joined, self._on_database_relation_joined)
-        self.framework.observe(self.db.on.database_relation_broken, self._on_database_relation_broken)
-        self.framework.observe(self.db.on.master_changed, self._on_master_changed)
+        # The databases are read from the relation, so any change to it may
+        # move the workload.
+        self.framework.observe(self.on.db_relation_joined, self._on_database_relation_joined)
+        self.framework.observe(self.on.db_relation_changed, self._reconcile)
+        self.framework.observe(self.on.db_relation_departed, self._reconcile)
+        self.framework.observe(self.on.db_relation_broken, self._on_database_relation_broken)
 
     @staticmethod
     def _pwgen(length=None):
@@ -72,45 +207,418 @@ class OpenLDAPK8sCharm(CharmBase):
         random_chars = [random_generator.choice(alphanumeric_chars) for _ in range(length)]
         return ''.join(random_chars)
 
-    def _on_database_relation_joined(self, event: pgsql.DatabaseRelationJoinedEvent):
+    def _request_database(self):
+        """Ask the PostgreSQL charm for the database.
+
+        The leader asks in the application data. Every unit also asks in
+        its own data, which older PostgreSQL charms wait to agree on."""
+        for relation in self.model.relations['db']:
+            databags = [relation.data[self.unit]]
+            if self.unit.is_leader():
+                databags.append(relation.data[self.app])
+            for data in databags:
+                if data.get('database') != DATABASE_NAME:
+                    data['database'] = DATABASE_NAME
+
+    def _on_database_relation_joined(self, event):
         """Handle db-relation-joined."""
-        if self.model.unit.is_leader():
-            # Provide requirements to the PostgreSQL server.
-            event.database = DATABASE_NAME  # Request database named mydbname
-        elif event.database != DATABASE_NAME:
-            # Leader has not yet set requirements. Defer, in case this unit
-            # becomes leader and needs to perform that operation.
-            event.defer()
-
-    def _on_database_relation_broken(self, _):
+        self._request_database()
+        self._reconcile(event)
+
+    def _on_leader_elected(self, event):
+        """Request the database if the previous leader didn't get to it, then reconcile."""
+        self._request_database()
+        self._reconcile(event)
+
+    def _on_leader_settings_changed(self, event):
+        """Reconcile with the settings the leader has changed."""
+        self.leader_data.invalidate()
+        self._reconcile(event)
+
+    def _on_commit(self, _):
+        """Set the leadership settings written during the hook."""
+        self.leader_data.commit()
+
+    def _on_database_relation_broken(self, event):
         """Handle db-relation-broken."""
-        self._state.postgres = None
-        self.unit.status = WaitingStatus('Waiting for database relation')
-
-    def _on_master_changed(self, event: pgsql.MasterChangedEvent):
-        """Handle changes in the primary database unit."""
-        if event.database != DATABASE_NAME:
-            # Leader has not yet set requirements. Wait until next
-            # event, or risk connecting to an incorrect database.
+        # The relation is still in the model while it is being broken.
+        self._databases = (None, [])
+        self._reconcile(event)
+
+    def _database_state(self):
+        """The primary database and the hot standbys, read from the db relation.
+
+        Nothing is stored, so there is no state to keep in sync with the
+        relation, or to lose when the pod is rescheduled."""
+        if self._databases is not None:
+            return self._databases
+        self._databases = (None, [])
+        relation = self.model.get_relation('db')
+        if relation is None or relation.app is None:
+            return self._databases
+        master = standbys = None
+        egress_subnets = set(self._split_subnets(relation.data[self.unit].get('egress-subnets')))
+        for entity in sorted((relation.app, *relation.units), key=lambda entity: entity.name):
+            data = relation.data[entity]
+            # Until the PostgreSQL charm has created the requested database
+            # and let this unit in, its connection strings are not for us.
+            if data.get('database') != DATABASE_NAME or data.get('roles') or data.get('extensions'):
+                continue
+            if not egress_subnets <= set(self._split_subnets(data.get('allowed-subnets'))):
+                continue
+            if master is None and data.get('master'):
+                master = data['master']
+            if standbys is None and data.get('standbys'):
+                standbys = [conn_str for conn_str in data['standbys'].splitlines() if conn_str]
+        if master is not None:
+            self._databases = (
+                self._connection_details(ConnectionString(master)),
+                [self._connection_details(ConnectionString(standby)) for standby in standbys or []],
+            )
+        return self._databases
+
+    @staticmethod
+    def _split_subnets(subnets):
+        """The subnets in a comma separated list."""
+        return [subnet.strip() for subnet in (subnets or "").split(",") if subnet.strip()]
+
+    def _primary_database(self):
+        """Connection details of the primary database, or None without one."""
+        return self._database_state()[0]
+
+    def _standby_databases(self):
+        """Connection details of the hot standbys."""
+        return self._database_state()[1]
+
+    @staticmethod
+    def _connection_details(conn_str):
+        """The parts of a pgsql connection string the workload needs."""
+        return {
+            'dbname': conn_str.dbname,
+            'user': conn_str.user,
+            'password': conn_str.password,
+            'host': conn_str.host,
+            'port': conn_str.port,
+        }
+
+    def _unit_address(self):
+        """The stable DNS name of this unit's pod."""
+        return "{}.{}-endpoints.{}.svc.cluster.local".format(
+            self.unit.name.replace("/", "-"), self.app.name, self.model.name
+        )
+
+    def _sql_backend(self):
+        """Whether the directory is kept in PostgreSQL with back-sql."""
+        return self.config["backend"] != "mdb"
+
+    def _sync_provider(self):
+        """The URI of the leader's slapd, which the other units replicate back-mdb from.
+
+        None on the leader, or before the leader has shared its address."""
+        if self.unit.is_leader():
+            return None
+        relation = self.model.get_relation("replicas")
+        address = relation.data[self.app].get("provider") if relation else None
+        if not address:
+            return None
+        return "ldap://{}:{}".format(address, self.config["container_port"])
+
+    def _share_sync_provider(self):
+        """As the leader, tell the other units where to replicate from."""
+        relation = self.model.get_relation("replicas")
+        if relation and relation.data[self.app].get("provider") != self._unit_address():
+            relation.data[self.app]["provider"] = self._unit_address()
+
+    def _write_referral(self):
+        """Where this unit refers LDAP writes, or None if it handles them itself.
+
+        With read_from_standbys, the leader serves writes from the primary
+        database and the other units refer writes to it. With back-mdb, the
+        other units are read-only replicas of the leader."""
+        if not self._sql_backend():
+            return self._sync_provider()
+        if not self.config["read_from_standbys"] or self.unit.is_leader():
+            return None
+        if not self._standby_databases() or not self.leader_data["primary_address"]:
+            return None
+        return "ldap://{}:{}".format(self.leader_data["primary_address"], self.config["container_port"])
+
+    def _workload_database(self):
+        """The database this unit's slapd connects to.
+
+        Units referring writes to the leader are spread across the standbys
+        by unit number, everything else uses the primary. With back-mdb,
+        replicas refer writes to the leader but use no database at all."""
+        standbys = sorted(self._standby_databases(), key=lambda standby: (standby['host'], standby['port']))
+        if not self._sql_backend() or not standbys or not self._write_referral():
+            return self._primary_database()
+        unit_number = int(self.unit.name.split("/")[-1])
+        return standbys[unit_number % len(standbys)]
+
+    def _odbc_database(self):
+        """The database slapd's ODBC connection points at, possibly through PgBouncer."""
+        database = self._workload_database()
+        if not self.config["pgbouncer_enabled"]:
+            return database
+        return {**database, 'host': '127.0.0.1', 'port': str(PGBOUNCER_PORT)}
+
+    def _postgres_environment(self, database=None):
+        """Environment variables describing the database connection."""
+        if database is None:
+            database = self._primary_database()
+        return {
+            'POSTGRES_NAME': database['dbname'],
+            'POSTGRES_USER': database['user'],
+            'POSTGRES_PASSWORD': database['password'],
+            'POSTGRES_HOST': database['host'],
+            'POSTGRES_PORT': database['port'],
+        }
+
+    def _database_id(self):
+        """Identify the database, to know whether its schema has been migrated."""
+        return "{host}:{port}/{dbname}".format(**self._primary_database())
+
+    def _on_metrics_endpoint_relation_joined(self, event):
+        """Tell Prometheus how to scrape the exporter, like the prometheus_scrape library does."""
+        event.relation.data[self.unit].update(
+            {
+                "prometheus_scrape_unit_address": self._unit_address(),
+                "prometheus_scrape_unit_name": self.unit.name,
+            }
+        )
+        if not self.unit.is_leader():
             return
+        event.relation.data[self.app].update(
+            {
+                "scrape_metadata": json.dumps(
+                    {
+                        "model": self.model.name,
+                        "model_uuid": self.model.uuid,
+                        "application": self.app.name,
+                        "charm_name": self.meta.name,
+                    }
+                ),
+                # Prometheus replaces the "*" with each unit's address.
+                "scrape_jobs": json.dumps(
+                    [{"metrics_path": "/metrics", "static_configs": [{"targets": ["*:{}".format(METRICS_PORT)]}]}]
+                ),
+            }
+        )
+
+    def _on_upgrade_charm(self, event):
+        """Check for new schema migrations, which may come with a new image."""
+        if self.unit.is_leader():
+            self.leader_data["schema_database"] = ""
+        self._reconcile(event)
+
+    def _migrate_schema(self, container):
+        """Apply any schema migrations the database doesn't have yet.
+
+        Only the leader does this, once per database. The migration runner
+        itself checks the schema version and skips migrations already applied."""
+        process = container.exec(MIGRATE_SCHEMA_COMMAND, environment=self._postgres_environment())
+        stdout, _ = process.wait_output()
+        for line in stdout.splitlines():
+            logger.info(line)
+        self.leader_data["schema_database"] = self._database_id()
+
+    def _entry_change_log_database(self):
+        """The database whose entry change log should be on, or "" for none.
+
+        Only the cache invalidator reads the log, so it is off unless the
+        cache is enabled, rather than slowing down every write."""
+        return self._database_id() if self._cache_enabled() else ""
 
-        self._state.postgres = None
-        if event.master is None:
+    def _switch_entry_change_log(self, container):
+        """Turn the entry change log on or off to match the cache, once per database."""
+        database = self._entry_change_log_database()
+        if self.leader_data["entry_change_log"] == database:
             return
+        process = container.exec(
+            ENTRY_CHANGE_LOG_COMMAND + ["true" if database else "false"], environment=self._postgres_environment()
+        )
+        stdout, _ = process.wait_output()
+        for line in stdout.splitlines():
+            logger.info(line)
+        self.leader_data["entry_change_log"] = database
 
-        self._state.postgres = {
-            'dbname': event.master.dbname,
-            'user': event.master.user,
-            'password': event.master.password,
-            'host': event.master.host,
-            'port': event.master.port,
+    def _tuning_environment(self):
+        """Environment variables for the slapd tuning settings."""
+        environment = {}
+        for option, variable in TUNING_OPTIONS.items():
+            value = self.config[option]
+            if option in ('sizelimit', 'timelimit') and value < 0:
+                value = 'unlimited'
+            environment[variable] = str(value)
+        return environment
+
+    def _odbc_environment(self):
+        """Environment variables for the ODBC driver and connection pool settings."""
+        return {
+            'ODBC_FETCH_SIZE': str(self.config["odbc_fetch_size"]),
+            'ODBC_USE_DECLARE_FETCH': '1' if self.config["odbc_use_declare_fetch"] else '0',
+            'ODBC_POOLING': 'Yes' if self.config["odbc_pooling"] else 'No',
+            'ODBC_POOL_TIMEOUT': str(self.config["odbc_pool_timeout"]),
+            # Prepared statements don't survive PgBouncer's transaction pooling.
+            'ODBC_SERVER_SIDE_PREPARE': '0' if self.config["pgbouncer_enabled"] else '1',
+            'ODBC_APPLICATION_NAME': self._application_name(),
+        }
+
+    def _application_name(self):
+        """The PostgreSQL application_name of this unit's slapd sessions."""
+        return "slapd-{}".format(self.unit.name.replace("/", "-"))
+
+    def _cache_enabled(self):
+        """Whether to cache search results, which only helps back-sql."""
+        return self.config["cache_enabled"] and self._sql_backend()
+
+    def _cache_environment(self):
+        """Environment variables for the search result cache, which is off without templates."""
+        return {
+            'LDAP_CACHE_TEMPLATES': self.config["cache_templates"] if self._cache_enabled() else '',
+            'LDAP_CACHE_MAX_ENTRIES': str(self.config["cache_max_entries"]),
+            'LDAP_CACHE_TTL': str(self.config["cache_ttl"]),
+        }
+
+    def _pgbouncer_files(self):
+        """The PgBouncer configuration and auth files, by path."""
+        database = self._workload_database()
+        return {
+            PGBOUNCER_CONFIG: PGBOUNCER_INI_TEMPLATE.format(
+                dbname=database['dbname'],
+                host=database['host'],
+                port=database['port'],
+                listen_port=PGBOUNCER_PORT,
+                auth_file=PGBOUNCER_USERLIST,
+                pool_size=self.config["pgbouncer_pool_size"],
+                min_pool_size=self.config["pgbouncer_min_pool_size"],
+                reserve_pool_size=self.config["pgbouncer_reserve_pool_size"],
+                max_client_conn=self.config["pgbouncer_max_client_conn"],
+            ),
+            PGBOUNCER_USERLIST: '"{}" "{}"\n'.format(
+                database['user'].replace('"', '""'), database['password'].replace('"', '""')
+            ),
+        }
+
+    def _pgbouncer_layer(self):
+        """A pebble layer for PgBouncer."""
+        return {
+            "summary": "pgbouncer layer",
+            "description": "pebble config layer for pgbouncer",
+            "services": {
+                "pgbouncer": {
+                    "override": "replace",
+                    "startup": "enabled",
+                    # PgBouncer won't run as root.
+                    "command": "pgbouncer -u postgres {}".format(PGBOUNCER_CONFIG),
+                }
+            },
         }
 
-        self.on.db_master_available.emit()
+    def _configure_pgbouncer(self):
+        """Start, reload or stop PgBouncer to match the config.
+
+        Returns False if PgBouncer is enabled but its container isn't ready yet."""
+        container = self.unit.get_container("pgbouncer")
+        if not self.config["pgbouncer_enabled"] or not self._sql_backend():
+            if container.can_connect() and "pgbouncer" in container.get_plan().services:
+                if container.get_service("pgbouncer").is_running():
+                    container.stop("pgbouncer")
+            return True
+
+        if not container.can_connect():
+            return False
+
+        changed = False
+        for path, content in self._pgbouncer_files().items():
+            current = container.pull(path).read() if container.exists(path) else None
+            if current != content:
+                container.push(path, content, make_dirs=True, permissions=0o640, user="postgres", group="postgres")
+                changed = True
+
+        container.add_layer("pgbouncer", self._pgbouncer_layer(), combine=True)
+        if not container.get_service("pgbouncer").is_running():
+            container.start("pgbouncer")
+        elif changed:
+            # PgBouncer reloads its configuration on SIGHUP, keeping client connections.
+            container.send_signal("SIGHUP", "pgbouncer")
+        return True
+
+    def _config_error(self):
+        """Describe what is wrong with the charm config, if anything."""
+        if self.config["log_profile"] not in LOG_PROFILES:
+            return "Invalid log_profile, must be one of: {}".format(", ".join(sorted(LOG_PROFILES)))
+        if self.config["backend"] not in BACKENDS:
+            return "Invalid backend, must be one of: {}".format(", ".join(sorted(BACKENDS)))
+        if self.config["mdb_max_size"] < 1:
+            return "Invalid mdb_max_size, must be at least 1"
+        for option in (
+            'threads',
+            'listener_threads',
+            'conn_max_pending',
+            'conn_max_pending_auth',
+            'idletimeout',
+            'pgbouncer_min_pool_size',
+            'pgbouncer_reserve_pool_size',
+        ):
+            if self.config[option] < 0:
+                return "Invalid {}, must not be negative".format(option)
+        if self.config["odbc_fetch_size"] < 1:
+            return "Invalid odbc_fetch_size, must be at least 1"
+        if self.config["slow_query_threshold"] < 0:
+            return "Invalid slow_query_threshold, must not be negative"
+        if self.config["odbc_pool_timeout"] < 0:
+            return "Invalid odbc_pool_timeout, must not be negative"
+        for option in ('pgbouncer_pool_size', 'pgbouncer_max_client_conn'):
+            if self.config[option] < 1:
+                return "Invalid {}, must be at least 1".format(option)
+        for option in ('cache_max_entries', 'cache_ttl'):
+            if self.config[option] < 1:
+                return "Invalid {}, must be at least 1".format(option)
+        templates = self.config["cache_templates"].split()
+        if self.config["cache_enabled"] and not templates:
+            return "Invalid cache_templates, must not be empty when cache_enabled"
+        for template in templates:
+            if not (template.startswith("(") and template.endswith(")")):
+                return "Invalid cache_templates, {} is not a filter template".format(template)
+        listener_threads = self.config["listener_threads"]
+        if listener_threads & (listener_threads - 1):
+            return "Invalid listener_threads, must be a power of two"
+        if listener_threads > slapd_config.MAX_LISTENER_THREADS:
+            return "Invalid listener_threads, must be at most {}".format(slapd_config.MAX_LISTENER_THREADS)
+        if self.config["service_type"] and self.config["service_type"] not in kubernetes_service.SERVICE_TYPES:
+            return "Invalid service_type, must be empty or one of: {}".format(
+                ", ".join(kubernetes_service.SERVICE_TYPES)
+            )
+        return None
 
     def _openldap_layer(self):
-        """A pebble layer for OpenLDAP."""
-        ldap_admin_password = self.get_admin_password()
+        """A pebble layer for OpenLDAP.
+
+        slapd reads the configuration the charm renders from the openldap
+        service's environment, which records it so that plan changes tell
+        what to apply live and what to restart slapd for."""
+        write_referral = self._write_referral()
+        if self._sql_backend():
+            database_environment = self._postgres_environment(self._odbc_database())
+            backend_environment = {
+                **database_environment,
+                'ODBC_READ_ONLY': '1' if write_referral else '0',
+                **self._odbc_environment(),
+                **self._cache_environment(),
+            }
+            sampler_environment = {
+                # Sample the database itself, as PgBouncer doesn't show running statements.
+                **self._postgres_environment(self._workload_database()),
+                'SLOW_QUERY_THRESHOLD_MS': str(self.config["slow_query_threshold"]),
+                'SLOW_QUERY_APPLICATION_NAME': self._application_name(),
+            }
+        else:
+            database_environment = sampler_environment = {}
+            backend_environment = {
+                'LDAP_SYNC_PROVIDER': self._sync_provider() or '',
+                'LDAP_MDB_MAX_SIZE': str(self.config["mdb_max_size"]),
+            }
 
         return {
             "summary": "openldap layer",
@@ -119,26 +627,202 @@ class OpenLDAPK8sCharm(CharmBase):
                 "openldap": {
                     "override": "replace",
                     "startup": "enabled",
-                    "command": "/srv/image-scripts/configure-and-run-openldap.sh",
+                    "command": slapd_config.slapd_command(SLAPD_DEBUG_LEVEL),
                     "environment": {
-                        'POSTGRES_NAME': self._state.postgres['dbname'],
-                        'POSTGRES_USER': self._state.postgres['user'],
-                        'POSTGRES_PASSWORD': self._state.postgres['password'],
-                        'POSTGRES_HOST': self._state.postgres['host'],
-                        'POSTGRES_PORT': self._state.postgres['port'],
-                        'LDAP_ADMIN_PASSWORD': ldap_admin_password,
+                        'LDAP_BACKEND': self.config["backend"],
+                        'SLAPD_ROOTPW': self._admin_password_hash(),
+                        'LDAP_WRITE_REFERRAL': write_referral or '',
+                        **LOG_PROFILES[self.config["log_profile"]],
+                        **self._tuning_environment(),
+                        **backend_environment,
                     },
-                }
+                },
+                # The cache invalidator and slow query sampler watch PostgreSQL.
+                "cache-invalidator": {
+                    "override": "replace",
+                    "startup": "enabled" if self._cache_enabled() else "disabled",
+                    "command": "/srv/image-scripts/pcache-invalidator.py",
+                    "environment": database_environment,
+                },
+                "slow-query-sampler": {
+                    "override": "replace",
+                    "startup": "enabled" if self.config["slow_query_threshold"] and self._sql_backend() else "disabled",
+                    "command": "/srv/image-scripts/slow-query-sampler.py",
+                    "environment": sampler_environment,
+                },
+                "metrics-exporter": {
+                    "override": "replace",
+                    "startup": "enabled",
+                    "command": "/srv/image-scripts/monitor-exporter.py",
+                    "environment": {'METRICS_PORT': str(METRICS_PORT)},
+                },
+                "syslog": {
+                    "override": "replace",
+                    "startup": "enabled",
+                    "command": "/srv/image-scripts/syslog-forwarder.py",
+                },
             },
             "checks": {
                 "online": {
                     "override": "replace",
-                    "level": "ready",
+                    "level": "alive",
                     "tcp": {"port": self.config["container_port"]},
                 },
+                # Only send traffic to units whose searches reach the database.
+                "ldap-ready": {
+                    "override": "replace",
+                    "level": "ready",
+                    "period": "10s",
+                    "timeout": "5s",
+                    "threshold": 3,
+                    "exec": {"command": "/srv/image-scripts/ldap-ready.sh"},
+                },
             },
         }
 
+    @staticmethod
+    def _live_changes_only(current, desired):
+        """Whether the services differ only in settings slapd takes while running."""
+        if current.keys() != desired.keys():
+            return False
+        if any(current[name] != desired[name] for name in desired if name != "openldap"):
+            return False
+        if {**current["openldap"], "environment": {}} != {**desired["openldap"], "environment": {}}:
+            return False
+        current_env = current["openldap"].get("environment", {})
+        desired_env = desired["openldap"].get("environment", {})
+        changed = {
+            name for name in current_env.keys() | desired_env.keys() if current_env.get(name) != desired_env.get(name)
+        }
+        return changed <= LIVE_SETTINGS
+
+    def _apply_live_config(self, container, services, layer):
+        """Apply changes to slapd through cn=config, without restarting it or dropping connections.
+
+        Returns False if the changes need a restart, or couldn't be applied live."""
+        if not self._live_changes_only(services, layer["services"]):
+            return False
+        if not container.get_service("openldap").is_running():
+            return False
+        environment = layer["services"]["openldap"]["environment"]
+        environment = {**environment, **slapd_config.tuning(environment, self._container_cpus(container))}
+        try:
+            container.exec(APPLY_LIVE_CONFIG_COMMAND, environment=environment).wait_output()
+        except ExecError as e:
+            logger.warning("Applying settings through cn=config failed, restarting slapd: %s", e.stderr)
+            return False
+        # Later restarts start from the same settings.
+        container.add_layer("openldap", layer, combine=True)
+        logger.info("Applied settings through cn=config")
+        return True
+
+    def _container_cpus(self, container):
+        """The number of CPUs the workload container may use, rounded up."""
+        quota = period = None
+        if container.exists(CPU_MAX):
+            quota, period = container.pull(CPU_MAX).read().split()
+        elif container.exists(CPU_CFS_QUOTA):
+            quota = container.pull(CPU_CFS_QUOTA).read().strip()
+            period = container.pull(CPU_CFS_PERIOD).read().strip()
+        if quota and quota != "max" and int(quota) > 0:
+            return -(-int(quota) // int(period))
+        # Without a limit, slapd may use every CPU of the node, as the charm may.
+        return os.cpu_count()
+
+    def _write_openldap_config(self, container, environment):
+        """Render slapd's configuration into the workload container, ready to start it."""
+        files = slapd_config.render(environment, self._container_cpus(container), self.get_admin_password())
+        for path, content in files.items():
+            container.push(path, content, make_dirs=True, permissions=0o600)
+        # The cache starts out empty, as changes made while slapd was
+        # stopped haven't been invalidated.
+        for path in (slapd_config.SLAPD_CONFIG_DIR, slapd_config.PCACHE_DIR):
+            if container.exists(path):
+                container.remove_path(path, recursive=True)
+        for path in (slapd_config.SLAPD_CONFIG_DIR, slapd_config.PCACHE_DIR, slapd_config.MDB_DIR):
+            container.make_dir(path, make_parents=True)
+        container.exec(slapd_config.SLAPTEST_COMMAND).wait_output()
+
+    def _ldap_service_name(self):
+        """The name of the Service spreading LDAP connections across the units."""
+        return "{}-ldap".format(self.app.name)
+
+    def _update_ldap_service(self):
+        """As the leader, create, change or remove the LDAP Service as service_type asks.
+
+        The Service applied last is kept in leadership settings, so hooks
+        only call the Kubernetes API when it has to change. Returns what
+        went wrong, if anything."""
+        service_type = self.config["service_type"]
+        applied = self.leader_data["ldap_service"]
+        try:
+            if not service_type:
+                if applied:
+                    kubernetes_service.delete(self.model.name, self._ldap_service_name())
+                    self.leader_data["ldap_service"] = ""
+                    self.leader_data["ldap_service_address"] = ""
+                return None
+            service = kubernetes_service.manifest(
+                self._ldap_service_name(), self.app.name, service_type, self.config["container_port"]
+            )
+            desired = json.dumps(service, sort_keys=True)
+            # Load balancers get their address some time after they are created.
+            waiting = service_type == "LoadBalancer" and not self.leader_data["ldap_service_address"]
+            if applied != desired or waiting:
+                service = kubernetes_service.apply(self.model.name, service, self.app.name)
+                self.leader_data["ldap_service"] = desired
+                self.leader_data["ldap_service_address"] = kubernetes_service.external_address(service) or ""
+        except kubernetes_service.ApiError as e:
+            logger.error("Managing the %s Service failed: %s", self._ldap_service_name(), e)
+            if e.status == 403:
+                return "Not allowed to manage the LDAP Service, run juju trust or unset service_type"
+            return "Managing the LDAP Service failed, see the debug log"
+        return None
+
+    def _update_ldap_relations(self):
+        """Tell LDAP clients where to connect.
+
+        The leader shares the Service's address, which only leads to units
+        that are ready. Units don't share their own addresses: no hook runs
+        when a unit's ldap-ready check fails or passes again, so they would
+        go on leading clients to units that aren't ready until some
+        unrelated hook ran. Returns what went wrong, if anything."""
+        relations = self.model.relations["ldap"]
+        if not relations:
+            return None
+        port = self.config["container_port"]
+        # Units of earlier revisions shared their own address.
+        unit_data = {"url": ""}
+        app_data = {"base_dn": LDAP_BASE_DN, "url": "", "external_url": ""}
+        if self.leader_data["ldap_service"]:
+            app_data["url"] = "ldap://{}.{}.svc.cluster.local:{}".format(
+                self._ldap_service_name(), self.model.name, port
+            )
+        if self.leader_data["ldap_service_address"]:
+            app_data["external_url"] = "ldap://{}:{}".format(self.leader_data["ldap_service_address"], port)
+        for relation in relations:
+            updates = [(relation.data[self.unit], unit_data)]
+            if self.unit.is_leader():
+                updates.append((relation.data[self.app], app_data))
+            for data, values in updates:
+                # Each change is a relation-set, so only make those needed.
+                for key, value in values.items():
+                    if data.get(key, "") != value:
+                        data[key] = value
+        if not self.leader_data["ldap_service"]:
+            # Without a Service, clients only get the base DN.
+            return "Set service_type to give ldap relations an address"
+        return None
+
+    def _on_remove(self, _):
+        """Remove the LDAP Service along with the application's last unit."""
+        if not self.unit.is_leader() or self.app.planned_units() > 0 or not self.leader_data["ldap_service"]:
+            return
+        try:
+            kubernetes_service.delete(self.model.name, self._ldap_service_name())
+        except kubernetes_service.ApiError as e:
+            logger.error("Removing the %s Service failed: %s", self._ldap_service_name(), e)
+
     def _on_get_admin_password_action(self, event):
         """Handle on get-admin-password action."""
         admin_password = self.get_admin_password()
@@ -147,6 +831,116 @@ class OpenLDAPK8sCharm(CharmBase):
         else:
             event.fail("LDAP admin password has not yet been set, please retry later.")
 
+    def _on_get_cache_stats_action(self, event):
+        """Handle the get-cache-stats action."""
+        if not self._cache_enabled():
+            event.fail("The search result cache is not enabled.")
+            return
+        container = self.unit.get_container("openldap")
+        if not container.can_connect():
+            event.fail("The workload container is not ready yet, please retry later.")
+            return
+        try:
+            stdout, _ = container.exec(CACHE_STATS_COMMAND).wait_output()
+        except ExecError as e:
+            event.fail("Reading the cache statistics failed: {}".format(e.stderr))
+            return
+
+        searches = queries = entries = hits = 0
+        for line in stdout.splitlines():
+            attribute, _, value = line.partition(": ")
+            if attribute == "monitorOpCompleted":
+                searches = int(value)
+            elif attribute == "pcacheNumQueries":
+                queries += int(value)
+            elif attribute == "pcacheNumEntries":
+                entries += int(value)
+            elif attribute == "pcacheQueryURL":
+                # Each cached query counts the searches it has answered.
+                answerable = re.search(r"x-answerable=(\d+)", value)
+                if answerable:
+                    hits += int(answerable.group(1))
+        event.set_results(
+            {
+                "cached-queries": queries,
+                "cached-entries": entries,
+                "searches": searches,
+                "hits": hits,
+                # pcache doesn't count misses, and forgets the hits of
+                # expired queries, so this is an upper bound.
+                "misses": max(searches - hits, 0),
+            }
+        )
+
+    def _on_get_slow_queries_action(self, event):
+        """Handle the get-slow-queries action."""
+        if not self._sql_backend():
+            event.fail("There are no SQL queries with the mdb backend.")
+            return
+        container = self.unit.get_container("openldap")
+        if not container.can_connect():
+            event.fail("The workload container is not ready yet, please retry later.")
+            return
+        if not container.exists(SLOW_QUERY_LOG):
+            event.fail("No slow statements have been recorded, see the slow_query_threshold option.")
+            return
+        records = [json.loads(line) for line in container.pull(SLOW_QUERY_LOG).read().splitlines() if line]
+        records.sort(key=lambda record: record["duration_ms"], reverse=True)
+        count = event.params["count"]
+        event.set_results({"slow-queries": json.dumps(records[:count], indent=2)})
+
+    def _run_charm_script(self, event, script, args, database):
+        """Run one of the charm's scripts in the workload container, logging its output to the action.
+
+        `database` picks the database to run it against, once the backend
+        is known to keep the directory in PostgreSQL. Returns the last line
+        of output on success, or None if the action failed."""
+        if not self._sql_backend():
+            event.fail("This action works on the PostgreSQL database, which the mdb backend doesn't use.")
+            return None
+        if not self._primary_database():
+            event.fail("The database relation is not ready yet, please retry later.")
+            return None
+        container = self.unit.get_container("openldap")
+        if not container.can_connect():
+            event.fail("The workload container is not ready yet, please retry later.")
+            return None
+        path = "{}/{}".format(CHARM_SCRIPTS_DIR, script)
+        container.push(path, (Path(__file__).parent / script).read_text(), make_dirs=True, permissions=0o755)
+        process = container.exec(
+            ["python3", path, *args], environment=self._postgres_environment(database()), combine_stderr=True
+        )
+        output = []
+        for line in process.stdout:
+            line = line.rstrip("\n")
+            event.log(line)
+            output.append(line)
+        try:
+            process.wait()
+        except ExecError:
+            event.fail(output[-1] if output else "{} failed.".format(script))
+            return None
+        return output[-1] if output else ""
+
+    def _on_bulk_import_action(self, event):
+        """Handle the bulk-import action."""
+        # Imports write to the primary, whichever database this unit's slapd reads from.
+        result = self._run_charm_script(
+            event,
+            "bulk_import.py",
+            [event.params["path"], "--batch-size", str(event.params["batch-size"])],
+            self._primary_database,
+        )
+        if result is not None:
+            event.set_results({"result": result})
+
+    def _on_export_action(self, event):
+        """Handle the export action."""
+        # Exports only read, so they can run against this unit's standby.
+        result = self._run_charm_script(event, "bulk_export.py", [event.params["path"]], self._workload_database)
+        if result is not None:
+            event.set_results({"result": result, "path": event.params["path"]})
+
     def get_admin_password(self):
         """Get the LDAP admin password.
 
@@ -154,35 +948,116 @@ class OpenLDAPK8sCharm(CharmBase):
         or return an empty string if we're not."""
         admin_password = self.leader_data["admin_password"]
         if not admin_password:
-            if self.unit.is_leader:
+            if self.unit.is_leader():
                 admin_password = self._pwgen(40)
                 self.leader_data["admin_password"] = admin_password
         return admin_password
 
-    def _on_config_changed(self, event):
-        """Reconfigure service."""
-        if not self._state.postgres:
+    def _admin_password_hash(self):
+        """The admin password hashed for slapd's rootpw.
+
+        The leader hashes it once and shares the hash, as a new salt would
+        change slapd's configuration, and restart it, on every hook."""
+        password_hash = self.leader_data["admin_password_hash"]
+        if not password_hash and self.unit.is_leader() and self.get_admin_password():
+            password_hash = slapd_config.hash_password(self.get_admin_password())
+            self.leader_data["admin_password_hash"] = password_hash
+        return password_hash
+
+    def _reconcile(self, _=None):
+        """Bring the workload in line with the config, leadership and database state.
+
+        Safe to run from any event, as often as it comes: it only changes
+        what differs from the desired state, and never defers, since every
+        deferred event is stored and replayed on each later hook."""
+        config_error = self._config_error()
+        if config_error:
+            self.unit.status = BlockedStatus(config_error)
+            return
+
+        sql = self._sql_backend()
+        if sql and not self._primary_database():
             self.unit.status = WaitingStatus('Waiting for database relation')
-            event.defer()
             return
 
         if not self.unit.is_leader():
-            self.unit.status = ActiveStatus()
-            return
+            # Every unit runs slapd against the shared database, but only
+            # the leader generates the admin password and migrates the schema.
+            if not self.get_admin_password() or not self._admin_password_hash():
+                self.unit.status = WaitingStatus("Waiting for leader to set the admin password")
+                return
+            if sql and self.leader_data["schema_database"] != self._database_id():
+                self.unit.status = WaitingStatus("Waiting for leader to migrate the database schema")
+                return
+            if self._cache_enabled() and self.leader_data["entry_change_log"] != self._database_id():
+                # Changes made before then would never be dropped from the cache.
+                self.unit.status = WaitingStatus("Waiting for leader to turn on the entry change log")
+                return
+            if not sql and not self._sync_provider():
+                self.unit.status = WaitingStatus("Waiting for leader to share its address")
+                return
+
+        if self.unit.is_leader():
+            if self.leader_data["primary_address"] != self._unit_address():
+                self.leader_data["primary_address"] = self._unit_address()
+            self._share_sync_provider()
 
         container = self.unit.get_container("openldap")
         layer = self._openldap_layer()
 
         if container.can_connect():
-            services = container.get_plan().to_dict().get("services", {})
-            if services != layer["services"]:
+            if sql and self.unit.is_leader() and self.leader_data["schema_database"] != self._database_id():
+                self.unit.status = MaintenanceStatus("migrating database schema")
+                try:
+                    self._migrate_schema(container)
+                except ExecError as e:
+                    logger.error("Database schema migration failed: %s", e.stderr)
+                    self.unit.status = WaitingStatus("waiting for database schema migration")
+                    return
+            if sql and self.unit.is_leader():
+                try:
+                    self._switch_entry_change_log(container)
+                except ExecError as e:
+                    logger.error("Switching the entry change log failed: %s", e.stderr)
+                    self.unit.status = WaitingStatus("waiting to switch the entry change log")
+                    return
+
+            if not self._configure_pgbouncer():
+                self.unit.status = WaitingStatus("waiting for Pebble in pgbouncer container")
+                return
+
+            plan = container.get_plan().to_dict()
+            services = plan.get("services", {})
+            if services != layer["services"] and not self._apply_live_config(container, services, layer):
                 self.unit.status = MaintenanceStatus("adjusting workload container")
+                try:
+                    self._write_openldap_config(container, layer["services"]["openldap"]["environment"])
+                except ExecError as e:
+                    logger.error("slapd rejected its configuration: %s", e.stderr)
+                    self.unit.status = BlockedStatus("slapd rejected its configuration, see the debug log")
+                    return
                 container.add_layer("openldap", layer, combine=True)
+                # Listening before slapd starts, so none of its log is lost.
+                if not container.get_service("syslog").is_running():
+                    container.start("syslog")
                 container.restart("openldap")
-            self.unit.status = ActiveStatus()
+                if not container.get_service("metrics-exporter").is_running():
+                    container.start("metrics-exporter")
+                for service in ("cache-invalidator", "slow-query-sampler"):
+                    if layer["services"][service]["startup"] == "enabled":
+                        container.restart(service)
+                    elif container.get_service(service).is_running():
+                        container.stop(service)
+            elif plan.get("checks", {}) != layer["checks"]:
+                # Checks change without restarting anything.
+                container.add_layer("openldap", layer, combine=True)
+            service_error = self._update_ldap_service() if self.unit.is_leader() else None
+            relation_error = self._update_ldap_relations()
+            error = service_error or relation_error
+            self.unit.status = BlockedStatus(error) if error else ActiveStatus()
         else:
             self.unit.status = WaitingStatus("waiting for Pebble in workload container")
 
 
 if __name__ == "__main__":
-    main(OpenLDAPK8sCharm, use_juju_for_storage=True)
+    main(OpenLDAPK8sCharm, use_juju_for_storage=False)
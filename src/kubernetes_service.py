@@ -0,0 +1,110 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Manage the Kubernetes Service that spreads LDAP connections across the units.
+
+Juju's Service for the application doesn't forward LDAP. The headless
+Service Juju creates for unit addresses keeps every pod in its DNS
+records, ready or not. The charm therefore manages a Service of its
+own. Kubernetes only sends its connections to pods that are ready, and
+Juju makes a pod unready while a Pebble check at the ready level fails.
+A unit whose ldap-ready check fails stops getting new connections.
+
+The charm pod's service account talks to the Kubernetes API, which
+needs `juju trust`. Only the standard library is used, since the charm
+needs no other Kubernetes client.
+"""
+
+import json
+import os
+import ssl
+import urllib.error
+import urllib.request
+
+SERVICE_ACCOUNT = "/var/run/secrets/kubernetes.io/serviceaccount"
+SERVICE_TYPES = ("ClusterIP", "LoadBalancer")
+
+
+class ApiError(Exception):
+    """A request to the Kubernetes API failed."""
+
+    def __init__(self, status, message):
+        super().__init__("{} {}".format(status or "", message).strip())
+        self.status = status
+
+
+def _request(method, path, body=None, content_type="application/json"):
+    """Make a request to the Kubernetes API as the charm's service account, returning the response."""
+    host, port = os.environ.get("KUBERNETES_SERVICE_HOST"), os.environ.get("KUBERNETES_SERVICE_PORT")
+    if not host or not port:
+        raise ApiError(None, "The Kubernetes API isn't reachable from outside a pod")
+    with open(os.path.join(SERVICE_ACCOUNT, "token")) as f:
+        token = f.read().strip()
+    request = urllib.request.Request(
+        "https://{}:{}{}".format(host, port, path),
+        data=None if body is None else json.dumps(body).encode(),
+        method=method,
+        headers={
+            "Authorization": "Bearer {}".format(token),
+            "Accept": "application/json",
+            "Content-Type": content_type,
+        },
+    )
+    context = ssl.create_default_context(cafile=os.path.join(SERVICE_ACCOUNT, "ca.crt"))
+    try:
+        with urllib.request.urlopen(request, context=context, timeout=30) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        # The API explains what went wrong in a Status object.
+        try:
+            message = json.load(e).get("message", e.reason)
+        except ValueError:
+            message = e.reason
+        raise ApiError(e.code, message) from e
+    except urllib.error.URLError as e:
+        raise ApiError(None, str(e.reason)) from e
+
+
+def manifest(name, app, service_type, port):
+    """A Service sending LDAP connections to the ready pods of a Juju application."""
+    return {
+        "apiVersion": "v1",
+        "kind": "Service",
+        "metadata": {"name": name, "labels": {"app.kubernetes.io/managed-by": app}},
+        "spec": {
+            "type": service_type,
+            # Juju labels the pods of every unit of the application with its name.
+            "selector": {"app.kubernetes.io/name": app},
+            "ports": [{"name": "ldap", "protocol": "TCP", "port": port, "targetPort": port}],
+        },
+    }
+
+
+def apply(namespace, service, field_manager):
+    """Create or update a Service with server-side apply, returning it as Kubernetes has it."""
+    return _request(
+        "PATCH",
+        "/api/v1/namespaces/{}/services/{}?fieldManager={}&force=true".format(
+            namespace, service["metadata"]["name"], field_manager
+        ),
+        service,
+        content_type="application/apply-patch+yaml",
+    )
+
+
+def delete(namespace, name):
+    """Delete a Service, if it exists."""
+    try:
+        _request("DELETE", "/api/v1/namespaces/{}/services/{}".format(namespace, name))
+    except ApiError as e:
+        if e.status != 404:
+            raise
+
+
+def external_address(service):
+    """The address a LoadBalancer Service is reachable at from outside the cluster, or None until it has one."""
+    for ingress in service.get("status", {}).get("loadBalancer", {}).get("ingress", []):
+        address = ingress.get("ip") or ingress.get("hostname")
+        if address:
+            return address
+    return None
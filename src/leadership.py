@@ -172,9 +172,16 @@ class LeadershipSettings(collections.abc.MutableMapping):
     setting it to the empty string. Attempting to read a missing
     key will return the empty string (this class will never raise
     a KeyError).
+
+    Settings are read with one leader-get, the first time they are
+    needed. Writes are visible to reads straight away, but only reach
+    Juju on commit(), with one leader-set for all of them.
     """
 
     __cls_cache = None
+    # Writes not yet passed to leader-set. Like the cache, they are shared
+    # by every instance, and only ever changed in place.
+    __cls_pending = {}
 
     @property
     def _cache_loaded(self) -> bool:
@@ -188,9 +195,20 @@ class LeadershipSettings(collections.abc.MutableMapping):
         cls = self.__class__
         if cls.__cls_cache is None:
             cmd = ["leader-get", "--format=yaml"]
-            cls.__cls_cache = yaml.safe_load(subprocess.check_output(cmd).decode("UTF-8")) or {}
+            cache = yaml.safe_load(subprocess.check_output(cmd).decode("UTF-8")) or {}
+            # Writes waiting for commit() are newer than what Juju has.
+            for key, value in self.__cls_pending.items():
+                self._update_cache(cache, key, value)
+            cls.__cls_cache = cache
         return cls.__cls_cache
 
+    @staticmethod
+    def _update_cache(cache: Dict[str, str], key: str, value: str):
+        if value == "":
+            cache.pop(key, None)
+        else:
+            cache[key] = value
+
     def __getitem__(self, key: str) -> str:
         return self._cache.get(key, "")
 
@@ -200,13 +218,9 @@ class LeadershipSettings(collections.abc.MutableMapping):
             raise RuntimeError(f"LeadershipSettings keys may not contain '=', got {key}")
         if value is None:
             value = ""
-        cmd = ["leader-set", f"{key}={value}"]
-        subprocess.check_call(cmd)
+        self.__cls_pending[key] = value
         if self._cache_loaded:
-            if value == "":
-                del self._cache[key]
-            else:
-                self._cache[key] = value
+            self._update_cache(self._cache, key, value)
 
     def __delitem__(self, key: str):
         self[key] = ""
@@ -216,3 +230,17 @@ class LeadershipSettings(collections.abc.MutableMapping):
 
     def __len__(self) -> int:
         return len(self._cache)
+
+    def commit(self):
+        """Pass the settings written since the last commit to Juju, with a single leader-set."""
+        if not self.__cls_pending:
+            return
+        cmd = ["leader-set"] + [f"{key}={value}" for key, value in self.__cls_pending.items()]
+        subprocess.check_call(cmd)
+        self.__cls_pending.clear()
+
+    def invalidate(self):
+        """Forget the settings read so far, so the next read gets them from Juju again.
+
+        Writes waiting for commit() are kept."""
+        self.__class__.__cls_cache = None
@@ -0,0 +1,164 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Render the slapd and ODBC driver configuration for the workload.
+
+The charm renders these files from the settings it keeps in the openldap
+service's environment, and pushes them to the workload container before
+starting slapd, so starting the container runs slapd itself with nothing
+to hash, render or work out first. Only the standard library is used, so
+the benchmarks can render the same files.
+"""
+
+import base64
+import hashlib
+import os
+from pathlib import Path
+from string import Template
+
+TEMPLATES_DIR = Path(__file__).parents[1] / "templates"
+
+SLAPD_CONF = "/etc/openldap/slapd.conf"
+SLAPD_CONFIG_DIR = "/etc/openldap/slapd.d"
+ODBC_INI = "/etc/odbc.ini"
+ODBCINST_INI = "/etc/odbcinst.ini"
+PCACHE_DIR = "/var/lib/openldap/pcache"
+MDB_DIR = "/var/lib/openldap/data"
+
+# slapd runs from a cn=config tree, converted from slapd.conf before each
+# start so the settings stay the source of truth. Settings changed through
+# cn=config since are already in them.
+SLAPTEST_COMMAND = ["/usr/sbin/slaptest", "-u", "-f", SLAPD_CONF, "-F", SLAPD_CONFIG_DIR]
+
+# slapd refuses more listener threads than this.
+MAX_LISTENER_THREADS = 16
+
+# The settings slapd runs with when they aren't given, as in the benchmarks.
+DEFAULT_SETTINGS = {
+    'LDAP_BACKEND': 'sql',
+    'LDAP_WRITE_REFERRAL': '',
+    'LDAP_SYNC_PROVIDER': '',
+    'LDAP_MDB_MAX_SIZE': '10240',
+    'LDAP_CACHE_TEMPLATES': '',
+    'LDAP_CACHE_MAX_ENTRIES': '10000',
+    'LDAP_CACHE_TTL': '300',
+    'SLAPD_LOG_LEVEL': 'none',
+    'SLAPD_THREADS': '0',
+    'SLAPD_LISTENER_THREADS': '0',
+    'SLAPD_CONN_MAX_PENDING': '100',
+    'SLAPD_CONN_MAX_PENDING_AUTH': '1000',
+    'SLAPD_IDLETIMEOUT': '0',
+    'SLAPD_SIZELIMIT': '500',
+    'SLAPD_TIMELIMIT': '3600',
+    'ODBC_DEBUG': '0',
+    'ODBC_COMMLOG': '0',
+    'ODBC_READ_ONLY': '0',
+    'ODBC_FETCH_SIZE': '1000',
+    'ODBC_USE_DECLARE_FETCH': '0',
+    'ODBC_POOLING': 'Yes',
+    'ODBC_POOL_TIMEOUT': '60',
+    'ODBC_SERVER_SIDE_PREPARE': '1',
+    'ODBC_APPLICATION_NAME': 'slapd',
+}
+
+
+def slapd_command(debug_level):
+    """The command running slapd in the foreground, with `slapd -d` logging."""
+    return "/usr/libexec/slapd -d {} -h 'ldap:/// ldapi:///' -F {}".format(debug_level, SLAPD_CONFIG_DIR)
+
+
+def hash_password(password, salt=None):
+    """Hash a password for rootpw, as `slappasswd` does by default."""
+    if salt is None:
+        salt = os.urandom(8)
+    digest = hashlib.sha1(password.encode() + salt).digest()
+    return "{SSHA}" + base64.b64encode(digest + salt).decode()
+
+
+def tuning(settings, cpus):
+    """Work out the thread settings left at 0 ("auto") from the CPUs slapd may use."""
+    # Four worker threads per CPU, and never fewer than slapd's default of 16.
+    threads = int(settings['SLAPD_THREADS']) or max(cpus * 4, 16)
+    # One listener thread per four CPUs, as a power of two slapd accepts.
+    listener_threads = int(settings['SLAPD_LISTENER_THREADS'])
+    if not listener_threads:
+        listener_threads = 1
+        while listener_threads * 2 * 4 <= cpus and listener_threads < MAX_LISTENER_THREADS:
+            listener_threads *= 2
+    return {'SLAPD_THREADS': str(threads), 'SLAPD_LISTENER_THREADS': str(listener_threads)}
+
+
+def _template(name):
+    return Template((TEMPLATES_DIR / name).read_text())
+
+
+def _write_referral(values):
+    """Units reading from a database standby refer writes to the leader.
+
+    The updatedn is never bound as, it only marks the database as a replica."""
+    if not values['LDAP_WRITE_REFERRAL']:
+        return ""
+    return 'updatedn           "cn=replica,dc=example"\nupdateref          "{}"'.format(values['LDAP_WRITE_REFERRAL'])
+
+
+def _cache(values):
+    """Cache search results matching the filter templates in a local mdb database."""
+    templates = values['LDAP_CACHE_TEMPLATES'].split()
+    if not templates:
+        return ""
+    lines = [
+        "overlay            pcache",
+        "pcache             mdb {} 1 1000 60".format(values['LDAP_CACHE_MAX_ENTRIES']),
+        "pcacheAttrset      0 *",
+    ]
+    lines.extend("pcacheTemplate     {} 0 {}".format(template, values['LDAP_CACHE_TTL']) for template in templates)
+    lines.extend(
+        [
+            "directory          {}".format(PCACHE_DIR),
+            "maxsize            1073741824",
+            "index              objectClass eq",
+            "index              pcacheQueryID eq",
+        ]
+    )
+    return "\n".join(lines)
+
+
+def _sync(values, admin_password):
+    """With back-mdb, units other than the leader replicate its database and refer writes to it."""
+    if not values['LDAP_SYNC_PROVIDER']:
+        return ""
+    return "\n".join(
+        [
+            "syncrepl           rid=001",
+            "                   provider={}".format(values['LDAP_SYNC_PROVIDER']),
+            "                   bindmethod=simple",
+            '                   binddn="cn=administrator,dc=example"',
+            "                   credentials={}".format(admin_password),
+            '                   searchbase="dc=example"',
+            "                   type=refreshAndPersist",
+            '                   retry="5 +"',
+            'updateref          "{}"'.format(values['LDAP_WRITE_REFERRAL']),
+        ]
+    )
+
+
+def render(settings, cpus, admin_password):
+    """Render the configuration files, by path in the workload container.
+
+    `settings` are the openldap service's environment, including the
+    hashed admin password as SLAPD_ROOTPW. The plain password is only
+    written out for replicas to bind to the leader with."""
+    values = {**DEFAULT_SETTINGS, **settings}
+    values.update(tuning(values, cpus))
+    values.update(
+        SLAPD_WRITE_REFERRAL=_write_referral(values),
+        SLAPD_CACHE=_cache(values),
+        SLAPD_SYNC=_sync(values, admin_password),
+        SLAPD_MDB_MAX_SIZE=str(int(values['LDAP_MDB_MAX_SIZE']) * 1048576),
+    )
+    values['SLAPD_DATABASE'] = _template("database-{}.conf".format(values['LDAP_BACKEND'])).substitute(values)
+    files = {SLAPD_CONF: _template("slapd.conf").substitute(values)}
+    if values['LDAP_BACKEND'] == 'sql':
+        files[ODBC_INI] = _template("odbc.ini").substitute(values)
+        files[ODBCINST_INI] = _template("odbcinst.ini").substitute(values)
+    return files
@@ -18,12 +18,12 @@ PSQL = "postgresql-k8s"
 @pytest.mark.abort_on_fail
 async def test_build_and_deploy(ops_test: OpsTest):
     openldap_charm = await ops_test.build_charm(".")
-    openldap_image = yaml.safe_load(Path("metadata.yaml").read_text())["resources"]["openldap-image"]["upstream-source"]
+    resources = yaml.safe_load(Path("metadata.yaml").read_text())["resources"]
     await asyncio.gather(
         ops_test.model.deploy("postgresql-k8s", application_name=PSQL, num_units=1),
         ops_test.model.deploy(
             openldap_charm,
-            resources={'openldap-image': openldap_image},
+            resources={name: resource["upstream-source"] for name, resource in resources.items()},
             application_name=APP_NAME,
             num_units=1,
         ),
@@ -0,0 +1,52 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Fixtures for the stress tests.
+
+These run against a throwaway PostgreSQL database given by the
+POSTGRES_TEST_DSN environment variable, and are skipped otherwise.
+"""
+
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+ROOT = Path(__file__).parents[2]
+MIGRATIONS = ROOT / "image-scripts" / "migrations"
+
+
+@pytest.fixture
+def dsn():
+    """The test database, with the migrations applied to it afresh."""
+    dsn = os.environ.get("POSTGRES_TEST_DSN")
+    if not dsn:
+        pytest.skip("POSTGRES_TEST_DSN is not set")
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cur:
+        cur.execute(
+            "drop table if exists ldap_schema_version, ldap_entry_changes, ldap_entry_objclasses, ldap_entries, "
+            "ldap_attr_mappings, ldap_oc_mappings, ldap_group_members, ldap_group_member_uids, ldap_groups, "
+            "ldap_people, ldap_units"
+        )
+        for migration in sorted(MIGRATIONS.glob("*.sql")):
+            cur.execute(migration.read_text())
+    return dsn
+
+
+@pytest.fixture
+def postgres_environment(dsn):
+    """The environment the charm gives its scripts in the workload container, for the test database."""
+    if not shutil.which("psql"):
+        pytest.skip("psql is not installed")
+    params = psycopg2.extensions.parse_dsn(dsn)
+    return {
+        **os.environ,
+        "POSTGRES_HOST": params.get("host", "localhost"),
+        "POSTGRES_PORT": params.get("port", "5432"),
+        "POSTGRES_NAME": params.get("dbname", params.get("user", "postgres")),
+        "POSTGRES_USER": params.get("user", "postgres"),
+        "POSTGRES_PASSWORD": params.get("password", ""),
+    }
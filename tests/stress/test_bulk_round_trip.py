@@ -0,0 +1,108 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Stress tests for loading an export back with the bulk importer."""
+
+import gzip
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+ROOT = Path(__file__).parents[2]
+
+# An entry of each of the default mappings, with multi valued attributes in
+# the member tables and posixAccount added to people as an auxiliary class.
+DIRECTORY = """version: 1
+
+dn: dc=example
+objectClass: organization
+o: example
+
+dn: ou=people,dc=example
+objectClass: organizationalUnit
+ou: people
+description: People
+
+dn: ou=groups,dc=example
+objectClass: organizationalUnit
+ou: groups
+
+dn: uid=ada,ou=people,dc=example
+objectClass: top
+objectClass: posixAccount
+objectClass: inetOrgPerson
+uid: ada
+cn: Ada Lovelace
+sn: Lovelace
+givenName: Ada
+mail: ada@example.com
+uidNumber: 1000
+gidNumber: 1000
+homeDirectory: /home/ada
+
+dn: uid=alan,ou=people,dc=example
+objectClass: posixAccount
+uid: alan
+cn: Alan Turing
+uidNumber: 1001
+gidNumber: 1000
+homeDirectory: /home/alan
+loginShell: /bin/bash
+
+dn: cn=staff,ou=groups,dc=example
+objectClass: posixGroup
+cn: staff
+gidNumber: 1000
+memberUid: ada
+memberUid: alan
+memberUid: ada
+
+dn: cn=admins,ou=groups,dc=example
+objectClass: groupOfNames
+cn: admins
+description:: QWRtaW5zIMO8
+member: uid=ada,ou=people,dc=example
+member: uid=alan,ou=people,dc=example
+
+"""
+
+
+def run(script, *args, env):
+    subprocess.run([sys.executable, str(ROOT / "src" / script), *map(str, args)], check=True, env=env)
+
+
+def entries(path):
+    """The entries of an exported LDIF, with their lines in a fixed order."""
+    with gzip.open(path, "rt", encoding="utf-8") as ldif:
+        return [sorted(entry.splitlines()) for entry in ldif.read().split("\n\n") if entry.startswith("dn")]
+
+
+def test_export_round_trip(dsn, postgres_environment, tmp_path):
+    """An export of every default mapping, member tables included, imports back as it was."""
+    ldif = tmp_path / "directory.ldif"
+    ldif.write_text(DIRECTORY)
+    run("bulk_import.py", ldif, env=postgres_environment)
+    run("bulk_export.py", tmp_path / "first.ldif.gz", env=postgres_environment)
+    first = entries(tmp_path / "first.ldif.gz")
+    assert [
+        "dn: cn=staff,ou=groups,dc=example",
+        "gidNumber: 1000",
+        "memberUid: ada",
+        "memberUid: alan",
+        "objectClass: posixGroup",
+    ] in [sorted(set(entry) - {"cn: staff"}) for entry in first]
+    assert any("member: uid=alan,ou=people,dc=example" in entry for entry in first)
+
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cur:
+        cur.execute(
+            "truncate ldap_entries, ldap_entry_objclasses, ldap_units, ldap_people, ldap_groups "
+            "restart identity cascade"
+        )
+    run("bulk_import.py", tmp_path / "first.ldif.gz", env=postgres_environment)
+    run("bulk_export.py", tmp_path / "second.ldif.gz", env=postgres_environment)
+    assert entries(tmp_path / "second.ldif.gz") == first
+    assert len(first) == 7
@@ -0,0 +1,123 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Stress tests for the log of changed entries the cache invalidator reads."""
+
+import importlib.util
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+ROOT = Path(__file__).parents[2]
+
+TREE = """
+insert into ldap_units (id, name) values (1, 'example'), (2, 'people');
+select setval('ldap_units_id_seq', 2);
+insert into ldap_entries (dn, oc_map_id, parent, keyval)
+    select 'dc=example', id, 0, 1 from ldap_oc_mappings where name = 'organization';
+insert into ldap_entries (dn, oc_map_id, parent, keyval)
+    select 'ou=people,dc=example', oc.id, parent.id, 2 from ldap_oc_mappings oc, ldap_entries parent
+    where oc.name = 'organizationalUnit' and parent.dn = 'dc=example';
+"""
+
+ADD_PERSON = """
+with person as (insert into ldap_people (uid, cn, sn) values (%(uid)s, %(uid)s, 'Test') returning id)
+insert into ldap_entries (dn, oc_map_id, parent, keyval)
+    select 'uid=' || %(uid)s || ',ou=people,dc=example', oc.id, parent.id, person.id
+    from person, ldap_oc_mappings oc, ldap_entries parent
+    where oc.name = 'inetOrgPerson' and parent.dn = 'ou=people,dc=example'
+"""
+
+PERSON_LDIF = "dn: uid=user{n},ou=people,dc=example\nobjectClass: inetOrgPerson\nuid: user{n}\ncn: User\nsn: {n}\n\n"
+
+
+def load_invalidator():
+    spec = importlib.util.spec_from_file_location(
+        "pcache_invalidator", ROOT / "image-scripts" / "pcache-invalidator.py"
+    )
+    invalidator = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(invalidator)
+    return invalidator
+
+
+def logged(cur):
+    cur.execute("select dn from ldap_entry_changes order by id")
+    return [dn for dn, in cur.fetchall()]
+
+
+def test_log_is_off_until_turned_on(dsn):
+    """Writes aren't logged until the log is turned on, and turning it off empties it."""
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cur:
+        cur.execute(TREE)
+        cur.execute(ADD_PERSON, {"uid": "before"})
+        cur.execute("select ldap_entry_change_log_enabled()")
+        assert cur.fetchone()[0] is False
+        assert logged(cur) == []
+
+        cur.execute("select ldap_set_entry_change_log(true)")
+        cur.execute("select ldap_entry_change_log_enabled()")
+        assert cur.fetchone()[0] is True
+        cur.execute(ADD_PERSON, {"uid": "after"})
+        cur.execute("update ldap_people set sn = 'Changed' where uid = 'before'")
+        assert set(logged(cur)) == {"uid=after,ou=people,dc=example", "uid=before,ou=people,dc=example"}
+
+        cur.execute("select ldap_set_entry_change_log(false)")
+        assert logged(cur) == []
+        cur.execute("update ldap_people set sn = 'Again' where uid = 'before'")
+        assert logged(cur) == []
+
+
+def test_log_skipped_by_session(dsn):
+    """Sessions can skip logging their own changes while the log is on."""
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cur:
+        cur.execute(TREE)
+        cur.execute("select ldap_set_entry_change_log(true)")
+        cur.execute("set local ldap.entry_change_log to off")
+        cur.execute(ADD_PERSON, {"uid": "skipped"})
+        assert logged(cur) == []
+
+
+def test_bulk_import_logs_parents(dsn, postgres_environment, tmp_path):
+    """A bulk import only logs the existing entries it added entries below."""
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cur:
+        cur.execute(TREE)
+        cur.execute("select ldap_set_entry_change_log(true)")
+    ldif = tmp_path / "people.ldif"
+    ldif.write_text("".join(PERSON_LDIF.format(n=n) for n in range(100)))
+    subprocess.run(
+        [sys.executable, str(ROOT / "src" / "bulk_import.py"), str(ldif)], check=True, env=postgres_environment
+    )
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cur:
+        cur.execute("select count(*) from ldap_entries where dn like 'uid=user%'")
+        assert cur.fetchone()[0] == 100
+        assert logged(cur) == ["ou=people,dc=example"]
+
+
+def test_invalidator_reads_changes_committed_out_of_order(dsn, postgres_environment, monkeypatch):
+    """The invalidator reads a change committed after a later one it has read, and reads each change once."""
+    for name in ("HOST", "PORT", "USER", "PASSWORD"):
+        monkeypatch.setenv("PG" + name, postgres_environment["POSTGRES_" + name])
+    monkeypatch.setenv("PGDATABASE", postgres_environment["POSTGRES_NAME"])
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cur:
+        cur.execute(TREE)
+        cur.execute("select ldap_set_entry_change_log(true)")
+    changes = load_invalidator().ChangeLog()
+
+    slow = psycopg2.connect(dsn)
+    try:
+        with slow.cursor() as cur:
+            cur.execute(ADD_PERSON, {"uid": "slow"})
+        with psycopg2.connect(dsn) as conn, conn.cursor() as cur:
+            cur.execute(ADD_PERSON, {"uid": "fast"})
+        assert "uid=fast,ou=people,dc=example" in changes.read()
+        slow.commit()
+    finally:
+        slow.close()
+    dns = changes.read()
+    assert "uid=slow,ou=people,dc=example" in dns
+    assert "uid=fast,ou=people,dc=example" not in dns
+    assert changes.read() == set()
@@ -0,0 +1,74 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Stress tests for back-sql entry id allocation."""
+
+import re
+import threading
+from pathlib import Path
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+ROOT = Path(__file__).parents[2]
+SLAPD_CONF = ROOT / "templates" / "database-sql.conf"
+MIGRATIONS = ROOT / "image-scripts" / "migrations"
+
+CLIENTS = 32
+ADDS_PER_CLIENT = 200
+
+
+def _insentry_stmt():
+    """Return the configured insentry_stmt with psycopg2 placeholders."""
+    match = re.search(r'^insentry_stmt\s+"(.*)"$', SLAPD_CONF.read_text(), re.MULTILINE)
+    return match.group(1).replace("?", "%s")
+
+
+def test_concurrent_adds_have_unique_ids(dsn):
+    """Many clients adding entries at once never collide on ldap_entries.id."""
+    stmt = _insentry_stmt()
+    errors = []
+    start = threading.Barrier(CLIENTS)
+
+    def client(n):
+        conn = psycopg2.connect(dsn)
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("select id from ldap_oc_mappings where name = 'inetOrgPerson'")
+                oc_map_id = cur.fetchone()[0]
+                start.wait()
+                for i in range(ADDS_PER_CLIENT):
+                    keyval = n * ADDS_PER_CLIENT + i
+                    cur.execute(stmt, (f"uid=user{keyval},dc=example", oc_map_id, 0, keyval))
+        except psycopg2.Error as e:
+            errors.append(e)
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(CLIENTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cur:
+        cur.execute("select count(*), count(distinct id) from ldap_entries")
+        assert cur.fetchone() == (CLIENTS * ADDS_PER_CLIENT, CLIENTS * ADDS_PER_CLIENT)
+
+
+def test_migration_moves_sequence_past_existing_ids(dsn):
+    """Entries added with max(id)+1 by older releases don't collide with new ones."""
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cur:
+        cur.execute("select id from ldap_oc_mappings where name = 'inetOrgPerson'")
+        oc_map_id = cur.fetchone()[0]
+        cur.execute(
+            "insert into ldap_entries (id, dn, oc_map_id, parent, keyval) "
+            "values (100, 'uid=legacy,dc=example', %s, 0, 100)",
+            (oc_map_id,),
+        )
+        cur.execute((MIGRATIONS / "0002_entry_id_sequence.sql").read_text())
+        cur.execute(_insentry_stmt() + " returning id", ("uid=new,dc=example", oc_map_id, 0, 101))
+        assert cur.fetchone()[0] > 100
@@ -0,0 +1,165 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Stress tests running slapd from the workload image against a migrated database.
+
+These need a workload image built from the dockerfile, given by the
+WORKLOAD_IMAGE environment variable, and docker. slapd is run with host
+networking, so POSTGRES_TEST_DSN has to reach PostgreSQL over TCP.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+import slapd_config
+
+ROOT = Path(__file__).parents[2]
+ADMIN_DN = "cn=administrator,dc=example"
+ADMIN_PASSWORD = "stress"
+SLAPD_LOG = "/var/log/slapd.log"
+
+DIRECTORY = """dn: dc=example
+objectClass: organization
+o: example
+
+dn: ou=people,dc=example
+objectClass: organizationalUnit
+ou: people
+
+dn: uid=ada,ou=people,dc=example
+objectClass: inetOrgPerson
+objectClass: posixAccount
+uid: ada
+cn: Ada Lovelace
+sn: Lovelace
+mail: ada@example.com
+uidNumber: 1000
+gidNumber: 1000
+homeDirectory: /home/ada
+
+"""
+
+ADDED = """dn: uid=alan,ou=people,dc=example
+objectClass: inetOrgPerson
+objectClass: posixAccount
+uid: alan
+cn: Alan Turing
+sn: Turing
+givenName: Alan
+uidNumber: 1001
+gidNumber: 1000
+homeDirectory: /home/alan
+loginShell: /bin/bash
+
+dn: cn=staff,ou=people,dc=example
+objectClass: posixGroup
+cn: staff
+gidNumber: 1000
+memberUid: ada
+memberUid: alan
+"""
+
+
+def docker(*args, **kwargs):
+    return subprocess.run(["docker", *args], check=True, stdout=subprocess.PIPE, text=True, **kwargs).stdout
+
+
+def ldap_client(container, command, *args, **kwargs):
+    """Run an LDAP client in the workload container, bound as the admin."""
+    return docker(
+        "exec",
+        "-i",
+        container,
+        command,
+        "-x",
+        "-H",
+        "ldap://localhost",
+        "-D",
+        ADMIN_DN,
+        "-w",
+        ADMIN_PASSWORD,
+        *args,
+        **kwargs
+    )
+
+
+@pytest.fixture
+def slapd(dsn, postgres_environment):
+    """A workload container running slapd against the test database."""
+    image = os.environ.get("WORKLOAD_IMAGE")
+    if not image or not shutil.which("docker"):
+        pytest.skip("WORKLOAD_IMAGE is not set or docker is not installed")
+    ldif = tempfile.NamedTemporaryFile("w", suffix=".ldif")
+    ldif.write(DIRECTORY)
+    ldif.flush()
+    subprocess.run(
+        [sys.executable, str(ROOT / "src" / "bulk_import.py"), ldif.name], check=True, env=postgres_environment
+    )
+
+    container = docker("run", "--detach", "--rm", "--network", "host", "--entrypoint", "sleep", image, "infinity")
+    container = container.strip()
+    try:
+        settings = {name: value for name, value in postgres_environment.items() if name.startswith("POSTGRES_")}
+        settings["SLAPD_ROOTPW"] = slapd_config.hash_password(ADMIN_PASSWORD)
+        with tempfile.TemporaryDirectory() as directory:
+            for path, content in slapd_config.render(settings, 2, ADMIN_PASSWORD).items():
+                local = Path(directory) / Path(path).name
+                local.write_text(content)
+                docker("cp", str(local), "{}:{}".format(container, path))
+        docker("exec", container, "mkdir", "-p", slapd_config.SLAPD_CONFIG_DIR, slapd_config.PCACHE_DIR)
+        docker("exec", container, *slapd_config.SLAPTEST_COMMAND)
+        docker("exec", "--detach", container, "sh", "-c", "{} 2>{}".format(slapd_config.slapd_command(1), SLAPD_LOG))
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                ldap_client(container, "ldapsearch", "-b", "dc=example", "-s", "base", stderr=subprocess.DEVNULL)
+                break
+            except subprocess.CalledProcessError:
+                if time.monotonic() > deadline:
+                    pytest.fail("slapd did not start:\n" + docker("exec", container, "cat", SLAPD_LOG))
+                time.sleep(1)
+        yield container
+    finally:
+        subprocess.run(["docker", "stop", container], check=False, stdout=subprocess.DEVNULL)
+        ldif.close()
+
+
+def test_default_mappings(slapd):
+    """slapd serves and adds entries of every default mapping's class, with their schemas loaded."""
+    found = ldap_client(slapd, "ldapsearch", "-LLL", "-b", "dc=example", "(uid=ada)")
+    assert "objectClass: posixAccount" in found
+    assert "uidNumber: 1000" in found
+
+    ldap_client(slapd, "ldapadd", input=ADDED)
+    found = ldap_client(slapd, "ldapsearch", "-LLL", "-b", "dc=example", "(memberUid=alan)", "memberUid")
+    assert "dn: cn=staff,ou=people,dc=example" in found
+    assert "memberUid: ada" in found
+    found = ldap_client(slapd, "ldapsearch", "-LLL", "-b", "dc=example", "(loginShell=/bin/bash)", "givenName")
+    assert "givenName: Alan" in found
+
+
+def test_trace_log_level_reaches_syslog_forwarder(slapd):
+    """The trace profile's loglevel, set through cn=config, produces output the syslog forwarder prints."""
+    syslog = "/var/log/syslog-forwarder.log"
+    docker("exec", "--detach", slapd, "sh", "-c", "/srv/image-scripts/syslog-forwarder.py >{}".format(syslog))
+    settings = {**slapd_config.DEFAULT_SETTINGS, 'SLAPD_LOG_LEVEL': 'trace args stats'}
+    settings.update(slapd_config.tuning(settings, 2))
+    environment = [option for name, value in settings.items() for option in ("--env", "{}={}".format(name, value))]
+    docker("exec", *environment, slapd, "/srv/image-scripts/apply-live-config.sh")
+
+    deadline = time.monotonic() + 30
+    while True:
+        ldap_client(slapd, "ldapsearch", "-LLL", "-b", "dc=example", "(uid=ada)", "uid")
+        logged = docker("exec", slapd, "cat", syslog)
+        if 'SRCH base="dc=example"' in logged:
+            break
+        assert time.monotonic() < deadline, "nothing logged:\n" + logged
+        time.sleep(1)
+    assert "conn=" in logged
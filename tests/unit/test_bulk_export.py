@@ -0,0 +1,69 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Unit tests for the bulk LDIF exporter."""
+
+import unittest
+
+from bulk_export import export_query, ldif_entry, ldif_line
+
+
+class TestBulkExport(unittest.TestCase):
+    def test_export_query(self):
+        """Test attribute values are selected like back-sql does, parents first."""
+        query = export_query(
+            [
+                ["1", "persons", "id", "cn", "persons.cn", "persons", ""],
+                [
+                    "1",
+                    "persons",
+                    "id",
+                    "telephoneNumber",
+                    "phones.phone",
+                    "persons,phones",
+                    "phones.pers_id=persons.id",
+                ],
+                ["2", "orgs", "id", "", "", "", ""],
+            ]
+        )
+        self.assertIn(
+            "json_build_object('cn', array(select (persons.cn)::text from persons where persons.id = e.keyval), "
+            "'telephoneNumber', array(select (phones.phone)::text from persons,phones "
+            "where persons.id = e.keyval and (phones.pers_id=persons.id)))::jsonb",
+            query,
+        )
+        self.assertIn("json_build_object()::jsonb from ldap_entries e", query)
+        self.assertTrue(query.endswith("order by length(dn) - length(replace(dn, ',', '')), id"))
+
+    def test_export_query_many_attributes(self):
+        """Test mappings with more attributes than a function takes arguments are built in parts."""
+        query = export_query([["1", "t", "id", "a{}".format(n), "t.a{}".format(n), "t", ""] for n in range(60)])
+        self.assertEqual(query.count("json_build_object("), 2)
+        self.assertIn(")::jsonb || json_build_object(", query)
+
+    def test_ldif_line(self):
+        """Test values that aren't safe strings are base64 encoded."""
+        self.assertEqual(ldif_line("cn", "John Doe"), "cn: John Doe\n")
+        self.assertEqual(ldif_line("cn", ""), "cn: \n")
+        self.assertEqual(ldif_line("sn", "Ümlaut"), "sn:: w5xtbGF1dA==\n")
+        self.assertEqual(ldif_line("cn", ":colon"), "cn:: OmNvbG9u\n")
+        self.assertEqual(ldif_line("cn", "trailing "), "cn:: dHJhaWxpbmcg\n")
+        self.assertEqual(ldif_line("cn", "two\nlines"), "cn:: dHdvCmxpbmVz\n")
+
+    def test_ldif_entry(self):
+        entry = ldif_entry(
+            "uid=jdoe,dc=example",
+            "inetOrgPerson",
+            ["posixAccount"],
+            {"uid": ["jdoe"], "telephoneNumber": ["1", "2"], "sn": []},
+        )
+        self.assertEqual(
+            entry,
+            "dn: uid=jdoe,dc=example\n"
+            "objectClass: inetOrgPerson\n"
+            "objectClass: posixAccount\n"
+            "uid: jdoe\n"
+            "telephoneNumber: 1\n"
+            "telephoneNumber: 2\n"
+            "\n",
+        )
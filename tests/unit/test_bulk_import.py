@@ -0,0 +1,186 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Unit tests for the bulk LDIF importer."""
+
+import io
+import unittest
+
+from bulk_import import Importer, LDIFError, load_mappings, parse_ldif
+
+MAPPING_ROWS = [
+    ["1", "organizationalUnit", "ous", "id", "ou", "ous.name", "ous", ""],
+    ["3", "inetOrgPerson", "persons", "id", "uid", "persons.uid", "persons", ""],
+    ["3", "inetOrgPerson", "persons", "id", "cn", "persons.cn", "persons", "persons.cn is not null"],
+    ["3", "inetOrgPerson", "persons", "id", "telephoneNumber", "phones.phone", "persons,phones", ""],
+    ["4", "organization", "orgs", "id", "", "", "", ""],
+    ["5", "posixAccount", "persons", "id", "uid", "persons.uid", "persons", ""],
+    ["5", "posixAccount", "persons", "id", "uidNumber", "persons.uid_number", "persons", ""],
+    ["6", "groupOfNames", "groups", "id", "cn", "groups.cn", "groups", ""],
+    ["6", "groupOfNames", "groups", "id", "member", "members.dn", "groups, members", "members.group_id = groups.id"],
+]
+
+
+class TestParseLDIF(unittest.TestCase):
+    def test_parse_ldif(self):
+        """Test folded lines, base64 values and comments are handled."""
+        ldif = io.StringIO(
+            "version: 1\n"
+            "\n"
+            "# people\n"
+            "dn: uid=jdoe, ou=people,dc=example\n"
+            "objectClass: inetOrgPerson\n"
+            "cn: John\n"
+            "  Doe\n"
+            "sn:: w5xtbGF1dA==\n"
+            "\n"
+            "dn: ou=people,dc=example\n"
+            "objectClass: organizationalUnit\n"
+        )
+        self.assertEqual(
+            list(parse_ldif(ldif)),
+            [
+                (
+                    "uid=jdoe,ou=people,dc=example",
+                    [("objectClass", "inetOrgPerson"), ("cn", "John Doe"), ("sn", "Ümlaut")],
+                ),
+                ("ou=people,dc=example", [("objectClass", "organizationalUnit")]),
+            ],
+        )
+
+    def test_parse_ldif_folded_comment(self):
+        """Test lines folded from a comment are part of the comment."""
+        ldif = io.StringIO("# people, imported from\n  the old directory\ndn: ou=people,dc=example\nou: people\n")
+        self.assertEqual(list(parse_ldif(ldif)), [("ou=people,dc=example", [("ou", "people")])])
+
+    def test_parse_ldif_bad_base64(self):
+        """Test base64 values that aren't valid, or aren't UTF-8 text, are refused with their line number."""
+        for value in ("not base64!", "/9j/4AAQ"):
+            ldif = io.StringIO("dn: uid=jdoe,dc=example\nuid: jdoe\njpegPhoto:: {}\n".format(value))
+            with self.subTest(value=value), self.assertRaisesRegex(LDIFError, "^Line 3: jpegPhoto isn't"):
+                list(parse_ldif(ldif))
+
+    def test_parse_ldif_changetype(self):
+        """Test change records are refused."""
+        ldif = io.StringIO("dn: uid=jdoe,dc=example\nchangetype: delete\n")
+        with self.assertRaises(LDIFError):
+            list(parse_ldif(ldif))
+
+
+class TestImporter(unittest.TestCase):
+    def setUp(self):
+        self.mappings = load_mappings(MAPPING_ROWS)
+        self.out = io.StringIO()
+        self.importer = Importer(self.out, self.mappings, "dc=example", batch_size=2)
+
+    def test_load_mappings(self):
+        """Test only attributes stored in a column of the key table or a table joined on its key are used."""
+        self.assertEqual(self.mappings["inetorgperson"].columns, {"uid": "uid", "cn": "cn"})
+        self.assertEqual(self.mappings["inetorgperson"].column_list(), ["id", "cn", "uid"])
+        self.assertEqual(self.mappings["inetorgperson"].joined, {})
+        self.assertEqual(self.mappings["organization"].columns, {})
+        self.assertEqual(self.mappings["groupofnames"].joined, {"member": ("members", "group_id", "dn")})
+
+    def test_batches_are_copied(self):
+        """Test entries are copied into the staging tables a batch at a time."""
+        self.importer.add("uid=a,dc=example", [("objectClass", "inetOrgPerson"), ("uid", "a")])
+        self.assertEqual(self.out.getvalue(), "")
+        self.importer.add(
+            "uid=b,dc=example",
+            [("objectClass", "top"), ("objectClass", "inetOrgPerson"), ("objectClass", "posixAccount"), ("cn", "B\t")],
+        )
+        copied = self.out.getvalue()
+        self.assertIn("copy import_entries (seq, dn, parent_dn, oc_map_id) from stdin;\n", copied)
+        self.assertIn("1\tuid=a,dc=example\tdc=example\t3\n2\tuid=b,dc=example\tdc=example\t3\n\\.\n", copied)
+        self.assertIn("copy import_objclasses (seq, oc_name) from stdin;\n2\tposixAccount\n\\.\n", copied)
+        self.assertIn("copy import_oc_3 (cn, uid, import_seq) from stdin;\n\\N\ta\t1\nB\\t\t\\N\t2\n\\.\n", copied)
+
+    def test_suffix_has_no_parent(self):
+        self.importer.add("dc=example", [("objectClass", "organization")])
+        self.importer.finish()
+        self.assertIn("1\tdc=example\t\t4\n", self.out.getvalue())
+        self.assertIn("insert into orgs (id) select id from import_oc_4;\n", self.out.getvalue())
+
+    def test_entry_change_log(self):
+        """Test imported rows aren't logged one by one, only the existing parents they are added below."""
+        self.importer.begin()
+        self.importer.add("uid=a,ou=people,dc=example", [("objectClass", "inetOrgPerson"), ("uid", "a")])
+        self.importer.finish()
+        self.assertIn("set local ldap.entry_change_log to off;\n", self.out.getvalue())
+        self.assertIn(
+            "insert into ldap_entry_changes (dn) select distinct p.dn from import_entries e "
+            "join ldap_entries p on p.id = e.parent "
+            "where not exists (select 1 from import_entries i where i.id = p.id) "
+            "and ldap_entry_change_log_enabled();\n",
+            self.out.getvalue(),
+        )
+
+    def test_unmapped_attribute(self):
+        """Test attributes that aren't a column of the key table are refused."""
+        with self.assertRaisesRegex(LDIFError, "telephoneNumber isn't mapped to a column of persons or a table joined"):
+            self.importer.add("uid=a,dc=example", [("objectClass", "inetOrgPerson"), ("telephoneNumber", "1")])
+
+    def test_most_specific_object_class(self):
+        """Test the mapping storing every attribute is used, whatever order the object classes are in."""
+        for object_classes in (["top", "posixAccount", "inetOrgPerson"], ["inetOrgPerson", "posixAccount", "top"]):
+            importer = Importer(self.out, self.mappings, "dc=example", batch_size=10)
+            attributes = [("objectClass", name) for name in object_classes]
+            importer.add("uid=a,dc=example", attributes + [("uid", "a"), ("cn", "A")])
+            importer.add("uid=b,dc=example", attributes + [("uid", "b"), ("uidNumber", "1000")])
+            # Both can store a uid alone, so the one with more attributes is used.
+            importer.add("uid=c,dc=example", attributes + [("uid", "c")])
+            self.assertEqual(
+                [(mapping.name, extra_classes) for _, mapping, _, _, extra_classes in importer.batch],
+                [
+                    ("inetOrgPerson", ["posixAccount"]),
+                    ("posixAccount", ["inetOrgPerson"]),
+                    ("inetOrgPerson", ["posixAccount"]),
+                ],
+            )
+
+    def test_attributes_of_different_mappings(self):
+        """Test entries needing more than one mapping to store their attributes are refused."""
+        with self.assertRaisesRegex(
+            LDIFError,
+            "uid=a,dc=example: uidNumber isn't mapped to a column of persons or a table joined to it for inetOrgPerson",
+        ):
+            self.importer.add(
+                "uid=a,dc=example",
+                [("objectClass", "posixAccount"), ("objectClass", "inetOrgPerson"), ("cn", "A"), ("uidNumber", "1")],
+            )
+
+    def test_joined_attribute(self):
+        """Test attributes in a joined table can have many values, stored once each below the entry's key."""
+        self.importer.begin()
+        self.importer.add(
+            "cn=g,dc=example",
+            [
+                ("objectClass", "groupOfNames"),
+                ("cn", "g"),
+                ("member", "uid=a,dc=example"),
+                ("member", "uid=b,dc=example"),
+            ],
+        )
+        self.importer.finish()
+        written = self.out.getvalue()
+        self.assertIn(
+            "create temp table import_oc_6_0 on commit drop as select dn from members with no data;\n", written
+        )
+        self.assertIn(
+            "copy import_oc_6_0 (dn, import_seq) from stdin;\nuid=a,dc=example\t1\nuid=b,dc=example\t1\n\\.\n",
+            written,
+        )
+        self.assertIn(
+            "insert into members (group_id, dn) select distinct s.id, v.dn "
+            "from import_oc_6_0 v join import_oc_6 s on s.import_seq = v.import_seq;\n",
+            written,
+        )
+        self.assertLess(written.index("insert into groups"), written.index("insert into members"))
+
+    def test_unmapped_object_class(self):
+        with self.assertRaisesRegex(LDIFError, "has no object class mapped"):
+            self.importer.add("cn=a,dc=example", [("objectClass", "device")])
+
+    def test_multiple_values(self):
+        with self.assertRaisesRegex(LDIFError, "uid has more than one value"):
+            self.importer.add("uid=a,dc=example", [("objectClass", "inetOrgPerson"), ("uid", "a"), ("uid", "b")])
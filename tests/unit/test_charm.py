@@ -3,17 +3,37 @@
 
 """Unit tests for charm-k8s-openldap charm."""
 
+import json
 import unittest
-from collections import namedtuple
+from collections import defaultdict
 from unittest.mock import MagicMock, patch
 
-from ops import testing
-from ops.model import ActiveStatus, WaitingStatus
+import yaml
+from ops import pebble, testing
+from ops.model import ActiveStatus, BlockedStatus, WaitingStatus
+from ops.pebble import ExecError
 
+import kubernetes_service
+import slapd_config
 from charm import OpenLDAPK8sCharm
+from leadership import LeadershipSettings
 
 testing.SIMULATE_CAN_CONNECT = True
 
+
+class LeaderData(defaultdict):
+    """Juju leadership settings, which read as empty strings when unset."""
+
+    def __init__(self):
+        super().__init__(str)
+
+    def commit(self):
+        pass
+
+    def invalidate(self):
+        pass
+
+
 DB_URI = {
     'dbname': 'openldap',
     'user': 'ldap_user',
@@ -28,10 +48,19 @@ class TestOpenLDAPK8sCharmHooksDisabled(unittest.TestCase):
         self.harness = testing.Harness(OpenLDAPK8sCharm)
         self.harness.begin()
         self.harness.disable_hooks()
+        self.harness.charm.leader_data = LeaderData()
+        # Rendering slapd's configuration runs slaptest in the workload container.
+        patcher = patch.object(OpenLDAPK8sCharm, "_write_openldap_config")
+        self.write_openldap_config = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch("slapd_config.hash_password", return_value="{SSHA}badmin")
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     def test_openldap_layer(self):
         """Test OpenLDAP Pebble layer."""
-        self.harness.charm._state.postgres = DB_URI
+        self.harness.charm._databases = (DB_URI, [])
+        self.harness.charm.leader_data["admin_password_hash"] = "{SSHA}badmin"
         expected = {
             "summary": "openldap layer",
             "description": "pebble config layer for openldap",
@@ -39,31 +68,594 @@ class TestOpenLDAPK8sCharmHooksDisabled(unittest.TestCase):
                 "openldap": {
                     "override": "replace",
                     "startup": "enabled",
-                    "command": "/srv/image-scripts/configure-and-run-openldap.sh",
+                    "command": "/usr/libexec/slapd -d 0 -h 'ldap:/// ldapi:///' -F /etc/openldap/slapd.d",
                     "environment": {
                         'POSTGRES_NAME': 'openldap',
                         'POSTGRES_USER': 'ldap_user',
                         'POSTGRES_PASSWORD': 'ldap_password',
                         'POSTGRES_HOST': '1.1.1.1',
                         'POSTGRES_PORT': '5432',
-                        'LDAP_ADMIN_PASSWORD': 'badmin_password',
+                        'LDAP_BACKEND': 'sql',
+                        'SLAPD_ROOTPW': '{SSHA}badmin',
+                        'LDAP_WRITE_REFERRAL': '',
+                        'ODBC_READ_ONLY': '0',
+                        'SLAPD_LOG_LEVEL': 'none',
+                        'ODBC_DEBUG': '0',
+                        'ODBC_COMMLOG': '0',
+                        'SLAPD_THREADS': '0',
+                        'SLAPD_LISTENER_THREADS': '0',
+                        'SLAPD_CONN_MAX_PENDING': '100',
+                        'SLAPD_CONN_MAX_PENDING_AUTH': '1000',
+                        'SLAPD_IDLETIMEOUT': '0',
+                        'SLAPD_SIZELIMIT': '500',
+                        'SLAPD_TIMELIMIT': '3600',
+                        'ODBC_FETCH_SIZE': '1000',
+                        'ODBC_USE_DECLARE_FETCH': '0',
+                        'ODBC_POOLING': 'Yes',
+                        'ODBC_POOL_TIMEOUT': '60',
+                        'ODBC_SERVER_SIDE_PREPARE': '1',
+                        'ODBC_APPLICATION_NAME': 'slapd-openldap-k8s-0',
+                        'LDAP_CACHE_TEMPLATES': '',
+                        'LDAP_CACHE_MAX_ENTRIES': '10000',
+                        'LDAP_CACHE_TTL': '300',
                     },
-                }
+                },
+                "cache-invalidator": {
+                    "override": "replace",
+                    "startup": "disabled",
+                    "command": "/srv/image-scripts/pcache-invalidator.py",
+                    "environment": {
+                        'POSTGRES_NAME': 'openldap',
+                        'POSTGRES_USER': 'ldap_user',
+                        'POSTGRES_PASSWORD': 'ldap_password',
+                        'POSTGRES_HOST': '1.1.1.1',
+                        'POSTGRES_PORT': '5432',
+                    },
+                },
+                "slow-query-sampler": {
+                    "override": "replace",
+                    "startup": "disabled",
+                    "command": "/srv/image-scripts/slow-query-sampler.py",
+                    "environment": {
+                        'POSTGRES_NAME': 'openldap',
+                        'POSTGRES_USER': 'ldap_user',
+                        'POSTGRES_PASSWORD': 'ldap_password',
+                        'POSTGRES_HOST': '1.1.1.1',
+                        'POSTGRES_PORT': '5432',
+                        'SLOW_QUERY_THRESHOLD_MS': '0',
+                        'SLOW_QUERY_APPLICATION_NAME': 'slapd-openldap-k8s-0',
+                    },
+                },
+                "metrics-exporter": {
+                    "override": "replace",
+                    "startup": "enabled",
+                    "command": "/srv/image-scripts/monitor-exporter.py",
+                    "environment": {'METRICS_PORT': '9330'},
+                },
+                "syslog": {
+                    "override": "replace",
+                    "startup": "enabled",
+                    "command": "/srv/image-scripts/syslog-forwarder.py",
+                },
             },
             "checks": {
                 "online": {
                     "override": "replace",
-                    "level": "ready",
+                    "level": "alive",
                     "tcp": {
                         "port": 389,
                     },
                 },
+                "ldap-ready": {
+                    "override": "replace",
+                    "level": "ready",
+                    "period": "10s",
+                    "timeout": "5s",
+                    "threshold": 3,
+                    "exec": {"command": "/srv/image-scripts/ldap-ready.sh"},
+                },
             },
         }
         with patch.object(self.harness.charm, "get_admin_password") as get_admin_password:
             get_admin_password.return_value = 'badmin_password'
             self.assertEqual(self.harness.charm._openldap_layer(), expected)
 
+    def test_openldap_layer_log_profile(self):
+        """Test the log profile sets slapd and ODBC logging together."""
+        self.harness.charm._databases = (DB_URI, [])
+        self.harness.update_config({"log_profile": "trace"})
+        with patch.object(self.harness.charm, "get_admin_password") as get_admin_password:
+            get_admin_password.return_value = 'badmin_password'
+            environment = self.harness.charm._openldap_layer()["services"]["openldap"]["environment"]
+        self.assertEqual(environment['SLAPD_LOG_LEVEL'], 'trace args stats')
+        self.assertEqual(environment['ODBC_DEBUG'], '1')
+        self.assertEqual(environment['ODBC_COMMLOG'], '1')
+
+    def test_configure_pod_invalid_log_profile(self):
+        """Check that we block on an unknown log profile."""
+        mock_event = MagicMock()
+
+        self.harness.charm._databases = (DB_URI, [])
+        self.harness.update_config({"log_profile": "verbose"})
+        self.harness.charm._reconcile(mock_event)
+        self.assertEqual(
+            self.harness.charm.unit.status,
+            BlockedStatus("Invalid log_profile, must be one of: diagnostic, production, trace"),
+        )
+
+    def test_configure_pod_invalid_backend(self):
+        mock_event = MagicMock()
+
+        self.harness.update_config({"backend": "bdb"})
+        self.harness.charm._reconcile(mock_event)
+        self.assertEqual(self.harness.charm.unit.status, BlockedStatus("Invalid backend, must be one of: mdb, sql"))
+
+    @patch("charm.OpenLDAPK8sCharm.get_admin_password", MagicMock(return_value='badmin_password'))
+    def test_configure_pod_mdb_leader(self):
+        """Test the leader runs back-mdb without a database relation and shares its address."""
+        mock_event = MagicMock()
+        relation_id = self.harness.add_relation('replicas', 'openldap-k8s')
+        container = self.harness.model.unit.get_container("openldap")
+
+        self.harness.container_pebble_ready('openldap')
+        self.harness.update_config({"backend": "mdb", "cache_enabled": True, "cache_templates": "(uid=)"})
+        self.harness.set_leader(True)
+        with patch.object(container, "exec") as container_exec:
+            self.harness.charm._reconcile(mock_event)
+        # No schema to migrate.
+        container_exec.assert_not_called()
+        self.assertEqual(self.harness.charm.unit.status, ActiveStatus())
+        self.assertEqual(
+            self.harness.get_relation_data(relation_id, self.harness.charm.app.name)["provider"],
+            "openldap-k8s-0.openldap-k8s-endpoints.{}.svc.cluster.local".format(self.harness.model.name),
+        )
+
+        services = container.get_plan().to_dict()["services"]
+        environment = services["openldap"]["environment"]
+        self.assertEqual(environment["LDAP_BACKEND"], "mdb")
+        self.assertEqual(environment["LDAP_SYNC_PROVIDER"], "")
+        self.assertEqual(environment["LDAP_WRITE_REFERRAL"], "")
+        self.assertEqual(environment["LDAP_MDB_MAX_SIZE"], "10240")
+        self.assertNotIn("POSTGRES_HOST", environment)
+        self.assertNotIn("LDAP_CACHE_TEMPLATES", environment)
+        self.assertEqual(services["cache-invalidator"]["startup"], "disabled")
+        self.assertEqual(services["slow-query-sampler"]["startup"], "disabled")
+        self.assertTrue(container.get_service("openldap").is_running())
+        self.assertFalse(container.get_service("cache-invalidator").is_running())
+
+    @patch("charm.OpenLDAPK8sCharm.get_admin_password", MagicMock(return_value='badmin_password'))
+    def test_configure_pod_mdb_replica(self):
+        """Test other units replicate back-mdb from the leader and refer writes to it."""
+        mock_event = MagicMock()
+        relation_id = self.harness.add_relation('replicas', 'openldap-k8s')
+
+        self.harness.container_pebble_ready('openldap')
+        self.harness.charm.leader_data["admin_password_hash"] = "{SSHA}badmin"
+        self.harness.update_config({"backend": "mdb"})
+        self.harness.charm._reconcile(mock_event)
+        self.assertEqual(self.harness.charm.unit.status, WaitingStatus("Waiting for leader to share its address"))
+
+        self.harness.update_relation_data(relation_id, self.harness.charm.app.name, {"provider": "openldap-k8s-1"})
+        self.harness.charm._reconcile(mock_event)
+        self.assertEqual(self.harness.charm.unit.status, ActiveStatus())
+        plan = self.harness.model.unit.get_container("openldap").get_plan().to_dict()
+        environment = plan["services"]["openldap"]["environment"]
+        self.assertEqual(environment["LDAP_SYNC_PROVIDER"], "ldap://openldap-k8s-1:389")
+        self.assertEqual(environment["LDAP_WRITE_REFERRAL"], "ldap://openldap-k8s-1:389")
+
+    def test_on_bulk_import_action_mdb(self):
+        mock_event = MagicMock()
+        mock_event.params = {"path": "/tmp/people.ldif", "batch-size": 5000}
+        self.harness.update_config({"backend": "mdb"})
+        self.harness.charm._on_bulk_import_action(mock_event)
+        mock_event.fail.assert_called_once()
+        mock_event.set_results.assert_not_called()
+
+    def test_on_export_action_mdb_replica(self):
+        """Test a non-leader replicating back-mdb fails the export instead of picking a database."""
+        mock_event = MagicMock()
+        mock_event.params = {"path": "/var/backups/openldap.ldif.gz"}
+        relation_id = self.harness.add_relation('replicas', 'openldap-k8s')
+        self.harness.update_relation_data(
+            relation_id, 'openldap-k8s', {"provider": "openldap-k8s-0.openldap-k8s-endpoints"}
+        )
+        self.harness.update_config({"backend": "mdb"})
+        self.harness.container_pebble_ready('openldap')
+        self.assertEqual(self.harness.charm._workload_database(), None)
+        container = self.harness.model.unit.get_container("openldap")
+        with patch.object(container, "exec") as container_exec:
+            self.harness.charm._on_export_action(mock_event)
+        container_exec.assert_not_called()
+        mock_event.fail.assert_called_once_with(
+            "This action works on the PostgreSQL database, which the mdb backend doesn't use."
+        )
+        mock_event.set_results.assert_not_called()
+
+    def test_openldap_layer_tuning(self):
+        """Test slapd tuning settings are passed to the workload."""
+        self.harness.charm._databases = (DB_URI, [])
+        self.harness.update_config({"threads": 48, "listener_threads": 4, "sizelimit": -1, "timelimit": 60})
+        with patch.object(self.harness.charm, "get_admin_password") as get_admin_password:
+            get_admin_password.return_value = 'badmin_password'
+            environment = self.harness.charm._openldap_layer()["services"]["openldap"]["environment"]
+        self.assertEqual(environment['SLAPD_THREADS'], '48')
+        self.assertEqual(environment['SLAPD_LISTENER_THREADS'], '4')
+        self.assertEqual(environment['SLAPD_SIZELIMIT'], 'unlimited')
+        self.assertEqual(environment['SLAPD_TIMELIMIT'], '60')
+
+    def test_openldap_layer_odbc(self):
+        """Test ODBC fetch and pooling settings are passed to the workload."""
+        self.harness.charm._databases = (DB_URI, [])
+        self.harness.update_config(
+            {"odbc_fetch_size": 5000, "odbc_use_declare_fetch": True, "odbc_pooling": False, "odbc_pool_timeout": 10}
+        )
+        with patch.object(self.harness.charm, "get_admin_password") as get_admin_password:
+            get_admin_password.return_value = 'badmin_password'
+            environment = self.harness.charm._openldap_layer()["services"]["openldap"]["environment"]
+        self.assertEqual(environment['ODBC_FETCH_SIZE'], '5000')
+        self.assertEqual(environment['ODBC_USE_DECLARE_FETCH'], '1')
+        self.assertEqual(environment['ODBC_POOLING'], 'No')
+        self.assertEqual(environment['ODBC_POOL_TIMEOUT'], '10')
+
+    def test_configure_pod_invalid_tuning(self):
+        """Check that we block on invalid tuning settings."""
+        mock_event = MagicMock()
+
+        self.harness.charm._databases = (DB_URI, [])
+        self.harness.update_config({"listener_threads": 3})
+        self.harness.charm._reconcile(mock_event)
+        self.assertEqual(
+            self.harness.charm.unit.status, BlockedStatus("Invalid listener_threads, must be a power of two")
+        )
+        # slapd would only reject these when slaptest converts its configuration.
+        self.harness.update_config({"listener_threads": 32})
+        self.harness.charm._reconcile(mock_event)
+        self.assertEqual(self.harness.charm.unit.status, BlockedStatus("Invalid listener_threads, must be at most 16"))
+        self.write_openldap_config.assert_not_called()
+        self.harness.update_config({"listener_threads": 16})
+        self.harness.charm._reconcile(mock_event)
+        self.assertNotIsInstance(self.harness.charm.unit.status, BlockedStatus)
+        self.harness.update_config({"listener_threads": 0, "threads": -1})
+        self.harness.charm._reconcile(mock_event)
+        self.assertEqual(self.harness.charm.unit.status, BlockedStatus("Invalid threads, must not be negative"))
+
+    def test_openldap_layer_cache(self):
+        """Test the cache templates are only passed to slapd when the cache is enabled."""
+        self.harness.charm._databases = (DB_URI, [])
+        self.harness.update_config({"cache_templates": "(uid=)", "cache_ttl": 60})
+        with patch.object(self.harness.charm, "get_admin_password") as get_admin_password:
+            get_admin_password.return_value = 'badmin_password'
+            services = self.harness.charm._openldap_layer()["services"]
+            self.assertEqual(services["openldap"]["environment"]['LDAP_CACHE_TEMPLATES'], '')
+            self.assertEqual(services["cache-invalidator"]["startup"], 'disabled')
+            self.harness.update_config({"cache_enabled": True})
+            services = self.harness.charm._openldap_layer()["services"]
+        self.assertEqual(services["openldap"]["environment"]['LDAP_CACHE_TEMPLATES'], '(uid=)')
+        self.assertEqual(services["openldap"]["environment"]['LDAP_CACHE_TTL'], '60')
+        self.assertEqual(services["cache-invalidator"]["startup"], 'enabled')
+
+    def test_configure_pod_invalid_cache_templates(self):
+        """Test a cache template that isn't a filter blocks the charm."""
+        self.harness.charm._databases = (DB_URI, [])
+        self.harness.update_config({"cache_templates": "(uid=) uid="})
+        self.harness.charm._reconcile(MagicMock())
+        self.assertEqual(
+            self.harness.charm.unit.status, BlockedStatus("Invalid cache_templates, uid= is not a filter template")
+        )
+
+    @patch("charm.OpenLDAPK8sCharm.get_admin_password", MagicMock(return_value='badmin_password'))
+    def test_configure_pod_cache_invalidator(self):
+        """Test the cache invalidator runs alongside slapd only when the cache is enabled."""
+        mock_event = MagicMock()
+        container = self.harness.model.unit.get_container("openldap")
+
+        self.harness.charm._databases = (DB_URI, [])
+        self.harness.charm.leader_data["schema_database"] = "1.1.1.1:5432/openldap"
+        self.harness.set_leader(True)
+        self.harness.container_pebble_ready('openldap')
+        self.harness.update_config({"cache_enabled": True})
+        with patch.object(container, "exec") as container_exec:
+            container_exec.return_value.wait_output.return_value = ("Entry change log enabled: t", "")
+            self.harness.charm._reconcile(mock_event)
+            self.harness.charm._reconcile(mock_event)
+        # The leader turns on the entry change log the invalidator reads, once.
+        container_exec.assert_called_once()
+        self.assertEqual(container_exec.call_args[0][0], ["/srv/image-scripts/entry-change-log.sh", "true"])
+        self.assertEqual(self.harness.charm.leader_data["entry_change_log"], "1.1.1.1:5432/openldap")
+        self.assertTrue(container.get_service("cache-invalidator").is_running())
+        self.harness.update_config({"cache_enabled": False})
+        with patch.object(container, "exec") as container_exec:
+            container_exec.return_value.wait_output.return_value = ("Entry change log enabled: f", "")
+            self.harness.charm._reconcile(mock_event)
+        self.assertEqual(container_exec.call_args[0][0], ["/srv/image-scripts/entry-change-log.sh", "false"])
+        self.assertEqual(self.harness.charm.leader_data["entry_change_log"], "")
+        self.assertFalse(container.get_service("cache-invalidator").is_running())
+        self.assertTrue(container.get_service("openldap").is_running())
+
+    def test_configure_pod_cache_waits_for_entry_change_log(self):
+        """Test other units only cache searches once the leader logs entry changes."""
+        mock_event = MagicMock()
+
+        self.harness.charm._databases = (DB_URI, [])
+        self.harness.charm.leader_data["admin_password"] = "badmin_password"
+        self.harness.charm.leader_data["admin_password_hash"] = "{SSHA}badmin"
+        self.harness.charm.leader_data["schema_database"] = "1.1.1.1:5432/openldap"
+        self.harness.update_config({"cache_enabled": True})
+        self.harness.charm._reconcile(mock_event)
+        self.assertEqual(
+            self.harness.charm.unit.status, WaitingStatus("Waiting for leader to turn on the entry change log")
+        )
+        self.harness.charm.leader_data["entry_change_log"] = "1.1.1.1:5432/openldap"
+        self.harness.charm._reconcile(mock_event)
+        self.assertNotEqual(
+            self.harness.charm.unit.status, WaitingStatus("Waiting for leader to turn on the entry change log")
+        )
+
+    @patch("charm.OpenLDAPK8sCharm.get_admin_password", MagicMock(return_value='badmin_password'))
+    def test_configure_pod_restarts_only_on_change(self):
+        """Test slapd is only restarted when its settings change."""
+        mock_event = MagicMock()
+        container = self.harness.model.unit.get_container("openldap")
+
+        self.harness.container_pebble_ready('openldap')
+        self.harness.charm._databases = (DB_URI, [])
+        self.harness.charm.leader_data["schema_database"] = "1.1.1.1:5432/openldap"
+        self.harness.set_leader(True)
+        with patch.object(container, "restart") as restart:
+            self.harness.charm._reconcile(mock_event)
+            self.assertEqual(restart.call_count, 1)
+            self.harness.update_config({"listener_threads": 4})
+            self.harness.charm._reconcile(mock_event)
+            self.assertEqual(restart.call_count, 2)
+            self.harness.update_config({"listener_threads": 4})
+            self.harness.charm._reconcile(mock_event)
+            self.assertEqual(restart.call_count, 2)
+        # slapd's configuration is only rendered for the restarts.
+        self.assertEqual(self.write_openldap_config.call_count, 2)
+
+    def test_container_cpus(self):
+        """Test slapd's threads follow the workload container's CPU limit, or the node's CPUs without one."""
+        self.harness.set_can_connect("openldap", True)
+        container = self.harness.model.unit.get_container("openldap")
+        with patch("charm.os.cpu_count", return_value=64):
+            self.assertEqual(self.harness.charm._container_cpus(container), 64)
+            container.push("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "150000\n", make_dirs=True)
+            container.push("/sys/fs/cgroup/cpu/cpu.cfs_period_us", "100000\n", make_dirs=True)
+            self.assertEqual(self.harness.charm._container_cpus(container), 2)
+            container.push("/sys/fs/cgroup/cpu.max", "max 100000\n", make_dirs=True)
+            self.assertEqual(self.harness.charm._container_cpus(container), 64)
+            container.push("/sys/fs/cgroup/cpu.max", "400000 100000\n")
+            self.assertEqual(self.harness.charm._container_cpus(container), 4)
+
+    @patch("charm.OpenLDAPK8sCharm.get_admin_password", MagicMock(return_value='badmin_password'))
+    def test_configure_pod_slaptest_failed(self):
+        """Test slapd isn't restarted with a configuration slaptest rejects."""
+        mock_event = MagicMock()
+        container = self.harness.model.unit.get_container("openldap")
+
+        self.harness.container_pebble_ready('openldap')
+        self.harness.charm._databases = (DB_URI, [])
+        self.harness.charm.leader_data["schema_database"] = "1.1.1.1:5432/openldap"
+        self.harness.set_leader(True)
+        self.write_openldap_config.side_effect = ExecError(slapd_config.SLAPTEST_COMMAND, 1, "", "bad config")
+        with patch.object(container, "restart") as restart:
+            self.harness.charm._reconcile(mock_event)
+        restart.assert_not_called()
+        self.assertEqual(
+            self.harness.charm.unit.status, BlockedStatus("slapd rejected its configuration, see the debug log")
+        )
+
+    @patch("charm.OpenLDAPK8sCharm.get_admin_password", MagicMock(return_value='badmin_password'))
+    def test_configure_pod_applies_live_settings(self):
+        """Test limits and the log level go through cn=config, and anything else restarts slapd."""
+        mock_event = MagicMock()
+        container = self.harness.model.unit.get_container("openldap")
+
+        self.harness.container_pebble_ready('openldap')
+        self.harness.charm._databases = (DB_URI, [])
+        self.harness.charm.leader_data["schema_database"] = "1.1.1.1:5432/openldap"
+        self.harness.set_leader(True)
+        self.harness.charm._reconcile(mock_event)
+        self.assertTrue(container.get_service("openldap").is_running())
+
+        self.harness.update_config({"threads": 32, "sizelimit": -1})
+        with patch.object(container, "restart") as restart, patch.object(container, "exec") as container_exec:
+            self.harness.charm._reconcile(mock_event)
+        restart.assert_not_called()
+        container_exec.assert_called_once()
+        self.assertEqual(container_exec.call_args[0][0], ["/srv/image-scripts/apply-live-config.sh"])
+        environment = container_exec.call_args[1]["environment"]
+        self.assertEqual(environment["SLAPD_THREADS"], "32")
+        # Threads left to slapd are worked out from the container's CPUs.
+        self.assertNotEqual(environment["SLAPD_LISTENER_THREADS"], "0")
+        self.assertEqual(environment["SLAPD_SIZELIMIT"], "unlimited")
+        plan = container.get_plan().to_dict()
+        self.assertEqual(plan["services"], self.harness.charm._openldap_layer()["services"])
+        self.assertEqual(self.harness.charm.unit.status, ActiveStatus())
+
+        # A failure to apply them live falls back to a restart.
+        self.harness.update_config({"idletimeout": 60})
+        with patch.object(container, "restart") as restart, patch.object(container, "exec") as container_exec:
+            container_exec.return_value.wait_output.side_effect = ExecError(
+                ["/srv/image-scripts/apply-live-config.sh"], 50, "", "Insufficient access"
+            )
+            self.harness.charm._reconcile(mock_event)
+        restart.assert_any_call("openldap")
+
+        # The database connection is only read at startup.
+        self.harness.charm._databases = ({**DB_URI, 'host': '1.1.1.2'}, [])
+        self.harness.charm.leader_data["schema_database"] = "1.1.1.2:5432/openldap"
+        self.harness.update_config({"threads": 16})
+        with patch.object(container, "restart") as restart, patch.object(container, "exec") as container_exec:
+            self.harness.charm._reconcile(mock_event)
+        container_exec.assert_not_called()
+        restart.assert_any_call("openldap")
+
+    @patch("charm.OpenLDAPK8sCharm.get_admin_password", MagicMock(return_value='badmin_password'))
+    def test_configure_pod_applies_log_level_live(self):
+        """Test a log profile only changing slapd's log level goes through cn=config."""
+        mock_event = MagicMock()
+        container = self.harness.model.unit.get_container("openldap")
+
+        self.harness.container_pebble_ready('openldap')
+        self.harness.charm._databases = (DB_URI, [])
+        self.harness.charm.leader_data["schema_database"] = "1.1.1.1:5432/openldap"
+        self.harness.set_leader(True)
+        self.harness.charm._reconcile(mock_event)
+        command = container.get_plan().to_dict()["services"]["openldap"]["command"]
+
+        self.harness.update_config({"log_profile": "diagnostic"})
+        with patch.object(container, "restart") as restart, patch.object(container, "exec") as container_exec:
+            self.harness.charm._reconcile(mock_event)
+        restart.assert_not_called()
+        self.write_openldap_config.assert_called_once()
+        container_exec.assert_called_once()
+        self.assertEqual(container_exec.call_args[0][0], ["/srv/image-scripts/apply-live-config.sh"])
+        self.assertEqual(container_exec.call_args[1]["environment"]["SLAPD_LOG_LEVEL"], "stats")
+        plan = container.get_plan().to_dict()
+        self.assertEqual(plan["services"]["openldap"]["command"], command)
+        self.assertEqual(plan["services"]["openldap"]["environment"]["SLAPD_LOG_LEVEL"], "stats")
+
+        # The ODBC driver only reads its logging flags when slapd starts.
+        self.harness.update_config({"log_profile": "trace"})
+        with patch.object(container, "restart") as restart, patch.object(container, "exec") as container_exec:
+            self.harness.charm._reconcile(mock_event)
+        container_exec.assert_not_called()
+        restart.assert_any_call("openldap")
+
+    @patch("charm.OpenLDAPK8sCharm.get_admin_password", MagicMock(return_value='badmin_password'))
+    def test_configure_pod_updates_checks_without_restart(self):
+        """Test a layer from an older charm gets the readiness check without restarting slapd."""
+        mock_event = MagicMock()
+        container = self.harness.model.unit.get_container("openldap")
+
+        self.harness.charm._databases = (DB_URI, [])
+        self.harness.charm.leader_data["schema_database"] = "1.1.1.1:5432/openldap"
+        self.harness.set_leader(True)
+        self.harness.container_pebble_ready('openldap')
+        layer = self.harness.charm._openldap_layer()
+        old_plan = pebble.Plan(
+            yaml.safe_dump(
+                {
+                    "services": layer["services"],
+                    "checks": {"online": {"override": "replace", "level": "ready", "tcp": {"port": 389}}},
+                }
+            )
+        )
+        with patch.object(container, "get_plan", return_value=old_plan), patch.object(
+            container, "add_layer"
+        ) as add_layer, patch.object(container, "restart") as restart:
+            self.harness.charm._reconcile(mock_event)
+        restart.assert_not_called()
+        add_layer.assert_called_once_with("openldap", layer, combine=True)
+
+    @patch("charm.OpenLDAPK8sCharm.get_admin_password", MagicMock(return_value='badmin_password'))
+    def test_configure_pod_ldap_relation(self):
+        """Test LDAP clients get no unit addresses that would outlive their readiness, and we block on no Service."""
+        mock_event = MagicMock()
+        self.harness.container_pebble_ready('openldap')
+        relation_id = self.harness.add_relation('ldap', 'ldap-client')
+        container = self.harness.model.unit.get_container("openldap")
+
+        self.harness.charm._databases = (DB_URI, [])
+        self.harness.charm.leader_data["schema_database"] = "1.1.1.1:5432/openldap"
+        self.harness.set_leader(True)
+        # Shared by an earlier revision of the charm.
+        self.harness.update_relation_data(
+            relation_id,
+            'openldap-k8s/0',
+            {"url": "ldap://openldap-k8s-0.openldap-k8s-endpoints.None.svc.cluster.local:389"},
+        )
+        with patch.object(container, "get_check") as get_check, patch("kubernetes_service.apply") as apply:
+            self.harness.charm._reconcile(mock_event)
+        get_check.assert_not_called()
+        apply.assert_not_called()
+        self.assertEqual(
+            self.harness.charm.unit.status, BlockedStatus("Set service_type to give ldap relations an address")
+        )
+        self.assertEqual(self.harness.get_relation_data(relation_id, 'openldap-k8s/0'), {})
+        self.assertEqual(self.harness.get_relation_data(relation_id, 'openldap-k8s'), {"base_dn": "dc=example"})
+
+    @patch("charm.OpenLDAPK8sCharm.get_admin_password", MagicMock(return_value='badmin_password'))
+    def test_configure_pod_ldap_service(self):
+        """Test the leader applies the LDAP Service only when it changes, and shares its addresses."""
+        mock_event = MagicMock()
+        self.harness.container_pebble_ready('openldap')
+        relation_id = self.harness.add_relation('ldap', 'ldap-client')
+
+        self.harness.charm._databases = (DB_URI, [])
+        self.harness.charm.leader_data["schema_database"] = "1.1.1.1:5432/openldap"
+        self.harness.set_leader(True)
+        self.harness.update_config({"service_type": "LoadBalancer"})
+        service = {"status": {"loadBalancer": {"ingress": [{"ip": "10.1.2.3"}]}}}
+        with patch("kubernetes_service.apply", return_value=service) as apply, patch(
+            "kubernetes_service.delete"
+        ) as delete:
+            self.harness.charm._reconcile(mock_event)
+            self.harness.charm._reconcile(mock_event)
+            apply.assert_called_once_with(
+                None,
+                kubernetes_service.manifest("openldap-k8s-ldap", "openldap-k8s", "LoadBalancer", 389),
+                "openldap-k8s",
+            )
+            self.assertEqual(
+                self.harness.get_relation_data(relation_id, 'openldap-k8s'),
+                {
+                    "base_dn": "dc=example",
+                    "url": "ldap://openldap-k8s-ldap.None.svc.cluster.local:389",
+                    "external_url": "ldap://10.1.2.3:389",
+                },
+            )
+            self.assertEqual(self.harness.charm.unit.status, ActiveStatus())
+
+            self.harness.update_config({"service_type": ""})
+            self.harness.charm._reconcile(mock_event)
+            delete.assert_called_once_with(None, "openldap-k8s-ldap")
+        self.assertEqual(
+            self.harness.charm.unit.status, BlockedStatus("Set service_type to give ldap relations an address")
+        )
+        self.assertEqual(self.harness.get_relation_data(relation_id, 'openldap-k8s'), {"base_dn": "dc=example"})
+
+    @patch("charm.OpenLDAPK8sCharm.get_admin_password", MagicMock(return_value='badmin_password'))
+    def test_configure_pod_ldap_service_forbidden(self):
+        """Test we block when the charm isn't trusted to manage the LDAP Service."""
+        mock_event = MagicMock()
+
+        self.harness.charm._databases = (DB_URI, [])
+        self.harness.charm.leader_data["schema_database"] = "1.1.1.1:5432/openldap"
+        self.harness.set_leader(True)
+        self.harness.container_pebble_ready('openldap')
+        self.harness.update_config({"service_type": "ClusterIP"})
+        with patch("kubernetes_service.apply", side_effect=kubernetes_service.ApiError(403, "forbidden")):
+            self.harness.charm._reconcile(mock_event)
+        self.assertEqual(
+            self.harness.charm.unit.status,
+            BlockedStatus("Not allowed to manage the LDAP Service, run juju trust or unset service_type"),
+        )
+        self.assertEqual(self.harness.charm.leader_data["ldap_service"], "")
+
+    def test_configure_pod_invalid_service_type(self):
+        mock_event = MagicMock()
+
+        self.harness.update_config({"service_type": "NodePort"})
+        self.harness.charm._reconcile(mock_event)
+        self.assertEqual(
+            self.harness.charm.unit.status,
+            BlockedStatus("Invalid service_type, must be empty or one of: ClusterIP, LoadBalancer"),
+        )
+
+    def test_on_remove_deletes_ldap_service(self):
+        """Test the LDAP Service is only deleted along with the application's last unit."""
+        self.harness.set_leader(True)
+        self.harness.charm.leader_data["ldap_service"] = "{}"
+        with patch("kubernetes_service.delete") as delete:
+            self.harness.set_planned_units(2)
+            self.harness.charm._on_remove(MagicMock())
+            delete.assert_not_called()
+            self.harness.set_planned_units(0)
+            self.harness.charm._on_remove(MagicMock())
+            delete.assert_called_once_with(None, "openldap-k8s-ldap")
+
     def test_pwgen(self):
         """Test we produce a password of specified length."""
         first_pw_run = self.harness.charm._pwgen(40)
@@ -79,17 +671,35 @@ class TestOpenLDAPK8sCharmHooksDisabled(unittest.TestCase):
         mock_event = MagicMock()
 
         expected = WaitingStatus('Waiting for database relation')
-        self.harness.charm._on_config_changed(mock_event)
+        self.harness.charm._reconcile(mock_event)
         self.assertEqual(self.harness.charm.unit.status, expected)
 
     def test_configure_pod_not_leader(self):
         """Test pod config as a non-leader."""
         mock_event = MagicMock()
 
-        self.harness.charm._state.postgres = DB_URI
-        expected = ActiveStatus()
-        self.harness.charm._on_config_changed(mock_event)
-        self.assertEqual(self.harness.charm.unit.status, expected)
+        self.harness.charm._databases = (DB_URI, [])
+        self.harness.container_pebble_ready('openldap')
+        self.harness.charm._reconcile(mock_event)
+        self.assertEqual(self.harness.charm.unit.status, WaitingStatus("Waiting for leader to set the admin password"))
+
+        self.harness.charm.leader_data["admin_password"] = 'badmin_password'
+        self.harness.charm._reconcile(mock_event)
+        self.assertEqual(self.harness.charm.unit.status, WaitingStatus("Waiting for leader to set the admin password"))
+
+        self.harness.charm.leader_data["admin_password_hash"] = "{SSHA}badmin"
+        self.harness.charm._reconcile(mock_event)
+        self.assertEqual(
+            self.harness.charm.unit.status, WaitingStatus("Waiting for leader to migrate the database schema")
+        )
+
+        self.harness.charm.leader_data["schema_database"] = "1.1.1.1:5432/openldap"
+        with patch.object(self.harness.charm, "_migrate_schema") as migrate_schema:
+            self.harness.charm._reconcile(mock_event)
+        migrate_schema.assert_not_called()
+        self.assertEqual(self.harness.charm.unit.status, ActiveStatus())
+        plan = self.harness.model.unit.get_container("openldap").get_plan().to_dict()
+        self.assertEqual(plan["services"], self.harness.charm._openldap_layer()["services"])
 
     def test_configure_pod(self):
         """Test pod configuration with everything working appropriately."""
@@ -102,50 +712,329 @@ class TestOpenLDAPK8sCharmHooksDisabled(unittest.TestCase):
                 "openldap": {
                     "override": "replace",
                     "startup": "enabled",
-                    "command": "/srv/image-scripts/configure-and-run-openldap.sh",
+                    "command": "/usr/libexec/slapd -d 0 -h 'ldap:/// ldapi:///' -F /etc/openldap/slapd.d",
                     "environment": {
                         'POSTGRES_NAME': 'openldap',
                         'POSTGRES_USER': 'ldap_user',
                         'POSTGRES_PASSWORD': 'ldap_password',
                         'POSTGRES_HOST': '1.1.1.1',
                         'POSTGRES_PORT': '5432',
-                        'LDAP_ADMIN_PASSWORD': 'badmin_password',
+                        'LDAP_BACKEND': 'sql',
+                        'SLAPD_ROOTPW': '{SSHA}badmin',
+                        'LDAP_WRITE_REFERRAL': '',
+                        'ODBC_READ_ONLY': '0',
+                        'SLAPD_LOG_LEVEL': 'none',
+                        'ODBC_DEBUG': '0',
+                        'ODBC_COMMLOG': '0',
+                        'SLAPD_THREADS': '0',
+                        'SLAPD_LISTENER_THREADS': '0',
+                        'SLAPD_CONN_MAX_PENDING': '100',
+                        'SLAPD_CONN_MAX_PENDING_AUTH': '1000',
+                        'SLAPD_IDLETIMEOUT': '0',
+                        'SLAPD_SIZELIMIT': '500',
+                        'SLAPD_TIMELIMIT': '3600',
+                        'ODBC_FETCH_SIZE': '1000',
+                        'ODBC_USE_DECLARE_FETCH': '0',
+                        'ODBC_POOLING': 'Yes',
+                        'ODBC_POOL_TIMEOUT': '60',
+                        'ODBC_SERVER_SIDE_PREPARE': '1',
+                        'ODBC_APPLICATION_NAME': 'slapd-openldap-k8s-0',
+                        'LDAP_CACHE_TEMPLATES': '',
+                        'LDAP_CACHE_MAX_ENTRIES': '10000',
+                        'LDAP_CACHE_TTL': '300',
                     },
-                }
+                },
+                "cache-invalidator": {
+                    "override": "replace",
+                    "startup": "disabled",
+                    "command": "/srv/image-scripts/pcache-invalidator.py",
+                    "environment": {
+                        'POSTGRES_NAME': 'openldap',
+                        'POSTGRES_USER': 'ldap_user',
+                        'POSTGRES_PASSWORD': 'ldap_password',
+                        'POSTGRES_HOST': '1.1.1.1',
+                        'POSTGRES_PORT': '5432',
+                    },
+                },
+                "slow-query-sampler": {
+                    "override": "replace",
+                    "startup": "disabled",
+                    "command": "/srv/image-scripts/slow-query-sampler.py",
+                    "environment": {
+                        'POSTGRES_NAME': 'openldap',
+                        'POSTGRES_USER': 'ldap_user',
+                        'POSTGRES_PASSWORD': 'ldap_password',
+                        'POSTGRES_HOST': '1.1.1.1',
+                        'POSTGRES_PORT': '5432',
+                        'SLOW_QUERY_THRESHOLD_MS': '0',
+                        'SLOW_QUERY_APPLICATION_NAME': 'slapd-openldap-k8s-0',
+                    },
+                },
+                "metrics-exporter": {
+                    "override": "replace",
+                    "startup": "enabled",
+                    "command": "/srv/image-scripts/monitor-exporter.py",
+                    "environment": {'METRICS_PORT': '9330'},
+                },
+                "syslog": {
+                    "override": "replace",
+                    "startup": "enabled",
+                    "command": "/srv/image-scripts/syslog-forwarder.py",
+                },
             },
             "checks": {
                 "online": {
                     "override": "replace",
-                    "level": "ready",
+                    "level": "alive",
                     "tcp": {
                         "port": 389,
                     },
                 },
+                "ldap-ready": {
+                    "override": "replace",
+                    "level": "ready",
+                    "period": "10s",
+                    "timeout": "5s",
+                    "threshold": 3,
+                    "exec": {"command": "/srv/image-scripts/ldap-ready.sh"},
+                },
             },
         }
 
-        self.harness.charm._state.postgres = DB_URI
+        self.harness.charm._databases = (DB_URI, [])
         self.harness.set_leader(True)
         expected_status = ActiveStatus()
-        with patch.object(self.harness.charm, "get_admin_password") as get_admin_password:
+        with patch.object(self.harness.charm, "get_admin_password") as get_admin_password, patch.object(
+            self.harness.charm, "_migrate_schema"
+        ):
             get_admin_password.return_value = 'badmin_password'
             self.harness.container_pebble_ready('openldap')
-            self.harness.charm._on_config_changed(mock_event)
+            self.harness.charm._reconcile(mock_event)
             self.assertEqual(self.harness.charm.unit.status, expected_status)
             self.assertEqual(self.harness.charm._openldap_layer(), expected)
             self.harness.update_config({"container_port": 567})
-            self.harness.charm._on_config_changed(mock_event)
+            self.harness.charm._reconcile(mock_event)
             expected["checks"]["online"]["tcp"]["port"] = 567
             self.assertEqual(self.harness.charm.unit.status, expected_status)
             self.assertEqual(self.harness.charm._openldap_layer(), expected)
 
+    @patch("charm.OpenLDAPK8sCharm.get_admin_password", MagicMock(return_value='badmin_password'))
+    def test_migrate_schema_once_per_database(self):
+        """Test the leader migrates the schema once for each database."""
+        mock_event = MagicMock()
+        container = self.harness.model.unit.get_container("openldap")
+
+        self.harness.container_pebble_ready('openldap')
+        self.harness.charm._databases = (DB_URI, [])
+        self.harness.set_leader(True)
+        with patch.object(container, "exec") as container_exec:
+            container_exec.return_value.wait_output.return_value = ("Schema is at version 3\n", "")
+            self.harness.charm._reconcile(mock_event)
+            self.harness.charm._reconcile(mock_event)
+        container_exec.assert_called_once_with(
+            ["/srv/image-scripts/migrate-schema.sh"],
+            environment={
+                'POSTGRES_NAME': 'openldap',
+                'POSTGRES_USER': 'ldap_user',
+                'POSTGRES_PASSWORD': 'ldap_password',
+                'POSTGRES_HOST': '1.1.1.1',
+                'POSTGRES_PORT': '5432',
+            },
+        )
+        self.assertEqual(self.harness.charm.leader_data["schema_database"], "1.1.1.1:5432/openldap")
+        self.assertEqual(
+            self.harness.charm.leader_data["primary_address"],
+            "openldap-k8s-0.openldap-k8s-endpoints.{}.svc.cluster.local".format(self.harness.model.name),
+        )
+        self.assertEqual(self.harness.charm.unit.status, ActiveStatus())
+
+        # A new image may bring new migrations.
+        with patch.object(container, "exec") as container_exec:
+            container_exec.return_value.wait_output.return_value = ("Schema is at version 4\n", "")
+            self.harness.charm._on_upgrade_charm(mock_event)
+        container_exec.assert_called_once()
+        self.assertEqual(self.harness.charm.leader_data["schema_database"], "1.1.1.1:5432/openldap")
+
+    @patch("leadership.subprocess.check_call")
+    @patch("leadership.subprocess.check_output", return_value=b"")
+    @patch.object(LeadershipSettings, "_LeadershipSettings__cls_pending", {})
+    @patch.object(LeadershipSettings, "_LeadershipSettings__cls_cache", None)
+    def test_leadership_settings_set_at_end_of_hook(self, leader_get, leader_set):
+        """Test the leader sets everything it writes during a hook with one leader-get and one leader-set."""
+        self.harness.charm.leader_data = LeadershipSettings()
+        self.harness.container_pebble_ready('openldap')
+        self.harness.charm._databases = (DB_URI, [])
+        self.harness.set_leader(True)
+        container = self.harness.model.unit.get_container("openldap")
+        with patch.object(container, "exec") as container_exec:
+            container_exec.return_value.wait_output.return_value = ("", "")
+            self.harness.charm._reconcile(MagicMock())
+        self.assertEqual(self.harness.charm.unit.status, ActiveStatus())
+        leader_set.assert_not_called()
+
+        self.harness.framework.commit()
+        leader_get.assert_called_once()
+        leader_set.assert_called_once()
+        self.assertEqual(
+            sorted(arg.partition("=")[0] for arg in leader_set.call_args[0][0][1:]),
+            ["admin_password", "admin_password_hash", "primary_address", "schema_database"],
+        )
+
+    @patch("charm.OpenLDAPK8sCharm.get_admin_password", MagicMock(return_value='badmin_password'))
+    def test_migrate_schema_failed(self):
+        """Test we wait and retry when the schema migration fails."""
+        mock_event = MagicMock()
+
+        self.harness.container_pebble_ready('openldap')
+        self.harness.charm._databases = (DB_URI, [])
+        self.harness.set_leader(True)
+        with patch.object(self.harness.charm, "_migrate_schema") as migrate_schema:
+            migrate_schema.side_effect = ExecError(["migrate-schema.sh"], 2, "", "connection refused")
+            self.harness.charm._reconcile(mock_event)
+        self.assertEqual(self.harness.charm.unit.status, WaitingStatus("waiting for database schema migration"))
+        mock_event.defer.assert_not_called()
+        self.assertEqual(self.harness.model.unit.get_container("openldap").get_plan().services, {})
+
+        # The next event, update-status at the latest, tries again.
+        with patch.object(self.harness.charm, "_migrate_schema"):
+            self.harness.charm._reconcile(mock_event)
+        self.assertEqual(self.harness.charm.unit.status, ActiveStatus())
+
+    @patch("charm.OpenLDAPK8sCharm.get_admin_password", MagicMock(return_value='badmin_password'))
+    def test_configure_pgbouncer(self):
+        """Test slapd connects through PgBouncer when it is enabled."""
+        mock_event = MagicMock()
+        pgbouncer = self.harness.model.unit.get_container("pgbouncer")
+
+        self.harness.charm._databases = (DB_URI, [])
+        self.harness.charm.leader_data["schema_database"] = "1.1.1.1:5432/openldap"
+        self.harness.charm.leader_data["admin_password"] = "badmin_password"
+        self.harness.charm.leader_data["admin_password_hash"] = "{SSHA}badmin"
+        self.harness.container_pebble_ready('openldap')
+        self.harness.update_config({"pgbouncer_enabled": True, "pgbouncer_pool_size": 10})
+
+        self.harness.set_can_connect(pgbouncer, False)
+        self.harness.charm._reconcile(mock_event)
+        self.assertEqual(self.harness.charm.unit.status, WaitingStatus("waiting for Pebble in pgbouncer container"))
+
+        self.harness.container_pebble_ready('pgbouncer')
+        self.harness.charm._reconcile(mock_event)
+        self.assertEqual(self.harness.charm.unit.status, ActiveStatus())
+        self.assertTrue(pgbouncer.get_service("pgbouncer").is_running())
+        pgbouncer_ini = pgbouncer.pull("/etc/pgbouncer/pgbouncer.ini").read()
+        self.assertIn("openldap = host=1.1.1.1 port=5432 dbname=openldap\n", pgbouncer_ini)
+        self.assertIn("pool_mode = transaction\n", pgbouncer_ini)
+        self.assertIn("default_pool_size = 10\n", pgbouncer_ini)
+        self.assertEqual(pgbouncer.pull("/etc/pgbouncer/userlist.txt").read(), '"ldap_user" "ldap_password"\n')
+
+        plan = self.harness.model.unit.get_container("openldap").get_plan().to_dict()
+        environment = plan["services"]["openldap"]["environment"]
+        self.assertEqual(environment["POSTGRES_HOST"], "127.0.0.1")
+        self.assertEqual(environment["POSTGRES_PORT"], "6432")
+        self.assertEqual(environment["ODBC_SERVER_SIDE_PREPARE"], "0")
+
+        # Pool changes are applied by reloading PgBouncer.
+        with patch.object(pgbouncer, "send_signal") as send_signal:
+            self.harness.charm._reconcile(mock_event)
+            send_signal.assert_not_called()
+            self.harness.update_config({"pgbouncer_pool_size": 30})
+            self.harness.charm._reconcile(mock_event)
+            send_signal.assert_called_once_with("SIGHUP", "pgbouncer")
+
+        self.harness.update_config({"pgbouncer_enabled": False})
+        self.harness.charm._reconcile(mock_event)
+        self.assertFalse(pgbouncer.get_service("pgbouncer").is_running())
+        plan = self.harness.model.unit.get_container("openldap").get_plan().to_dict()
+        self.assertEqual(plan["services"]["openldap"]["environment"]["POSTGRES_HOST"], "1.1.1.1")
+
+    @patch("charm.OpenLDAPK8sCharm.get_admin_password", MagicMock(return_value='badmin_password'))
+    def test_configure_pod_starts_metrics_exporter(self):
+        """Test the metrics exporter runs alongside slapd."""
+        container = self.harness.model.unit.get_container("openldap")
+        self.harness.charm._databases = (DB_URI, [])
+        self.harness.charm.leader_data["schema_database"] = "1.1.1.1:5432/openldap"
+        self.harness.set_leader(True)
+        self.harness.container_pebble_ready('openldap')
+        self.harness.charm._reconcile(MagicMock())
+        self.assertTrue(container.get_service("metrics-exporter").is_running())
+
+    def test_configure_pod_starts_syslog_before_slapd(self):
+        """Test slapd's syslog messages have somewhere to go before slapd starts."""
+        container = self.harness.model.unit.get_container("openldap")
+        self.harness.charm._databases = (DB_URI, [])
+        self.harness.charm.leader_data["schema_database"] = "1.1.1.1:5432/openldap"
+        self.harness.set_leader(True)
+        calls = []
+        for method in ("start", "restart"):
+            original = getattr(container, method)
+            patcher = patch.object(
+                container,
+                method,
+                side_effect=lambda *services, method=method, original=original: (
+                    calls.append((method, *services)),
+                    original(*services),
+                ),
+            )
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.harness.container_pebble_ready('openldap')
+        self.assertLess(calls.index(("start", "syslog")), calls.index(("restart", "openldap")))
+        self.assertTrue(container.get_service("syslog").is_running())
+
+    def test_on_metrics_endpoint_relation_joined(self):
+        """Test the scrape job and unit address are published for Prometheus."""
+        self.harness.set_leader(True)
+        self.harness.enable_hooks()
+        relation_id = self.harness.add_relation("metrics-endpoint", "prometheus")
+        self.harness.add_relation_unit(relation_id, "prometheus/0")
+        app_data = self.harness.get_relation_data(relation_id, self.harness.charm.app.name)
+        self.assertEqual(
+            json.loads(app_data["scrape_jobs"]),
+            [{"metrics_path": "/metrics", "static_configs": [{"targets": ["*:9330"]}]}],
+        )
+        self.assertEqual(json.loads(app_data["scrape_metadata"])["application"], "openldap-k8s")
+        unit_data = self.harness.get_relation_data(relation_id, self.harness.charm.unit.name)
+        self.assertEqual(unit_data["prometheus_scrape_unit_name"], "openldap-k8s/0")
+        self.assertEqual(
+            unit_data["prometheus_scrape_unit_address"],
+            "openldap-k8s-0.openldap-k8s-endpoints.{}.svc.cluster.local".format(self.harness.model.name),
+        )
+
     def test_on_database_relation_joined(self):
+        """Test the leader requests the database for the application and itself."""
         mock_event = MagicMock()
+        relation_id = self.harness.add_relation('db', 'postgresql')
 
         self.harness.set_leader(True)
-        expected = "openldap"
         self.harness.charm._on_database_relation_joined(mock_event)
-        self.assertEqual(mock_event.database, expected)
+        app_data = self.harness.get_relation_data(relation_id, self.harness.charm.app.name)
+        unit_data = self.harness.get_relation_data(relation_id, self.harness.charm.unit.name)
+        self.assertEqual(app_data['database'], "openldap")
+        self.assertEqual(unit_data['database'], "openldap")
+
+    def test_on_database_relation_joined_not_leader(self):
+        """Test other units request the database in their own data, for older PostgreSQL charms."""
+        mock_event = MagicMock()
+        relation_id = self.harness.add_relation('db', 'postgresql')
+
+        self.harness.charm._on_database_relation_joined(mock_event)
+        app_data = self.harness.get_relation_data(relation_id, self.harness.charm.app.name)
+        unit_data = self.harness.get_relation_data(relation_id, self.harness.charm.unit.name)
+        self.assertNotIn('database', app_data)
+        self.assertEqual(unit_data['database'], "openldap")
+        mock_event.defer.assert_not_called()
+
+    def test_on_leader_elected_requests_database(self):
+        """Test a new leader requests the database if the previous one didn't."""
+        mock_event = MagicMock()
+        relation_id = self.harness.add_relation('db', 'postgresql')
+
+        self.harness.set_leader(True)
+        self.harness.charm._on_leader_elected(mock_event)
+        app_data = self.harness.get_relation_data(relation_id, self.harness.charm.app.name)
+        self.assertEqual(app_data['database'], "openldap")
+        self.assertEqual(self.harness.charm.unit.status, WaitingStatus('Waiting for database relation'))
+        mock_event.defer.assert_not_called()
 
     def test_on_database_relation_broken(self):
         mock_event = MagicMock()
@@ -155,23 +1044,86 @@ class TestOpenLDAPK8sCharmHooksDisabled(unittest.TestCase):
         self.harness.charm._on_database_relation_broken(mock_event)
         self.assertEqual(self.harness.charm.unit.status, expected)
 
-    def test_on_master_changed(self):
+    def test_database_state(self):
+        """Test the databases are read from the db relation once the server has the requested database."""
+        relation_id = self.harness.add_relation('db', 'postgresql')
+        self.harness.add_relation_unit(relation_id, 'postgresql/0')
+        server_data = {
+            'master': 'dbname=openldap user=ldap_user password=ldap_password host=1.1.1.1 port=5432',
+            'standbys': 'dbname=openldap user=ldap_user password=ldap_password host=1.1.1.2 port=5432',
+        }
+        self.harness.update_relation_data(relation_id, 'postgresql/0', server_data)
+        self.assertIsNone(self.harness.charm._primary_database())
+
+        self.harness.charm._databases = None
+        self.harness.update_relation_data(relation_id, 'postgresql/0', {'database': 'openldap'})
+        self.assertEqual(self.harness.charm._primary_database(), DB_URI)
+        self.assertEqual(self.harness.charm._standby_databases(), [{**DB_URI, 'host': '1.1.1.2'}])
+
+    def test_database_state_egress_not_allowed(self):
+        """Test the databases aren't used until the server lets this unit's egress subnets in."""
+        relation_id = self.harness.add_relation('db', 'postgresql')
+        self.harness.add_relation_unit(relation_id, 'postgresql/0')
+        self.harness.update_relation_data(
+            relation_id, self.harness.charm.unit.name, {'egress-subnets': '10.1.0.0/16,10.2.0.0/16'}
+        )
+        self.harness.update_relation_data(
+            relation_id,
+            'postgresql/0',
+            {
+                'database': 'openldap',
+                'allowed-subnets': '10.1.0.0/16',
+                'master': 'dbname=openldap user=ldap_user password=ldap_password host=1.1.1.1 port=5432',
+            },
+        )
+        self.assertIsNone(self.harness.charm._primary_database())
+
+        self.harness.charm._databases = None
+        self.harness.update_relation_data(relation_id, 'postgresql/0', {'allowed-subnets': '10.1.0.0/16, 10.2.0.0/16'})
+        self.assertEqual(self.harness.charm._primary_database(), DB_URI)
+        self.assertEqual(self.harness.charm._standby_databases(), [])
+
+    def test_database_state_no_relation(self):
+        self.assertIsNone(self.harness.charm._primary_database())
+        self.assertEqual(self.harness.charm._standby_databases(), [])
+
+    @patch("charm.OpenLDAPK8sCharm.get_admin_password", MagicMock(return_value='badmin_password'))
+    def test_on_standby_changed(self):
+        """Test non-leaders read from the standbys and refer writes to the leader."""
         mock_event = MagicMock()
 
+        self.harness.charm._databases = (DB_URI, [{**DB_URI, 'host': '1.1.1.3'}, {**DB_URI, 'host': '1.1.1.2'}])
+        self.harness.charm.leader_data["schema_database"] = "1.1.1.1:5432/openldap"
+        self.harness.charm.leader_data["admin_password_hash"] = "{SSHA}badmin"
+        self.harness.charm.leader_data["primary_address"] = (
+            "openldap-k8s-1.openldap-k8s-endpoints.test.svc.cluster.local"
+        )
+        self.harness.container_pebble_ready('openldap')
+        self.harness.update_config({"read_from_standbys": True})
+        self.harness.charm._reconcile(mock_event)
+
+        plan = self.harness.model.unit.get_container("openldap").get_plan().to_dict()
+        environment = plan["services"]["openldap"]["environment"]
+        # Unit 0 gets the first standby.
+        self.assertEqual(environment["POSTGRES_HOST"], "1.1.1.2")
+        self.assertEqual(environment["ODBC_READ_ONLY"], "1")
+        self.assertEqual(
+            environment["LDAP_WRITE_REFERRAL"],
+            "ldap://openldap-k8s-1.openldap-k8s-endpoints.test.svc.cluster.local:389",
+        )
+
+        # The leader keeps the primary and serves writes.
         self.harness.set_leader(True)
-        master = namedtuple('master', ['dbname', 'user', 'password', 'host', 'port'])
-        master.dbname = "openldap"
-        master.user = "ldap_user"
-        master.password = "ldap_password"
-        master.host = "1.1.1.1"
-        master.port = "5432"
-        mock_event.master = master
-        mock_event.database = "openldap"
+        environment = self.harness.charm._openldap_layer()["services"]["openldap"]["environment"]
+        self.assertEqual(environment["POSTGRES_HOST"], "1.1.1.1")
+        self.assertEqual(environment["LDAP_WRITE_REFERRAL"], "")
 
-        with patch.object(self.harness.charm, "get_admin_password") as get_admin_password:
-            get_admin_password.return_value = 'badmin_password'
-            self.harness.charm._on_master_changed(mock_event)
-            self.assertEqual(self.harness.charm._state.postgres['dbname'], "openldap")
+        # Without standbys, every unit uses the primary.
+        self.harness.set_leader(False)
+        self.harness.charm._databases = (DB_URI, [])
+        self.harness.charm._reconcile(mock_event)
+        plan = self.harness.model.unit.get_container("openldap").get_plan().to_dict()
+        self.assertEqual(plan["services"]["openldap"]["environment"]["POSTGRES_HOST"], "1.1.1.1")
 
     def test_on_get_admin_password_action(self):
         mock_event = MagicMock()
@@ -185,3 +1137,292 @@ class TestOpenLDAPK8sCharmHooksDisabled(unittest.TestCase):
             mock_event.reset_mock()
             self.harness.charm._on_get_admin_password_action(mock_event)
             mock_event.fail.assert_called_with("LDAP admin password has not yet been set, please retry later.")
+
+    def test_on_get_cache_stats_action(self):
+        """Test cache statistics are read from slapd's monitor database."""
+        mock_event = MagicMock()
+        self.harness.update_config({"cache_enabled": True})
+        monitor = "\n".join(
+            [
+                "dn: cn=Search,cn=Operations,cn=Monitor",
+                "monitorOpCompleted: 120",
+                "",
+                "dn: cn=Database 1,cn=Databases,cn=Monitor",
+                "pcacheNumQueries: 2",
+                "pcacheNumEntries: 7",
+                "pcacheQueryURL: ldap:///dc=example??sub?(uid=a)?x-uuid=1,x-answerable=80,x-refcnt=0",
+                "pcacheQueryURL: ldap:///dc=example??sub?(uid=b)?x-uuid=2,x-answerable=20,x-refcnt=0",
+                "",
+            ]
+        )
+        self.harness.container_pebble_ready('openldap')
+        container = self.harness.model.unit.get_container("openldap")
+        with patch.object(container, "exec") as container_exec:
+            container_exec.return_value.wait_output.return_value = (monitor, "")
+            self.harness.charm._on_get_cache_stats_action(mock_event)
+        mock_event.set_results.assert_called_with(
+            {"cached-queries": 2, "cached-entries": 7, "searches": 120, "hits": 100, "misses": 20}
+        )
+
+    def test_on_get_cache_stats_action_cache_disabled(self):
+        mock_event = MagicMock()
+        self.harness.charm._on_get_cache_stats_action(mock_event)
+        mock_event.fail.assert_called_with("The search result cache is not enabled.")
+
+    def test_on_get_slow_queries_action(self):
+        """Test the slowest recorded statements are returned first."""
+        mock_event = MagicMock()
+        mock_event.params = {"count": 2}
+        self.harness.container_pebble_ready('openldap')
+        container = self.harness.model.unit.get_container("openldap")
+        self.harness.charm._on_get_slow_queries_action(mock_event)
+        mock_event.fail.assert_called_with(
+            "No slow statements have been recorded, see the slow_query_threshold option."
+        )
+
+        records = [
+            {"started": "t1", "statement": "select 1", "ldap_connections": [], "duration_ms": 150},
+            {"started": "t2", "statement": "select 2", "ldap_connections": ["conn=1001"], "duration_ms": 900},
+            {"started": "t3", "statement": "select 3", "ldap_connections": [], "duration_ms": 300},
+        ]
+        container.push(
+            "/var/log/slapd-slow-queries.jsonl", "".join(json.dumps(r) + "\n" for r in records), make_dirs=True
+        )
+        self.harness.charm._on_get_slow_queries_action(mock_event)
+        results = json.loads(mock_event.set_results.call_args[0][0]["slow-queries"])
+        self.assertEqual([record["statement"] for record in results], ["select 2", "select 3"])
+
+    @patch("charm.OpenLDAPK8sCharm.get_admin_password", MagicMock(return_value='badmin_password'))
+    def test_configure_pod_slow_query_sampler(self):
+        """Test the sampler watches this unit's slapd sessions in the database itself."""
+        self.harness.charm._databases = (DB_URI, [])
+        self.harness.charm.leader_data["schema_database"] = "1.1.1.1:5432/openldap"
+        self.harness.set_leader(True)
+        self.harness.container_pebble_ready('openldap')
+        self.harness.update_config({"slow_query_threshold": 250, "pgbouncer_enabled": True})
+        self.harness.container_pebble_ready('pgbouncer')
+        self.harness.charm._reconcile(MagicMock())
+        container = self.harness.model.unit.get_container("openldap")
+        self.assertTrue(container.get_service("slow-query-sampler").is_running())
+        services = container.get_plan().to_dict()["services"]
+        self.assertEqual(services["slow-query-sampler"]["environment"]["POSTGRES_PORT"], "5432")
+        self.assertEqual(services["slow-query-sampler"]["environment"]["SLOW_QUERY_THRESHOLD_MS"], "250")
+        self.assertEqual(services["openldap"]["environment"]["POSTGRES_PORT"], "6432")
+
+    def test_on_bulk_import_action(self):
+        """Test the importer runs against the primary and its progress is logged."""
+        mock_event = MagicMock()
+        mock_event.params = {"path": "/tmp/people.ldif", "batch-size": 5000}
+        self.harness.charm._databases = (DB_URI, [])
+        self.harness.container_pebble_ready('openldap')
+        container = self.harness.model.unit.get_container("openldap")
+        with patch.object(container, "exec") as container_exec:
+            container_exec.return_value.stdout = iter(
+                ["Copied 5000 entries, 25000 entries/s\n", "Imported 6000 entries in 0.3s, 20000 entries/s\n"]
+            )
+            self.harness.charm._on_bulk_import_action(mock_event)
+        container_exec.assert_called_once_with(
+            ["python3", "/srv/charm-scripts/bulk_import.py", "/tmp/people.ldif", "--batch-size", "5000"],
+            environment=self.harness.charm._postgres_environment(),
+            combine_stderr=True,
+        )
+        self.assertTrue(container.exists("/srv/charm-scripts/bulk_import.py"))
+        mock_event.log.assert_any_call("Copied 5000 entries, 25000 entries/s")
+        mock_event.set_results.assert_called_with({"result": "Imported 6000 entries in 0.3s, 20000 entries/s"})
+
+    def test_on_bulk_import_action_failed(self):
+        mock_event = MagicMock()
+        mock_event.params = {"path": "/tmp/people.ldif", "batch-size": 5000}
+        self.harness.charm._databases = (DB_URI, [])
+        self.harness.container_pebble_ready('openldap')
+        container = self.harness.model.unit.get_container("openldap")
+        with patch.object(container, "exec") as container_exec:
+            container_exec.return_value.stdout = iter(["Import failed, nothing was imported\n"])
+            container_exec.return_value.wait.side_effect = ExecError(["python3"], 1, None, None)
+            self.harness.charm._on_bulk_import_action(mock_event)
+        mock_event.fail.assert_called_with("Import failed, nothing was imported")
+        mock_event.set_results.assert_not_called()
+
+    def test_on_export_action(self):
+        """Test exports read from this unit's standby."""
+        mock_event = MagicMock()
+        mock_event.params = {"path": "/var/backups/openldap.ldif.gz"}
+        standby = {**DB_URI, 'host': '2.2.2.2'}
+        self.harness.charm._databases = (DB_URI, [standby])
+        self.harness.charm.leader_data["primary_address"] = "openldap-k8s-1.openldap-k8s-endpoints"
+        self.harness.update_config({"read_from_standbys": True})
+        self.harness.container_pebble_ready('openldap')
+        container = self.harness.model.unit.get_container("openldap")
+        with patch.object(container, "exec") as container_exec:
+            container_exec.return_value.stdout = iter(["Exported 3 entries to /var/backups/openldap.ldif.gz\n"])
+            self.harness.charm._on_export_action(mock_event)
+        container_exec.assert_called_once_with(
+            ["python3", "/srv/charm-scripts/bulk_export.py", "/var/backups/openldap.ldif.gz"],
+            environment=self.harness.charm._postgres_environment(standby),
+            combine_stderr=True,
+        )
+        mock_event.set_results.assert_called_with(
+            {"result": "Exported 3 entries to /var/backups/openldap.ldif.gz", "path": "/var/backups/openldap.ldif.gz"}
+        )
+
+
+class TestOpenLDAPK8sCharmScaleOut(unittest.TestCase):
+    def setUp(self):
+        # Leadership settings are shared by every unit of the application.
+        self.leader_data = LeaderData()
+
+    def _unit(self, is_leader):
+        harness = testing.Harness(OpenLDAPK8sCharm)
+        self.addCleanup(harness.cleanup)
+        harness.begin()
+        harness.disable_hooks()
+        harness.charm.leader_data = self.leader_data
+        harness.container_pebble_ready('openldap')
+        harness.charm._databases = (DB_URI, [])
+        harness.set_leader(is_leader)
+        return harness
+
+    def test_every_unit_runs_openldap(self):
+        """Test the leader and every non-leader unit get the same workload layer."""
+        mock_event = MagicMock()
+        units = [self._unit(is_leader=True), self._unit(is_leader=False), self._unit(is_leader=False)]
+
+        leader_container = units[0].model.unit.get_container("openldap")
+        with patch.object(leader_container, "exec") as container_exec:
+            container_exec.return_value.wait_output.return_value = ("", "")
+            units[0].charm._reconcile(mock_event)
+        # The leader migrates the schema, then every unit has slaptest convert its rendered slapd.conf.
+        self.assertEqual(container_exec.call_count, 2)
+        container_exec.assert_called_with(slapd_config.SLAPTEST_COMMAND)
+
+        for harness in units[1:]:
+            with patch.object(harness.model.unit.get_container("openldap"), "exec") as container_exec:
+                harness.charm._reconcile(mock_event)
+            container_exec.assert_called_once_with(slapd_config.SLAPTEST_COMMAND)
+
+        expected = units[0].charm._openldap_layer()["services"]
+        self.assertTrue(self.leader_data["admin_password_hash"].startswith("{SSHA}"))
+        self.assertEqual(expected["openldap"]["environment"]["SLAPD_ROOTPW"], self.leader_data["admin_password_hash"])
+        for harness in units:
+            self.assertEqual(harness.charm.unit.status, ActiveStatus())
+            plan = harness.model.unit.get_container("openldap").get_plan().to_dict()
+            self.assertEqual(plan["services"], expected)
+            slapd_conf = harness.model.unit.get_container("openldap").pull(slapd_config.SLAPD_CONF).read()
+            self.assertIn("rootpw             {}".format(self.leader_data["admin_password_hash"]), slapd_conf)
+
+
+class TestOpenLDAPK8sCharmControllerStorage(unittest.TestCase):
+    """Framework storage writes, each a round trip to the controller with use_juju_for_storage."""
+
+    def setUp(self):
+        self.harness = testing.Harness(OpenLDAPK8sCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.begin()
+        self.harness.charm.leader_data = LeaderData()
+        self.storage = self.harness.framework._storage
+
+    def _run_hook(self, event):
+        """Dispatch a hook the way ops.main does, returning how many storage writes it made."""
+        methods = ("save_snapshot", "drop_snapshot", "save_notice", "drop_notice")
+        mocks = [patch.object(self.storage, method, wraps=getattr(self.storage, method)) for method in methods]
+        counters = [mock.start() for mock in mocks]
+        try:
+            self.harness.framework.reemit()
+            event.emit()
+            self.harness.framework.commit()
+        finally:
+            for mock in mocks:
+                mock.stop()
+        return sum(counter.call_count for counter in counters)
+
+    def test_waiting_for_database_writes_per_hook(self):
+        """Test hooks run while waiting for the database leave nothing queued for later hooks."""
+        # A warm-up hook, whose writes also set up the framework and its
+        # storage, so only the hooks after it are counted.
+        self._run_hook(self.harness.charm.on.config_changed)
+        writes = [
+            self._run_hook(self.harness.charm.on.config_changed),
+            self._run_hook(self.harness.charm.on.update_status),
+            self._run_hook(self.harness.charm.on.config_changed),
+        ]
+        self.assertEqual(self.harness.charm.unit.status, WaitingStatus('Waiting for database relation'))
+        self.assertEqual(list(self.storage.notices()), [])
+        # Saving and dropping the event and its notice, the commit event and
+        # its notice, and the framework's event counter. A deferred event
+        # would instead stay stored and be run again by every later hook.
+        self.assertEqual(writes, [9, 9, 9])
+
+    def test_database_relation_changed_without_joined(self):
+        """Test a unit that didn't see db-relation-joined, like a rescheduled pod, uses the database straight away."""
+        with self.harness.hooks_disabled():
+            relation_id = self.harness.add_relation('db', 'postgresql')
+            self.harness.add_relation_unit(relation_id, 'postgresql/0')
+        self.harness.charm._databases = None
+        self.harness.update_relation_data(
+            relation_id,
+            'postgresql/0',
+            {
+                'database': 'openldap',
+                'master': 'dbname=openldap user=ldap_user password=ldap_password host=1.1.1.1 port=5432',
+            },
+        )
+        self.assertEqual(self.harness.charm._primary_database(), DB_URI)
+        self.assertEqual(list(self.storage.notices()), [])
+        self.assertEqual(self.harness.charm.unit.status, WaitingStatus("Waiting for leader to set the admin password"))
+
+
+class TestOpenLDAPK8sCharmHookTools(unittest.TestCase):
+    """leader-get and leader-set calls, each a round trip to the controller."""
+
+    def setUp(self):
+        for name, value in (("_LeadershipSettings__cls_cache", None), ("_LeadershipSettings__cls_pending", {})):
+            patcher = patch.object(LeadershipSettings, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch("leadership.subprocess.check_output")
+        self.leader_get = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch("leadership.subprocess.check_call")
+        self.leader_set = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(OpenLDAPK8sCharm, "_write_openldap_config")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.harness = testing.Harness(OpenLDAPK8sCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.begin()
+
+    def test_database_relation_changed_leader_get_once(self):
+        """Test a new primary costs the leader one leader-get, and one leader-set for the migrated schema."""
+        self.leader_get.return_value = yaml.safe_dump(
+            {
+                "admin_password": "badmin_password",
+                "admin_password_hash": "{SSHA}badmin",
+                "schema_database": "1.1.1.1:5432/openldap",
+                "primary_address": self.harness.charm._unit_address(),
+            }
+        ).encode()
+        with self.harness.hooks_disabled():
+            self.harness.set_leader(True)
+            relation_id = self.harness.add_relation('db', 'postgresql')
+            self.harness.add_relation_unit(relation_id, 'postgresql/0')
+            self.harness.update_relation_data(relation_id, 'postgresql/0', {'database': 'openldap'})
+        self.harness.container_pebble_ready('openldap')
+        # As a new hook process would, start from nothing read.
+        self.harness.charm.leader_data.invalidate()
+        self.harness.charm._databases = None
+        self.leader_get.reset_mock()
+
+        container = self.harness.model.unit.get_container("openldap")
+        with patch.object(container, "exec") as container_exec:
+            container_exec.return_value.wait_output.return_value = ("", "")
+            self.harness.update_relation_data(
+                relation_id,
+                'postgresql/0',
+                {'master': 'dbname=openldap user=ldap_user password=ldap_password host=1.1.1.2 port=5432'},
+            )
+            self.harness.framework.commit()
+        self.assertEqual(self.harness.charm.unit.status, ActiveStatus())
+        self.leader_get.assert_called_once_with(["leader-get", "--format=yaml"])
+        self.leader_set.assert_called_once_with(["leader-set", "schema_database=1.1.1.2:5432/openldap"])
@@ -0,0 +1,88 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Unit tests for managing the LDAP Service through the Kubernetes API."""
+
+import io
+import json
+import tempfile
+import unittest
+import urllib.error
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import kubernetes_service
+
+
+class TestKubernetesService(unittest.TestCase):
+    def setUp(self):
+        service_account = tempfile.TemporaryDirectory()
+        self.addCleanup(service_account.cleanup)
+        Path(service_account.name, "token").write_text("secret-token\n")
+        patchers = [
+            patch("kubernetes_service.SERVICE_ACCOUNT", service_account.name),
+            patch.dict("os.environ", {"KUBERNETES_SERVICE_HOST": "10.0.0.1", "KUBERNETES_SERVICE_PORT": "443"}),
+            patch("kubernetes_service.ssl.create_default_context"),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch("kubernetes_service.urllib.request.urlopen")
+        self.urlopen = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _respond(self, body):
+        response = MagicMock()
+        response.__enter__.return_value = io.BytesIO(json.dumps(body).encode())
+        self.urlopen.return_value = response
+
+    def test_manifest(self):
+        """Test the Service selects every pod of the application on the LDAP port."""
+        service = kubernetes_service.manifest("openldap-k8s-ldap", "openldap-k8s", "ClusterIP", 389)
+        self.assertEqual(service["metadata"]["name"], "openldap-k8s-ldap")
+        self.assertEqual(service["spec"]["type"], "ClusterIP")
+        self.assertEqual(service["spec"]["selector"], {"app.kubernetes.io/name": "openldap-k8s"})
+        self.assertEqual(
+            service["spec"]["ports"], [{"name": "ldap", "protocol": "TCP", "port": 389, "targetPort": 389}]
+        )
+
+    def test_apply(self):
+        """Test Services are applied server-side, as the charm's service account."""
+        service = kubernetes_service.manifest("openldap-k8s-ldap", "openldap-k8s", "LoadBalancer", 389)
+        self._respond({**service, "status": {"loadBalancer": {"ingress": [{"hostname": "ldap.example.com"}]}}})
+        applied = kubernetes_service.apply("ldap", service, "openldap-k8s")
+        self.assertEqual(kubernetes_service.external_address(applied), "ldap.example.com")
+        request = self.urlopen.call_args[0][0]
+        self.assertEqual(request.get_method(), "PATCH")
+        self.assertEqual(
+            request.full_url,
+            "https://10.0.0.1:443/api/v1/namespaces/ldap/services/openldap-k8s-ldap"
+            "?fieldManager=openldap-k8s&force=true",
+        )
+        self.assertEqual(request.get_header("Authorization"), "Bearer secret-token")
+        self.assertEqual(request.get_header("Content-type"), "application/apply-patch+yaml")
+        self.assertEqual(json.loads(request.data), service)
+
+    def test_api_error(self):
+        """Test errors carry the status and the message the API gave."""
+        self.urlopen.side_effect = urllib.error.HTTPError(
+            "https://10.0.0.1:443", 403, "Forbidden", {}, io.BytesIO(b'{"message": "services is forbidden"}')
+        )
+        with self.assertRaises(kubernetes_service.ApiError) as raised:
+            kubernetes_service.apply("ldap", kubernetes_service.manifest("a", "a", "ClusterIP", 389), "a")
+        self.assertEqual(raised.exception.status, 403)
+        self.assertEqual(str(raised.exception), "403 services is forbidden")
+
+    def test_delete(self):
+        """Test deleting a Service that doesn't exist succeeds."""
+        self.urlopen.side_effect = urllib.error.HTTPError(
+            "https://10.0.0.1:443", 404, "Not Found", {}, io.BytesIO(b"{}")
+        )
+        kubernetes_service.delete("ldap", "openldap-k8s-ldap")
+        self.assertEqual(self.urlopen.call_args[0][0].get_method(), "DELETE")
+
+    def test_external_address(self):
+        """Test LoadBalancer Services have no external address until the cloud gives them one."""
+        self.assertIsNone(kubernetes_service.external_address({"status": {"loadBalancer": {}}}))
+        service = {"status": {"loadBalancer": {"ingress": [{"ip": "10.1.2.3"}]}}}
+        self.assertEqual(kubernetes_service.external_address(service), "10.1.2.3")
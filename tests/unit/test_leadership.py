@@ -0,0 +1,83 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Unit tests for the Juju leadership settings backend."""
+
+import unittest
+from unittest.mock import patch
+
+from leadership import LeadershipSettings
+
+
+class TestLeadershipSettings(unittest.TestCase):
+    def setUp(self):
+        # The cache and pending writes are shared by every instance, as the backend is.
+        for name, value in (("_LeadershipSettings__cls_cache", None), ("_LeadershipSettings__cls_pending", {})):
+            patcher = patch.object(LeadershipSettings, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch("leadership.subprocess.check_output", return_value=b"admin_password: secret\n")
+        self.leader_get = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch("leadership.subprocess.check_call")
+        self.leader_set = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reads_once(self):
+        """Test every read, from every instance, is served by one leader-get."""
+        settings = LeadershipSettings()
+        self.assertEqual(settings["admin_password"], "secret")
+        self.assertEqual(settings["schema_database"], "")
+        self.assertEqual(LeadershipSettings()["admin_password"], "secret")
+        self.assertEqual(dict(settings), {"admin_password": "secret"})
+        self.leader_get.assert_called_once_with(["leader-get", "--format=yaml"])
+
+    def test_writes_batched_until_commit(self):
+        """Test writes cost no leader-set until commit(), which sets them all at once."""
+        settings = LeadershipSettings()
+        settings["schema_database"] = "1.1.1.1:5432/openldap"
+        settings["primary_address"] = "openldap-k8s-0"
+        settings["schema_database"] = "1.1.1.2:5432/openldap"
+        del settings["admin_password"]
+        self.leader_set.assert_not_called()
+
+        settings.commit()
+        self.leader_set.assert_called_once_with(
+            ["leader-set", "schema_database=1.1.1.2:5432/openldap", "primary_address=openldap-k8s-0", "admin_password="]
+        )
+
+        # Nothing left to set.
+        settings.commit()
+        self.leader_set.assert_called_once()
+        self.leader_get.assert_not_called()
+
+    def test_reads_see_pending_writes(self):
+        """Test writes are visible to reads before they are committed, whenever the settings are loaded."""
+        settings = LeadershipSettings()
+        settings["schema_database"] = "1.1.1.1:5432/openldap"
+        del settings["admin_password"]
+        self.assertEqual(settings["schema_database"], "1.1.1.1:5432/openldap")
+        self.assertEqual(settings["admin_password"], "")
+
+        settings["primary_address"] = "openldap-k8s-0"
+        self.assertEqual(
+            dict(settings), {"schema_database": "1.1.1.1:5432/openldap", "primary_address": "openldap-k8s-0"}
+        )
+        self.leader_get.assert_called_once()
+        self.leader_set.assert_not_called()
+
+    def test_invalidate(self):
+        """Test invalidate() makes the next read call leader-get again, keeping pending writes."""
+        settings = LeadershipSettings()
+        self.assertEqual(settings["admin_password"], "secret")
+        settings["primary_address"] = "openldap-k8s-0"
+
+        settings.invalidate()
+        self.leader_get.return_value = b"admin_password: changed\n"
+        self.assertEqual(settings["admin_password"], "changed")
+        self.assertEqual(settings["primary_address"], "openldap-k8s-0")
+        self.assertEqual(self.leader_get.call_count, 2)
+
+    def test_invalid_key(self):
+        with self.assertRaises(RuntimeError):
+            LeadershipSettings()["a=b"] = "c"
@@ -0,0 +1,81 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Unit tests for rendering slapd's configuration."""
+
+import base64
+import hashlib
+import unittest
+
+import slapd_config
+
+
+class TestSlapdConfig(unittest.TestCase):
+    def test_hash_password(self):
+        """Test rootpw hashes are salted SHA-1, as slappasswd makes them."""
+        password_hash = slapd_config.hash_password("badmin_password", salt=b"saltsalt")
+        self.assertTrue(password_hash.startswith("{SSHA}"))
+        decoded = base64.b64decode(password_hash.replace("{SSHA}", "", 1))
+        self.assertEqual(decoded, hashlib.sha1(b"badmin_passwordsaltsalt").digest() + b"saltsalt")
+        self.assertNotEqual(slapd_config.hash_password("badmin_password"), password_hash)
+
+    def test_tuning(self):
+        """Test threads left at 0 are worked out from the CPUs, and others kept."""
+        settings = {'SLAPD_THREADS': '0', 'SLAPD_LISTENER_THREADS': '0'}
+        self.assertEqual(slapd_config.tuning(settings, 2), {'SLAPD_THREADS': '16', 'SLAPD_LISTENER_THREADS': '1'})
+        self.assertEqual(slapd_config.tuning(settings, 16), {'SLAPD_THREADS': '64', 'SLAPD_LISTENER_THREADS': '4'})
+        self.assertEqual(slapd_config.tuning(settings, 256)['SLAPD_LISTENER_THREADS'], '16')
+        settings = {'SLAPD_THREADS': '32', 'SLAPD_LISTENER_THREADS': '2'}
+        self.assertEqual(slapd_config.tuning(settings, 16), {'SLAPD_THREADS': '32', 'SLAPD_LISTENER_THREADS': '2'})
+
+    def test_render_sql(self):
+        """Test back-sql gets slapd.conf and the ODBC driver configuration."""
+        settings = {
+            'POSTGRES_NAME': 'openldap',
+            'POSTGRES_USER': 'ldap_user',
+            'POSTGRES_PASSWORD': 'ldap_password',
+            'POSTGRES_HOST': '1.1.1.1',
+            'POSTGRES_PORT': '5432',
+            'SLAPD_ROOTPW': '{SSHA}badmin',
+            'LDAP_WRITE_REFERRAL': 'ldap://openldap-k8s-1:389',
+            'LDAP_CACHE_TEMPLATES': '(uid=) (memberUid=)',
+        }
+        files = slapd_config.render(settings, 4, "badmin_password")
+        self.assertEqual(sorted(files), [slapd_config.ODBC_INI, slapd_config.ODBCINST_INI, slapd_config.SLAPD_CONF])
+        slapd_conf = files[slapd_config.SLAPD_CONF]
+        self.assertIn("rootpw             {SSHA}badmin", slapd_conf)
+        self.assertIn('updateref          "ldap://openldap-k8s-1:389"', slapd_conf)
+        self.assertIn("pcacheTemplate     (memberUid=) 0 300", slapd_conf)
+        self.assertNotIn("badmin_password", slapd_conf)
+        self.assertNotIn("$", slapd_conf)
+        self.assertIn("1.1.1.1", files[slapd_config.ODBC_INI])
+
+    def test_render_schemas(self):
+        """Test the schemas of the default mappings' classes are included, each after those it builds on."""
+        settings = {'LDAP_BACKEND': 'mdb', 'SLAPD_ROOTPW': '{SSHA}badmin'}
+        slapd_conf = slapd_config.render(settings, 4, "badmin_password")[slapd_config.SLAPD_CONF]
+        includes = [line.split()[1] for line in slapd_conf.splitlines() if line.startswith("include ")]
+        self.assertEqual(
+            includes,
+            [
+                "/etc/openldap/schema/core.schema",
+                "/etc/openldap/schema/cosine.schema",
+                "/etc/openldap/schema/inetorgperson.schema",
+                "/etc/openldap/schema/nis.schema",
+            ],
+        )
+
+    def test_render_mdb(self):
+        """Test back-mdb replicas bind to the leader with the admin password, and need no ODBC driver."""
+        settings = {
+            'LDAP_BACKEND': 'mdb',
+            'SLAPD_ROOTPW': '{SSHA}badmin',
+            'LDAP_SYNC_PROVIDER': 'ldap://openldap-k8s-1:389',
+            'LDAP_WRITE_REFERRAL': 'ldap://openldap-k8s-1:389',
+        }
+        files = slapd_config.render(settings, 4, "badmin_password")
+        self.assertEqual(list(files), [slapd_config.SLAPD_CONF])
+        slapd_conf = files[slapd_config.SLAPD_CONF]
+        self.assertIn("provider=ldap://openldap-k8s-1:389", slapd_conf)
+        self.assertIn("credentials=badmin_password", slapd_conf)
+        self.assertIn("maxsize            10737418240", slapd_conf)
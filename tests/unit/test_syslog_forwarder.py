@@ -0,0 +1,44 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Unit tests for the syslog forwarder printing slapd's log for Pebble."""
+
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+FORWARDER = Path(__file__).parents[2] / "image-scripts" / "syslog-forwarder.py"
+
+
+class TestSyslogForwarder(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.socket_path = os.path.join(directory.name, "log")
+        self.forwarder = subprocess.Popen(
+            [sys.executable, str(FORWARDER)],
+            env={**os.environ, "SYSLOG_SOCKET": self.socket_path},
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        self.addCleanup(self.forwarder.wait)
+        self.addCleanup(self.forwarder.kill)
+        deadline = time.monotonic() + 10
+        while not os.path.exists(self.socket_path):
+            self.assertLess(time.monotonic(), deadline, "the forwarder did not listen")
+            time.sleep(0.01)
+
+    def test_prints_messages(self):
+        """Test what slapd logs with the trace profile's loglevel reaches stdout, without the syslog header."""
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.addCleanup(client.close)
+        client.connect(self.socket_path)
+        client.send(b"<167>Oct 17 09:15:02 slapd[12]: conn=1000 op=1 SRCH base=\"dc=example\" scope=2\n")
+        client.send(b"<167>Oct  7 09:15:02 slapd[12]: => backsql_search()\x00")
+        self.assertEqual(self.forwarder.stdout.readline(), 'slapd[12]: conn=1000 op=1 SRCH base="dc=example" scope=2\n')
+        self.assertEqual(self.forwarder.stdout.readline(), "slapd[12]: => backsql_search()\n")